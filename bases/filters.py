@@ -1,9 +1,51 @@
+import datetime
+
 import django_filters as filters
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+import bases.lookups  # noqa: F401 registers trigram_contains
+
+
+class DayFilter(filters.CharFilter):
+    """
+        Filter a datetime field by calendar day as a half-open range of timestamps,
+        so an index on the column can be used (created_on__date casts every row).
+        lookup_expr is exact for the day itself, gte from the day and lte up to the end of the day.
+    """
+
+    def filter(self, qs, value):
+        if value in filters.constants.EMPTY_VALUES:
+            return qs
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError(f"'{value}' is not a valid date, use YYYY-MM-DD.")
+        start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+        end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+        if self.lookup_expr == 'gte':
+            lookups = {f"{self.field_name}__gte": start}
+        elif self.lookup_expr == 'lte':
+            lookups = {f"{self.field_name}__lt": end}
+        else:
+            lookups = {f"{self.field_name}__gte": start, f"{self.field_name}__lt": end}
+        return self.get_method(qs)(**lookups)
 
 
 class BaseFilters(filters.FilterSet):
 
     order_by = filters.CharFilter(method='order_by_filter')
+    # order_by keys a client can use, each is the column list of an index and ends with a unique column,
+    # so the sort reads the index and rows have a stable order for keyset pagination
+    order_by_fields = {}
 
     def order_by_filter(self, qs, name, value):
-        return qs.order_by(value)
+        descending = value.startswith('-')
+        fields = self.order_by_fields.get(value[1:] if descending else value)
+        if fields is None:
+            allowed = ', '.join(sorted(self.order_by_fields)) or 'nothing'
+            raise ValidationError(f"'{value}' can not be used for ordering, allowed are: {allowed}.")
+        return qs.order_by(*[f"-{field}" if descending else field for field in fields])
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import models
+from django.db.models import Lookup, Q
+from django.db.models.lookups import PatternLookup
+
+
+@models.CharField.register_lookup
+class TrigramContains(PatternLookup):
+    """
+        Case insensitive substring match as a plain ILIKE on the column,
+        so it can use a gin_trgm_ops index (icontains wraps the column in UPPER).
+    """
+    lookup_name = 'trigram_contains'
+    param_pattern = '%%%s%%'
+    prepare_rhs = False
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        params.extend(rhs_params)
+        return f"{lhs_sql} ILIKE {rhs_sql}", params
+
+
+@ArrayField.register_lookup
+class AnyRangeContains(Lookup):
+    """
+        Value contained in one of the ranges of an array of ranges.
+    """
+    lookup_name = 'any_range_contains'
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return '%s', [value]
+
+    def as_sql(self, compiler, connection):
+        lhs_sql, lhs_params = self.process_lhs(compiler, connection)
+        rhs_sql, rhs_params = self.process_rhs(compiler, connection)
+        return f"{rhs_sql} <@ ANY({lhs_sql})", list(rhs_params) + list(lhs_params)
+
+
+def autocomplete(queryset, field_name, value, first=None):
+    """
+        Rows whose field contains the value or is similar to it, most similar first.
+    """
+    value = (value or '').strip()
+    if not value:
+        return queryset.none()
+    first = min(first or settings.AUTOCOMPLETE_SIZE, settings.AUTOCOMPLETE_MAX_SIZE)
+    return queryset.filter(
+        Q(**{f"{field_name}__trigram_contains": value}) | Q(**{f"{field_name}__trigram_similar": value})
+    ).annotate(
+        similarity=TrigramSimilarity(field_name, value)
+    ).order_by('-similarity', field_name)[:first]
@@ -6,6 +6,7 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
+        import chat.signals  # noqa: F401
         try:
             from chat.models import ConnectedParticipantConversation
             ConnectedParticipantConversation.objects.all().delete()
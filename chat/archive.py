@@ -0,0 +1,302 @@
+import datetime
+import gzip
+import json
+import os
+import uuid
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from chat.models import (
+    ChatMessage,
+    Conversation,
+    FavoriteMessage,
+    MessageSegment,
+    Participant,
+    ParticipantConversationState,
+)
+from chat.partitions import drop_empty_partitions
+from users.models import Client
+
+# columns of a message kept in a segment line, the conversation comes from the segment
+ARCHIVED_FIELDS = ('id', 'message_type', 'sender_id', 'message', 'sequence', 'read_on', 'delivered_on',
+                   'is_deleted', 'reply_to_id', 'file', 'created_on')
+DATE_FIELDS = ('read_on', 'delivered_on', 'created_on')
+
+
+def archive_cutoff(client, now=None):
+    """
+        Creation time before which messages of a client are archived, None when the client keeps everything.
+        Clients without archive age use the default one, an age of 0 days turns archiving off.
+    """
+    days = client.archive_after_days
+    if days is None:
+        days = settings.MESSAGE_ARCHIVE_AFTER_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) - datetime.timedelta(days=days)
+
+
+def segment_file(path):
+    return os.path.join(settings.MESSAGE_ARCHIVE_ROOT, path)
+
+
+def encode_value(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else str(value)  # dates and uuids
+
+
+def write_segment(conversation, rows):
+    """
+        Write messages of a conversation, oldest first, to a segment file and return its unsaved index row.
+    """
+    path = os.path.join(str(conversation.client_id), str(conversation.id),
+                        f"{rows[0]['sequence']:020d}-{rows[-1]['sequence']:020d}.jsonl.gz")
+    full_path = segment_file(path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with gzip.open(f"{full_path}.tmp", 'wt', encoding='utf-8') as segment:
+        for row in rows:
+            segment.write(json.dumps(row, default=encode_value) + '\n')
+    os.replace(f"{full_path}.tmp", full_path)  # readers never see a partial segment
+    return MessageSegment(
+        conversation=conversation, first_sequence=rows[0]['sequence'], last_sequence=rows[-1]['sequence'],
+        first_created_on=min(row['created_on'] for row in rows),
+        last_created_on=max(row['created_on'] for row in rows),
+        message_count=len(rows), path=path,
+    )
+
+
+def remove_segment(path):
+    try:
+        os.remove(segment_file(path))
+    except FileNotFoundError:
+        pass
+
+
+@lru_cache(maxsize=settings.MESSAGE_ARCHIVE_CACHE_SIZE)
+def read_segment(path):
+    """
+        Decoded lines of a segment file, oldest first. Segment files never change once written.
+    """
+    with gzip.open(segment_file(path), 'rt', encoding='utf-8') as segment:
+        rows = [json.loads(line) for line in segment]
+    for row in rows:
+        row['sender_id'] = uuid.UUID(row['sender_id'])
+        for name in DATE_FIELDS:
+            if row[name]:
+                row[name] = parse_datetime(row[name])
+    return tuple(rows)
+
+
+def segment_messages(segment):
+    """
+        Messages of a segment newest first, as unsaved instances.
+    """
+    messages = []
+    for row in reversed(read_segment(segment.path)):
+        message = ChatMessage(conversation_id=segment.conversation_id, **row)
+        message._state.adding = False
+        messages.append(message)
+    return messages
+
+
+def archive_conversation(conversation, cutoff):
+    """
+        Move the messages of a conversation created before a cutoff to segment files, return the archived count.
+        Every message up to the last old one goes to the segments, so history stays split on one sequence.
+        Each segment is archived in its own transaction, the conversation row is only locked while one segment
+        is written and archived_up_to advances segment by segment.
+    """
+    up_to = conversation.history().filter(
+        sequence__gt=conversation.archived_up_to, created_on__lt=cutoff
+    ).aggregate(up_to=Max('sequence'))['up_to']
+    count = 0
+    while up_to is not None:
+        archived = archive_segment(conversation, up_to)
+        if not archived:
+            break
+        count += archived
+    return count
+
+
+def archive_segment(conversation, up_to):
+    """
+        Archive the next segment of a conversation, messages after archived_up_to and up to a sequence.
+        Messages that are favorites or answered by a message after the segment are archived and also kept
+        in the table, so replies of later segments still find them, drop_empty_partitions moves them
+        out of the monthly partitions.
+    """
+    path = None
+    try:
+        with transaction.atomic():
+            conversation = Conversation.objects.select_for_update().get(id=conversation.id)
+            archived = conversation.history().filter(sequence__gt=conversation.archived_up_to, sequence__lte=up_to)
+            rows = list(archived.order_by('sequence').values(*ARCHIVED_FIELDS)[:settings.MESSAGE_ARCHIVE_SEGMENT_SIZE])
+            if not rows:
+                return 0
+            segment = write_segment(conversation, rows)
+            path = segment.path
+            segment.save()
+            answered = ChatMessage.objects.filter(reply_to=OuterRef('pk')).filter(
+                Q(sequence__gt=segment.last_sequence) | Q(favorites__isnull=False)
+            )
+            archived.filter(sequence__lte=segment.last_sequence).exclude(
+                Exists(FavoriteMessage.objects.filter(message=OuterRef('pk')))
+            ).exclude(Exists(answered)).delete()
+            conversation.archived_up_to = segment.last_sequence
+            conversation.save(update_fields=['archived_up_to'])
+    except Exception:
+        if path:
+            remove_segment(path)
+        raise
+    return len(rows)
+
+
+def archive_messages(clients=None, now=None):
+    """
+        Archive the old messages of the conversations of the clients (all by default)
+        and drop the monthly partitions left empty before the earliest cutoff.
+        Return the archived count by client and the dropped partitions.
+    """
+    now = now or timezone.now()
+    counts = {}
+    cutoffs = []
+    for client in clients if clients is not None else Client.objects.all():
+        cutoff = archive_cutoff(client, now)
+        if cutoff is None:
+            continue
+        cutoffs.append(cutoff)
+        old_messages = ChatMessage.objects.filter(
+            conversation=OuterRef('pk'), created_on__lt=cutoff, sequence__gt=OuterRef('archived_up_to')
+        )
+        conversations = Conversation.objects.filter(client=client, created_on__lt=cutoff).filter(
+            Exists(old_messages)
+        )
+        counts[client] = sum(archive_conversation(conversation, cutoff) for conversation in conversations)
+    dropped = drop_empty_partitions(min(cutoffs)) if cutoffs else []
+    return counts, dropped
+
+
+class ConversationHistory:
+    """
+        Messages of a conversation visible to a participant, the rows of the table after the archived sequence
+        and the archived segments before them.
+        Sliced like a queryset by the connection field, segments are only read for the pages that reach them.
+    """
+
+    def __init__(self, conversation, participant, messages, descending=True):
+        self.conversation = conversation
+        self.participant = participant
+        self.messages = messages.filter(sequence__gt=conversation.archived_up_to)  # visible messages of the table
+        self.descending = descending
+
+    @cached_property
+    def state(self):
+        return ParticipantConversationState.objects.filter(participant=self.participant,
+                                                           conversation=self.conversation).first()
+
+    @cached_property
+    def table_count(self):
+        return self.messages.count()
+
+    @cached_property
+    def segments(self):
+        """
+            Segments as (segment, visible message count) in history order.
+            Only segments overlapping the hidden messages of the participant are read to count them.
+        """
+        if not self.conversation.archived_up_to:
+            return []
+        cleared_up_to = self.state.cleared_up_to if self.state else 0
+        segments = []
+        for segment in self.conversation.segments.filter(last_sequence__gt=cleared_up_to):
+            count = segment.message_count
+            if self.state and (segment.first_sequence <= cleared_up_to or any(
+                    hidden.lower <= segment.last_sequence and hidden.upper > segment.first_sequence
+                    for hidden in self.state.hidden_ranges)):
+                count = len(self.visible(segment_messages(segment)))
+            segments.append((segment, count))
+        return segments if self.descending else segments[::-1]
+
+    def visible(self, messages):
+        if self.state is None:
+            return messages
+        return [message for message in messages if not self.state.hides(message.sequence)]
+
+    def __len__(self):
+        return self.table_count + sum(count for segment, count in self.segments)
+
+    def __getitem__(self, item):
+        return HistoryPage(self, item.start or 0, item.stop)
+
+    def page(self, start, stop):
+        """
+            Messages between two positions of the history.
+        """
+        parts = [(self.table_count, lambda first, last: list(self.messages[first:last]))]
+        parts += [(count, partial(self.segment_page, segment)) for segment, count in self.segments]
+        if not self.descending:
+            parts = parts[1:] + parts[:1]
+        messages = []
+        offset = 0
+        for count, read in parts:
+            if stop is not None and offset >= stop:
+                break
+            first, last = max(start - offset, 0), count if stop is None else min(stop - offset, count)
+            if first < last:
+                messages += read(first, last)
+            offset += count
+        return messages
+
+    def segment_page(self, segment, first, last):
+        messages = self.visible(segment_messages(segment))
+        if not self.descending:
+            messages.reverse()
+        messages = messages[first:last]
+        self.add_relations(messages)
+        return messages
+
+    @cached_property
+    def receipt_states(self):
+        return ParticipantConversationState.receipt_states(self.conversation.id)
+
+    def add_relations(self, messages):
+        """
+            Set what the table query gets by joins and annotations on archived messages:
+            sender, conversation, replied message and the lowest watermarks of the receivers.
+        """
+        senders = Participant.objects.in_bulk({message.sender_id for message in messages})
+        replied = {message.id: message for message in messages}
+        missing = {message.reply_to_id for message in messages if message.reply_to_id not in replied} - {None}
+        if missing:
+            replied.update(ChatMessage.objects.with_receipts().in_bulk(missing))
+        for message in messages:
+            message.conversation = self.conversation
+            message._state.fields_cache['sender'] = senders.get(message.sender_id)
+            message._state.fields_cache['reply_to'] = replied.get(message.reply_to_id)  # None once it is gone
+            message.set_receivers(self.receipt_states)
+
+
+class HistoryPage:
+    """
+        Lazy slice of a conversation history, read when the connection iterates it.
+    """
+
+    def __init__(self, history, start, stop):
+        self.history = history
+        self.start = start
+        self.stop = stop
+
+    def __getitem__(self, item):
+        start = self.start + (item.start or 0)
+        stop = self.stop if item.stop is None else self.start + item.stop
+        if self.stop is not None and stop is not None:
+            stop = min(stop, self.stop)
+        return HistoryPage(self.history, start, stop)
+
+    def __iter__(self):
+        return iter(self.history.page(self.start, self.stop))
@@ -1,9 +1,14 @@
 import uuid
 
 import channels_graphql_ws
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
+from graphql import GraphQLError, get_default_backend
+from graphql.error import format_error
 
 from chat.models import ConnectedParticipantConversation
+from mysite.persisted_queries import persisted_queries
+from mysite.query_cost import check_query_cost
 from mysite.schema import schema
 
 
@@ -12,6 +17,21 @@ def delete_connection(user, token):
                                                     connection_token=token).delete()
 
 
+def prepare_query(schema, payload, user):
+    """
+        Resolve a persisted query of a subscription and check its cost against the client budget.
+    """
+    query = persisted_queries.resolve(schema, payload.get("query"), payload.get("extensions"))
+    try:
+        document = get_default_backend().document_from_string(schema, query)
+    except Exception:
+        return query  # reported by the subscription server
+    if not getattr(document, "validation_errors", None):
+        check_query_cost(schema, document.document_ast, payload.get("operationName"), payload.get("variables"),
+                         getattr(user, "client", None))
+    return query
+
+
 class MyGraphqlWsConsumer(channels_graphql_ws.GraphqlWsConsumer):
     schema = schema
 
@@ -22,6 +42,19 @@ class MyGraphqlWsConsumer(channels_graphql_ws.GraphqlWsConsumer):
         else:
             print("[connected]... AnonymousUser")
 
+    async def receive_json(self, content):
+        if content.get("type") == "start" and isinstance(content.get("payload"), dict):
+            payload = content["payload"]
+            try:
+                payload["query"] = await sync_to_async(prepare_query)(self.schema, payload, self.scope.get("user"))
+            except GraphQLError as error:
+                await self.send_json({
+                    "type": "data", "id": content.get("id"), "payload": {"data": None, "errors": [format_error(error)]}
+                })
+                await self.send_json({"type": "complete", "id": content.get("id")})
+                return
+        await super().receive_json(content)
+
     async def disconnect(self, payload):
         await super(MyGraphqlWsConsumer, self).disconnect(payload)
         if self.scope["user"]:
@@ -1,10 +1,14 @@
 
 
 import django_filters
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
 
-from bases.filters import BaseFilters
+from bases.filters import BaseFilters, DayFilter
 
 from .models import (
+    MESSAGE_SEARCH_CONFIG,
+    ChatChange,
     ChatMessage,
     ClientOffensiveWords,
     ClientREFormats,
@@ -16,42 +20,56 @@ from .models import (
 )
 
 
+class ReceiptDayFilter(DayFilter):
+    """
+        Day filter on the delivered or read time of a message as its status shows it,
+        new messages take it from the watermarks of the receivers.
+    """
+
+    def filter(self, qs, value):
+        if value in django_filters.constants.EMPTY_VALUES:
+            return qs
+        return super().filter(qs.with_receipt_times(), value)
+
+
 class MessageFilters(BaseFilters):
     """
         Chat message Filters will define here
     """
-    conversation = django_filters.CharFilter(
-        field_name='conversation__id',
-        lookup_expr='icontains'
-    )
-    message = django_filters.CharFilter(
-        field_name='message',
-        lookup_expr='icontains'
+    conversation = django_filters.UUIDFilter(
+        field_name='conversation_id',
+        lookup_expr='exact'
     )
-    sender = django_filters.CharFilter(
-        field_name='sender__email',
-        lookup_expr='icontains'
+    message = django_filters.CharFilter(method='search_message')
+    sender = django_filters.UUIDFilter(
+        field_name='sender_id',
+        lookup_expr='exact'
     )
     message_type = django_filters.CharFilter(
         field_name='message_type',
         lookup_expr='exact'
     )
-    created_on = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='exact'
+    created_on = DayFilter(
+        field_name='created_on', lookup_expr='exact'
     )
-    delivered_on = django_filters.CharFilter(
-        field_name='delivered_on__date', lookup_expr='exact'
+    delivered_on = ReceiptDayFilter(
+        field_name='receipt_delivered_on', lookup_expr='exact'
     )
-    read_on = django_filters.CharFilter(
-        field_name='read_on__date', lookup_expr='exact'
+    read_on = ReceiptDayFilter(
+        field_name='receipt_read_on', lookup_expr='exact'
     )
-    start = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='gte'
+    start = DayFilter(
+        field_name='created_on', lookup_expr='gte'
     )
-    end = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='lte'
+    end = DayFilter(
+        field_name='created_on', lookup_expr='lte'
     )
 
+    order_by_fields = {
+        'created_on': ('created_on', 'id'),
+        'sequence': ('conversation_id', 'sequence'),
+    }
+
     class Meta:
         model = ChatMessage
         fields = [
@@ -67,32 +85,50 @@ class MessageFilters(BaseFilters):
             'end'
         ]
 
+    def search_message(self, qs, name, value):
+        """
+            Full text search on the message search vector, best matches first unless order_by is given.
+            Date separators are not searched.
+            Quoted phrases, "or" and -excluded words are supported.
+        """
+        if not value.strip():
+            return qs
+        query = SearchQuery(value, config=MESSAGE_SEARCH_CONFIG, search_type='websearch')
+        qs = qs.filter(search_vector=query, message_type=ChatMessage.MessageType.MESSAGE)
+        if self.data.get('order_by'):
+            return qs
+        return qs.annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', '-created_on')
+
 
 class ConversationFilters(BaseFilters):
     """
         Conversation filters will be defined here
     """
     client = django_filters.CharFilter(
-        field_name='client__name',
-        lookup_expr='icontains'
+        field_name='client__client_name',
+        lookup_expr='trigram_contains'
     )
     participant = django_filters.CharFilter(
         field_name='participants__user_id',
         lookup_expr='exact'
     )
-    created_on = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='exact'
+    created_on = DayFilter(
+        field_name='created_on', lookup_expr='exact'
     )
-    updated_on = django_filters.CharFilter(
-        field_name='updated_on__date', lookup_expr='exact'
+    updated_on = DayFilter(
+        field_name='updated_on', lookup_expr='exact'
     )
-    start = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='gte'
+    start = DayFilter(
+        field_name='created_on', lookup_expr='gte'
     )
-    end = django_filters.CharFilter(
-        field_name='created_on__date', lookup_expr='lte'
+    end = DayFilter(
+        field_name='created_on', lookup_expr='lte'
     )
 
+    order_by_fields = {
+        'created_on': ('created_on', 'id'),
+    }
+
     class Meta:
         model = Conversation
         fields = [
@@ -111,19 +147,23 @@ class ParticipantFilters(BaseFilters):
         Conversation filters will be defined here
     """
     client = django_filters.CharFilter(
-        field_name='client__name',
-        lookup_expr='icontains'
+        field_name='client__client_name',
+        lookup_expr='trigram_contains'
     )
     name = django_filters.CharFilter(
-        field_name='name', lookup_expr='icontains'
+        field_name='name', lookup_expr='trigram_contains'
     )
     user_id = django_filters.CharFilter(
         field_name='user_id', lookup_expr='exact'
     )
-    last_seen = django_filters.CharFilter(
-        field_name='last_seen__date', lookup_expr='exact'
+    last_seen = DayFilter(
+        field_name='last_seen', lookup_expr='exact'
     )
 
+    order_by_fields = {
+        'user_id': ('client_id', 'user_id'),
+    }
+
     class Meta:
         model = Participant
         fields = [
@@ -144,6 +184,10 @@ class OffensiveWordFilters(BaseFilters):
         lookup_expr='icontains'
     )
 
+    order_by_fields = {
+        'word': ('word',),
+    }
+
     class Meta:
         model = OffensiveWord
         fields = [
@@ -157,14 +201,18 @@ class ClientOffensiveWordFilters(BaseFilters):
         Conversation filters will be defined here
     """
     client = django_filters.CharFilter(
-        field_name='client__name',
-        lookup_expr='icontains'
+        field_name='client__client_name',
+        lookup_expr='trigram_contains'
     )
     words = django_filters.CharFilter(
         field_name='words',
         lookup_expr='icontains'
     )
 
+    order_by_fields = {
+        'id': ('id',),
+    }
+
     class Meta:
         model = ClientOffensiveWords
         fields = [
@@ -183,6 +231,10 @@ class REFormatFilters(BaseFilters):
         lookup_expr='icontains'
     )
 
+    order_by_fields = {
+        'expression': ('expression',),
+    }
+
     class Meta:
         model = REFormat
         fields = [
@@ -196,14 +248,18 @@ class ClientREFormatFilters(BaseFilters):
         Conversation filters will be defined here
     """
     client = django_filters.CharFilter(
-        field_name='client__name',
-        lookup_expr='icontains'
+        field_name='client__client_name',
+        lookup_expr='trigram_contains'
     )
     expressions = django_filters.CharFilter(
         field_name='expressions',
         lookup_expr='icontains'
     )
 
+    order_by_fields = {
+        'id': ('id',),
+    }
+
     class Meta:
         model = ClientREFormats
         fields = [
@@ -222,9 +278,40 @@ class FavoriteMessageFilters(BaseFilters):
         lookup_expr='exact'
     )
 
+    order_by_fields = {
+        'id': ('id',),  # the row id is the cursor of the favorites list
+    }
+
     class Meta:
         model = FavoriteMessage
         fields = [
             'id',
             'participant'
         ]
+
+
+class ChatChangeFilters(BaseFilters):
+    """
+        Change feed filters will be defined here
+    """
+    since = django_filters.NumberFilter(
+        field_name='position',
+        lookup_expr='gt'
+    )
+    conversation = django_filters.UUIDFilter(
+        field_name='conversation_id',
+        lookup_expr='exact'
+    )
+
+    order_by_fields = {
+        'position': ('position',),
+        'id': ('position',),  # feed order, the row id was the cursor before positions
+    }
+
+    class Meta:
+        model = ChatChange
+        fields = [
+            'since',
+            'conversation',
+            'change_type'
+        ]
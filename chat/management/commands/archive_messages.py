@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+# local imports
+from chat.archive import archive_messages
+from users.models import Client
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than the archive age of their client to compressed segment files. "
+        "Archived messages are still listed in the conversation history, "
+        "monthly partitions with every message archived are dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--client", action="append", dest="clients",
+                            help="Id of a client to archive, all clients by default. Can be repeated.")
+
+    def handle(self, *args, **options):
+        clients = Client.objects.filter(id__in=options["clients"]) if options["clients"] else None
+        counts, dropped = archive_messages(clients)
+        for client, count in counts.items():
+            self.stdout.write(f"archived  {count} messages of {client}")
+        for name in dropped:
+            self.stdout.write(f"dropped   {name}")
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# local imports
+from chat.partitions import ensure_partitions, message_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the message table from this month to some months ahead. "
+        "Run it at least monthly, messages of months without a partition go to the default partition."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ahead", type=int, default=settings.MESSAGE_PARTITION_MONTHS_AHEAD,
+                            help="Number of months after the current one to create.")
+
+    def handle(self, *args, **options):
+        if options["ahead"] < 0:
+            raise CommandError("--ahead can not be negative.")
+        for name in ensure_partitions(options["ahead"]):
+            self.stdout.write(f"created   {name}")
+        for name, month in message_partitions():
+            self.stdout.write(f"partition {name} from {month:%Y-%m-%d}")
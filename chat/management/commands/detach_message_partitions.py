@@ -0,0 +1,24 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+# local imports
+from chat.partitions import detach_partitions
+
+
+class Command(BaseCommand):
+    help = (
+        "Detach the monthly partitions of the message table before a month. "
+        "Detached tables keep their rows and can be archived or dropped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("before", help="First month to keep, as YYYY-MM.")
+
+    def handle(self, *args, **options):
+        try:
+            before = datetime.datetime.strptime(options["before"], "%Y-%m")
+        except ValueError:
+            raise CommandError("Month must be given as YYYY-MM.")
+        for name in detach_partitions(before):
+            self.stdout.write(f"detached  {name}")
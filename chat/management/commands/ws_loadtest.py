@@ -0,0 +1,359 @@
+import asyncio
+import contextlib
+import json
+import math
+import os
+import random
+import time
+import tracemalloc
+import uuid
+from collections import Counter, defaultdict
+from functools import partial
+
+import channels.layers
+import jwt
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.urls import path
+from django.utils import timezone
+
+# local imports
+from chat.consumers import MyGraphqlWsConsumer
+from chat.models import Conversation, Participant, ParticipantConversationState
+from mysite.celery import app as celery_app
+from mysite.middlewares import TokenMiddleware
+from users.models import Client, User
+
+SUBSCRIPTIONS = {
+    "message": "subscription($chatId: ID){messageSubscription(chatId: $chatId){message{message}}}",
+    "chat": "subscription{chatSubscription{conversation{objectId lastMessage{message}}}}",
+    "typing": "subscription{typingSubscription{chatId}}",
+    "inbox": "subscription{inboxSubscription{event chatId message{message}}}",
+}
+SEND_MESSAGE = "mutation($chatId: ID, $message: String){sendMessage(chatId: $chatId, message: $message){success}}"
+TYPING = "mutation($chatId: ID, $recipientId: ID){typingMutation(chatId: $chatId, recipientId: $recipientId){success}}"
+# rate limits of the generated client with --no-rate-limits
+UNLIMITED = {"client": (10 ** 9, 1), "participant": (10 ** 9, 1)}
+
+
+class LoadTestConsumer(MyGraphqlWsConsumer):
+    # confirm every subscription so the harness knows when a client is ready
+    confirm_subscriptions = True
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * pct / 100) - 1)]
+
+
+def payload_key(kind, data):
+    """
+        Return the key the sender stored the send time under,
+        or None for events that are not timed (inbox count, conversation and typing).
+    """
+    if kind == "message":
+        return ((data.get("messageSubscription") or {}).get("message") or {}).get("message")
+    if kind == "chat":
+        conversation = (data.get("chatSubscription") or {}).get("conversation") or {}
+        return (conversation.get("lastMessage") or {}).get("message")
+    if kind == "typing":
+        return None
+    event = data.get("inboxSubscription") or {}
+    return (event.get("message") or {}).get("message")
+
+
+def typing_chat(kind, data):
+    """
+        Return the chat id of a typing event, None for other events.
+        Typing payloads carry no send id, they are matched to the sends of the chat to the participant in order.
+    """
+    if kind == "typing":
+        return (data.get("typingSubscription") or {}).get("chatId")
+    event = data.get("inboxSubscription") or {}
+    if kind == "inbox" and event.get("event") == "typing":
+        return event.get("chatId")
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Start the ASGI application in process, open simulated websocket clients with a mix of "
+        "subscriptions, drive sendMessage load over HTTP and report delivery latency, "
+        "deliveries per second and memory per connection. "
+        "Mutations rejected by the rate limits are reported apart from failures, "
+        "use --no-rate-limits to measure above the limits of RATE_LIMITS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=1000, help="Number of websocket clients.")
+        parser.add_argument("--conversations", type=int, default=None,
+                            help="Number of two-participant conversations (default connections / 4).")
+        parser.add_argument("--messages", type=int, default=1000, help="Number of mutations to send.")
+        parser.add_argument("--typing-ratio", type=float, default=0.2,
+                            help="Share of mutations sent as typingMutation instead of sendMessage.")
+        parser.add_argument("--concurrency", type=int, default=10, help="Mutations in flight at once.")
+        parser.add_argument("--connect-concurrency", type=int, default=100, help="Handshakes in flight at once.")
+        parser.add_argument("--mix", default="message=5,chat=3,typing=2",
+                            help="Subscription weights, any of message, chat, typing and inbox.")
+        parser.add_argument("--redis", default=None,
+                            help="Redis url for the channel layer, the in-memory layer is used when empty.")
+        parser.add_argument("--drain", type=float, default=2.0,
+                            help="Seconds without deliveries before the run is considered finished.")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed for a repeatable run.")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated client and conversations.")
+        parser.add_argument("--no-rate-limits", action="store_true",
+                            help="Lift the rate limits of the generated client.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options["seed"])
+        self.mix = self.parse_mix(options["mix"])
+        if options["connections"] < 1 or options["messages"] < 0:
+            raise CommandError("--connections must be positive and --messages can not be negative.")
+
+        settings.DEBUG = False  # do not keep every executed query in memory
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, "loadtest.local"]
+        settings.CHANNEL_LAYERS = {"default": self.channel_layer_config(options["redis"])}
+        channels.layers.channel_layers.backends = {}
+        celery_app.conf.task_always_eager = True  # run the debounced count broadcast in process
+
+        client, conversations = self.create_fixture()
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                report = asyncio.run(self.run(client, conversations))
+        finally:
+            if not options["keep"]:
+                self.delete_fixture(client)
+        self.write_report(report)
+
+    @staticmethod
+    def parse_mix(value):
+        mix = {}
+        for item in value.split(","):
+            try:
+                kind, weight = item.split("=")
+                weight = float(weight)
+            except ValueError:
+                raise CommandError(f"Invalid mix entry '{item}', expected kind=weight.")
+            if kind not in SUBSCRIPTIONS:
+                raise CommandError(f"Unknown subscription '{kind}', choose from {', '.join(SUBSCRIPTIONS)}.")
+            mix[kind] = weight
+        if not sum(mix.values()) > 0:
+            raise CommandError("The subscription mix needs a positive weight.")
+        return mix
+
+    @staticmethod
+    def channel_layer_config(redis_url):
+        if not redis_url:
+            return {"BACKEND": "channels.layers.InMemoryChannelLayer"}
+        return {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [redis_url]}}
+
+    def create_fixture(self):
+        count = self.options["conversations"] or max(1, self.options["connections"] // 4)
+        name = f"loadtest-{uuid.uuid4().hex[:8]}"
+        with transaction.atomic():
+            admin = User.objects.create_user(name, f"{name}@loadtest.local", uuid.uuid4().hex)
+            rate_limits = None
+            if self.options["no_rate_limits"]:
+                rate_limits = {action: UNLIMITED for action in settings.RATE_LIMITS}
+            client = Client.objects.create(auth_key=uuid.uuid4().hex, admin=admin, client_name=name,
+                                           url="http://loadtest.local", rate_limits=rate_limits)
+            participants = Participant.objects.bulk_create([
+                Participant(client=client, user_id=str(i), name=f"user-{i}", last_seen=timezone.now())
+                for i in range(count * 2)
+            ])
+            conversations = Conversation.objects.bulk_create([Conversation(client=client) for _ in range(count)])
+            Conversation.participants.through.objects.bulk_create([
+                Conversation.participants.through(conversation=chat, participant=participant)
+                for i, chat in enumerate(conversations)
+                for participant in participants[i * 2:i * 2 + 2]
+            ])
+            ParticipantConversationState.objects.bulk_create([
+                ParticipantConversationState(participant=participant, conversation=chat)
+                for i, chat in enumerate(conversations)
+                for participant in participants[i * 2:i * 2 + 2]
+            ])
+        return client, [(chat, participants[i * 2:i * 2 + 2]) for i, chat in enumerate(conversations)]
+
+    @staticmethod
+    def delete_fixture(client):
+        admin = client.admin
+        Conversation.objects.filter(client=client).delete()
+        Participant.objects.filter(client=client).delete()
+        client.delete()
+        admin.delete()
+
+    @staticmethod
+    def token(client, participant):
+        return jwt.encode(
+            {"client_id": str(client.id), "user_id": participant.user_id, "username": participant.name},
+            settings.CLIENT_KEY, algorithm="HS256"
+        )
+
+    async def run(self, client, conversations):
+        application = ProtocolTypeRouter({
+            "http": get_asgi_application(),
+            "websocket": TokenMiddleware(URLRouter([path("graphql/", LoadTestConsumer.as_asgi())])),
+        })
+        self.sent_at = {}
+        self.typing_sent = defaultdict(list)  # send times by (chat, recipient) in send order
+        self.typing_locks = defaultdict(asyncio.Lock)
+        self.deliveries = {kind: [] for kind in SUBSCRIPTIONS}
+        self.delivered = 0
+        self.unmatched = 0
+        self.last_delivery = time.perf_counter()
+
+        kinds = self.random.choices(list(self.mix), weights=list(self.mix.values()), k=self.options["connections"])
+        members = [(chat, participant) for chat, participants in conversations for participant in participants]
+        semaphore = asyncio.Semaphore(self.options["connect_concurrency"])
+
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        communicators = await asyncio.gather(*[
+            self.connect(application, semaphore, client, kind, *members[i % len(members)])
+            for i, kind in enumerate(kinds)
+        ])
+        connect_seconds = time.perf_counter() - started
+        memory_used = tracemalloc.get_traced_memory()[0] - memory_before
+        tracemalloc.stop()
+
+        readers = [asyncio.ensure_future(self.read(*connection)) for connection in communicators]
+        mutation_latencies = []
+        semaphore = asyncio.Semaphore(self.options["concurrency"])
+        load_started = time.perf_counter()
+        outcomes = await asyncio.gather(*[
+            self.send(application, semaphore, client, *self.random.choice(conversations), i, mutation_latencies)
+            for i in range(self.options["messages"])
+        ])
+        while time.perf_counter() - self.last_delivery < self.options["drain"]:
+            await asyncio.sleep(0.1)
+        load_seconds = max(self.last_delivery - load_started, 1e-9)
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+        await asyncio.gather(*[communicator.disconnect() for communicator, kind, participant in communicators])
+
+        return {
+            "connections": len(communicators),
+            "connect_seconds": connect_seconds,
+            "memory_per_connection": memory_used / len(communicators),
+            "mutations": self.options["messages"],
+            "mutation_errors": outcomes.count("error"),
+            "mutations_limited": outcomes.count("limited"),
+            "mutation_latencies": mutation_latencies,
+            "load_seconds": load_seconds,
+            "delivered": self.delivered,
+            "unmatched": self.unmatched,
+            "deliveries": self.deliveries,
+        }
+
+    async def connect(self, application, semaphore, client, kind, chat, participant):
+        async with semaphore:
+            communicator = WebsocketCommunicator(
+                application, f"/graphql/?token={self.token(client, participant)}", subprotocols=["graphql-ws"]
+            )
+            connected, _ = await communicator.connect(timeout=30)
+            if not connected:
+                raise CommandError(f"Websocket connection for {participant} was refused.")
+            await communicator.send_json_to({"type": "connection_init", "payload": {}})
+            await communicator.receive_json_from(timeout=30)
+            await communicator.send_json_to({
+                "type": "start",
+                "id": "1",
+                "payload": {"query": SUBSCRIPTIONS[kind], "variables": {"chatId": str(chat.id)}},
+            })
+            confirmation = await communicator.receive_json_from(timeout=30)
+            if confirmation.get("type") != "data" or confirmation["payload"].get("errors"):
+                raise CommandError(f"Subscribing {participant} to {kind} failed: {confirmation}")
+            return communicator, kind, participant
+
+    async def read(self, communicator, kind, participant):
+        typing_received = Counter()  # typing events of this connection by chat
+        while True:
+            # no timeout, the communicator cancels the application when receive_output times out
+            output = await communicator.receive_output(timeout=None)
+            received = time.perf_counter()
+            if output.get("type") != "websocket.send":
+                continue
+            data = (json.loads(output["text"]).get("payload") or {}).get("data") or {}
+            self.delivered += 1
+            self.last_delivery = received
+            chat_id = typing_chat(kind, data)
+            if chat_id is not None:
+                sent = self.typing_sent[(chat_id, str(participant.id))]
+                index = typing_received[chat_id]
+                typing_received[chat_id] += 1
+                if index < len(sent):
+                    self.deliveries[kind].append(received - sent[index])
+                else:
+                    self.unmatched += 1
+                continue
+            key = payload_key(kind, data)
+            if key in self.sent_at:
+                self.deliveries[kind].append(received - self.sent_at[key])
+            elif key is not None:
+                self.unmatched += 1
+
+    async def send(self, application, semaphore, client, chat, participants, number, latencies):
+        sender, receiver = self.random.sample(participants, 2)
+        if self.random.random() < self.options["typing_ratio"]:
+            key = (str(chat.id), str(receiver.id))
+            body = {"query": TYPING, "variables": {"chatId": str(chat.id), "recipientId": str(receiver.id)}}
+            # one typing send in flight per chat and recipient, so its events arrive in the order of the sends
+            async with self.typing_locks[key]:
+                outcome = await self.post(application, semaphore, client, sender, body, latencies,
+                                          self.typing_sent[key].append)
+                if outcome != "ok":
+                    self.typing_sent[key].pop()  # nothing was broadcast
+                return outcome
+        key = f"loadtest {number}"
+        body = {"query": SEND_MESSAGE, "variables": {"chatId": str(chat.id), "message": key}}
+        return await self.post(application, semaphore, client, sender, body, latencies,
+                               partial(self.sent_at.__setitem__, key))
+
+    async def post(self, application, semaphore, client, sender, body, latencies, record_sent):
+        async with semaphore:
+            communicator = HttpCommunicator(
+                application, "POST", "/graphql/", body=json.dumps(body).encode(),
+                headers=[(b"host", b"loadtest.local"), (b"content-type", b"application/json"),
+                         (b"authorization", self.token(client, sender).encode())]
+            )
+            started = time.perf_counter()
+            record_sent(started)
+            response = await communicator.get_response(timeout=30)
+            self.last_delivery = max(self.last_delivery, time.perf_counter())
+            latencies.append(time.perf_counter() - started)
+        if response["status"] != 200:
+            return "error"
+        errors = json.loads(response["body"]).get("errors")
+        if not errors:
+            return "ok"
+        if all((error.get("extensions") or {}).get("code") == "rate_limited" for error in errors):
+            return "limited"
+        return "error"
+
+    def write_report(self, report):
+        def milliseconds(values):
+            return f"p50 {percentile(values, 50) * 1000:8.2f} ms | p99 {percentile(values, 99) * 1000:8.2f} ms"
+
+        latencies = [value for values in report["deliveries"].values() for value in values]
+        self.stdout.write(f"connections         {report['connections']} opened in {report['connect_seconds']:.2f}s")
+        self.stdout.write(f"memory/connection   {report['memory_per_connection'] / 1024:.1f} KiB")
+        self.stdout.write(f"mutations           {report['mutations']} ({report['mutation_errors']} failed, "
+                          f"{report['mutations_limited']} rate limited) "
+                          f"{milliseconds(report['mutation_latencies'])}")
+        self.stdout.write(f"deliveries          {report['delivered']} in {report['load_seconds']:.2f}s, "
+                          f"{report['delivered'] / report['load_seconds']:.1f}/s, "
+                          f"{report['unmatched']} without a matching send")
+        self.stdout.write(f"delivery latency    {milliseconds(latencies)}")
+        for kind, values in report["deliveries"].items():
+            if values:
+                self.stdout.write(f"  {kind:<17} {len(values):>7} {milliseconds(values)}")
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:03
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_conversation_states(apps, schema_editor):
+    Conversation = apps.get_model('chat', 'Conversation')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+    ParticipantConversationState = apps.get_model('chat', 'ParticipantConversationState')
+
+    unread = {}  # {conversation_id: {sender_id: count}}
+    for row in ChatMessage.objects.filter(read_on__isnull=True, is_deleted=False).order_by().values(
+            'conversation_id', 'sender_id').annotate(count=models.Count('id')):
+        unread.setdefault(row['conversation_id'], {})[row['sender_id']] = row['count']
+
+    states = []
+    for row in Conversation.participants.through.objects.values('conversation_id', 'participant_id').iterator():
+        senders = unread.get(row['conversation_id'], {})
+        states.append(ParticipantConversationState(
+            conversation_id=row['conversation_id'],
+            participant_id=row['participant_id'],
+            unread_count=sum(senders.values()) - senders.get(row['participant_id'], 0)
+        ))
+    ParticipantConversationState.objects.bulk_create(states, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_conversation_connected'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantConversationState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_states', to='chat.conversation')),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversation_states', to='chat.participant')),
+            ],
+            options={
+                'db_table': 'w3chat_participant_conversation_states',
+                'unique_together': {('participant', 'conversation')},
+            },
+        ),
+        migrations.RunPython(create_conversation_states, migrations.RunPython.noop),
+    ]
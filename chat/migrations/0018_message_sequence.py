@@ -0,0 +1,80 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+NUMBER_MESSAGES = """
+    UPDATE w3chat_chat_messages AS message SET sequence = numbered.sequence
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY created_on, id) AS sequence
+        FROM w3chat_chat_messages
+    ) AS numbered
+    WHERE message.id = numbered.id;
+    UPDATE w3chat_conversations AS conversation SET last_sequence = numbered.last_sequence
+    FROM (
+        SELECT conversation_id, MAX(sequence) AS last_sequence FROM w3chat_chat_messages GROUP BY conversation_id
+    ) AS numbered
+    WHERE conversation.id = numbered.conversation_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_participant_conversation_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change_type', models.CharField(choices=[('message', 'Message'), ('delivered', 'Delivered'), ('read', 'Read'), ('deleted', 'Deleted')], max_length=16)),
+                ('sequence', models.BigIntegerField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'w3chat_chat_changes',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='chatmessage',
+            name='sequence',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='last_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(NUMBER_MESSAGES, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='sequence',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddConstraint(
+            model_name='chatmessage',
+            constraint=models.UniqueConstraint(fields=('conversation', 'sequence'), name='unique_message_sequence'),
+        ),
+        migrations.AddField(
+            model_name='chatchange',
+            name='conversation',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='chat.conversation'),
+        ),
+        migrations.AddField(
+            model_name='chatchange',
+            name='message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='chat.chatmessage'),
+        ),
+        migrations.AddField(
+            model_name='chatchange',
+            name='participant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='chat.participant'),
+        ),
+        migrations.AddIndex(
+            model_name='chatchange',
+            index=models.Index(fields=['participant', 'id'], name='chat_change_feed_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:29
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+CREATE_SEARCH_TRIGGER = """
+    CREATE TRIGGER chat_message_search_update BEFORE INSERT OR UPDATE OF message ON w3chat_chat_messages
+    FOR EACH ROW EXECUTE FUNCTION tsvector_update_trigger(search_vector, 'pg_catalog.simple', message);
+    UPDATE w3chat_chat_messages SET search_vector = to_tsvector('pg_catalog.simple', message);
+"""
+
+DROP_SEARCH_TRIGGER = """
+    DROP TRIGGER IF EXISTS chat_message_search_update ON w3chat_chat_messages;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_message_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmessage',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_SEARCH_TRIGGER, DROP_SEARCH_TRIGGER),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+        ),
+    ]
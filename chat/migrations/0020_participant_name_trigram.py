@@ -0,0 +1,19 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:34
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_message_search'),
+        ('users', '0007_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participant',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['name'], name='participant_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
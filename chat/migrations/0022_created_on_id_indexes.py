@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0021_created_on_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='chatmessage',
+            name='chat_message_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='conversation',
+            name='conversation_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['created_on', 'id'], name='chat_message_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['created_on', 'id'], name='conversation_created_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:40
+
+from django.db import migrations, models
+
+SET_WATERMARKS = """
+    INSERT INTO w3chat_participant_conversation_states AS state (participant_id, conversation_id, unread_count,
+        last_read_sequence, last_read_on, last_delivered_sequence, last_delivered_on)
+    SELECT c.participant_id, c.conversation_id, 0,
+        COALESCE(MAX(m.sequence) FILTER (WHERE m.read_on IS NOT NULL), 0), MAX(m.read_on),
+        COALESCE(MAX(m.sequence) FILTER (WHERE m.delivered_on IS NOT NULL OR m.read_on IS NOT NULL), 0),
+        MAX(COALESCE(m.delivered_on, m.read_on))
+    FROM w3chat_conversations_participants c
+    JOIN w3chat_chat_messages m ON m.conversation_id = c.conversation_id AND m.sender_id <> c.participant_id
+        AND m.message_type = 'message'
+    GROUP BY c.participant_id, c.conversation_id
+    ON CONFLICT (participant_id, conversation_id) DO UPDATE SET
+        last_read_sequence = EXCLUDED.last_read_sequence, last_read_on = EXCLUDED.last_read_on,
+        last_delivered_sequence = EXCLUDED.last_delivered_sequence, last_delivered_on = EXCLUDED.last_delivered_on;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_created_on_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='last_delivered_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='last_delivered_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='last_read_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='last_read_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunSQL(SET_WATERMARKS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:44
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.fields.ranges
+from django.db import migrations, models
+
+# messages deleted for a participant become ranges of consecutive messages,
+# a range starting at the first message of the conversation becomes the cleared sequence
+SET_HIDDEN_RANGES = """
+    WITH positions AS (
+        SELECT m.id, m.conversation_id, m.sequence,
+            ROW_NUMBER() OVER (PARTITION BY m.conversation_id ORDER BY m.sequence) AS position
+        FROM w3chat_chat_messages m
+    ), islands AS (
+        SELECT d.participant_id, p.conversation_id, p.sequence, p.position,
+            p.position - ROW_NUMBER() OVER (PARTITION BY d.participant_id, p.conversation_id ORDER BY p.sequence)
+                AS island
+        FROM w3chat_chat_messages_deleted_from d JOIN positions p ON p.id = d.chatmessage_id
+    ), ranges AS (
+        SELECT participant_id, conversation_id, MIN(position) AS position,
+            MIN(sequence) AS lower, MAX(sequence) + 1 AS upper
+        FROM islands GROUP BY participant_id, conversation_id, island
+    )
+    INSERT INTO w3chat_participant_conversation_states AS state (participant_id, conversation_id, unread_count,
+        last_delivered_sequence, last_read_sequence, cleared_up_to, hidden_ranges)
+    SELECT participant_id, conversation_id, 0, 0, 0,
+        COALESCE(MAX(upper - 1) FILTER (WHERE position = 1), 0),
+        COALESCE(ARRAY_AGG(int8range(lower, upper) ORDER BY lower) FILTER (WHERE position <> 1), '{}')
+    FROM ranges GROUP BY participant_id, conversation_id
+    ON CONFLICT (participant_id, conversation_id) DO UPDATE SET
+        cleared_up_to = EXCLUDED.cleared_up_to, hidden_ranges = EXCLUDED.hidden_ranges;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0023_receipt_watermarks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='cleared_up_to',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='participantconversationstate',
+            name='hidden_ranges',
+            field=django.contrib.postgres.fields.ArrayField(base_field=django.contrib.postgres.fields.ranges.BigIntegerRangeField(), blank=True, default=list, size=None),
+        ),
+        migrations.RunSQL(SET_HIDDEN_RANGES, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='chatmessage',
+            name='deleted_from',
+        ),
+        migrations.AlterField(
+            model_name='chatchange',
+            name='change_type',
+            field=models.CharField(choices=[('message', 'Message'), ('delivered', 'Delivered'), ('read', 'Read'), ('deleted', 'Deleted'), ('cleared', 'Cleared')], max_length=16),
+        ),
+    ]
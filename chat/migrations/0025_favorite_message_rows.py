@@ -0,0 +1,58 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+# one row per favorite message instead of one row per participant with a join table
+SET_FAVORITE_ROWS = """
+    SET CONSTRAINTS ALL IMMEDIATE;  -- the table is altered after the inserts in the same transaction
+    INSERT INTO w3chat_favorite_messages (participant_id, message_id, created_on)
+    SELECT f.participant_id, t.chatmessage_id, NOW()
+    FROM w3chat_favorite_messages_messages t JOIN w3chat_favorite_messages f ON f.id = t.favoritemessage_id
+    GROUP BY f.participant_id, t.chatmessage_id
+    ORDER BY MIN(t.id);
+    DELETE FROM w3chat_favorite_messages_messages;
+    DELETE FROM w3chat_favorite_messages WHERE message_id IS NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0024_hidden_message_ranges'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favoritemessage',
+            name='created_on',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='favoritemessage',
+            name='message',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='favorites',
+                                    to='chat.chatmessage'),
+        ),
+        migrations.RunSQL(SET_FAVORITE_ROWS, migrations.RunSQL.noop),
+        migrations.RemoveField(
+            model_name='favoritemessage',
+            name='messages',
+        ),
+        migrations.AlterField(
+            model_name='favoritemessage',
+            name='message',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='favorites',
+                                    to='chat.chatmessage'),
+        ),
+        migrations.AddConstraint(
+            model_name='favoritemessage',
+            constraint=models.UniqueConstraint(fields=('participant', 'message'), name='favorite_message_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='favoritemessage',
+            index=models.Index(fields=['participant', 'id'], name='favorite_message_list_idx'),
+        ),
+    ]
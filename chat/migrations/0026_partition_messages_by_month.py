@@ -0,0 +1,104 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# the message table becomes a table range partitioned by month of created_on with a default partition,
+# months from the oldest message to three months ahead get a partition and the rows are copied over,
+# indexes, foreign keys and triggers of the old table are created again on the partitioned one,
+# it needs PostgreSQL 13 or later for the BEFORE row trigger of the search vector on a partitioned table.
+# The migration is irreversible, the rows of the old table are not copied back.
+PARTITION_MESSAGES = [
+    "SET CONSTRAINTS ALL IMMEDIATE",  # no pending foreign key checks on the tables that are dropped
+    """
+    CREATE TEMPORARY TABLE message_definitions ON COMMIT DROP AS
+    SELECT 1 AS position, indexdef AS definition FROM pg_indexes
+    WHERE schemaname = current_schema() AND tablename = 'w3chat_chat_messages'
+        AND indexname <> 'w3chat_chat_messages_pkey'
+    UNION ALL
+    SELECT 2, format('ALTER TABLE w3chat_chat_messages ADD CONSTRAINT %I %s', conname, pg_get_constraintdef(oid))
+    FROM pg_constraint WHERE conrelid = 'w3chat_chat_messages'::regclass AND contype = 'f'
+    UNION ALL
+    SELECT 3, pg_get_triggerdef(oid) FROM pg_trigger
+    WHERE tgrelid = 'w3chat_chat_messages'::regclass AND NOT tgisinternal
+    """,
+    "ALTER TABLE w3chat_chat_messages RENAME TO w3chat_chat_messages_unpartitioned",
+    "ALTER INDEX w3chat_chat_messages_pkey RENAME TO w3chat_chat_messages_unpartitioned_pkey",
+    """
+    CREATE TABLE w3chat_chat_messages (
+        LIKE w3chat_chat_messages_unpartitioned INCLUDING DEFAULTS INCLUDING STORAGE,
+        PRIMARY KEY (id, created_on)
+    ) PARTITION BY RANGE (created_on)
+    """,
+    "CREATE TABLE w3chat_chat_messages_default PARTITION OF w3chat_chat_messages DEFAULT",
+    """
+    DO $$
+    DECLARE
+        month timestamp := date_trunc('month', COALESCE(
+            (SELECT MIN(created_on) FROM w3chat_chat_messages_unpartitioned), now()
+        ) AT TIME ZONE 'UTC');
+    BEGIN
+        WHILE month <= date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months' LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF w3chat_chat_messages FOR VALUES FROM (%L) TO (%L)',
+                'w3chat_chat_messages_p' || to_char(month, 'YYYYMM'),
+                month AT TIME ZONE 'UTC', (month + interval '1 month') AT TIME ZONE 'UTC'
+            );
+            month := month + interval '1 month';
+        END LOOP;
+    END $$
+    """,
+    "INSERT INTO w3chat_chat_messages SELECT * FROM w3chat_chat_messages_unpartitioned",
+    """
+    DO $$
+    BEGIN
+        EXECUTE format('ALTER SEQUENCE %s OWNED BY w3chat_chat_messages.id',
+                       pg_get_serial_sequence('w3chat_chat_messages_unpartitioned', 'id'));
+    END $$
+    """,
+    "DROP TABLE w3chat_chat_messages_unpartitioned",
+    """
+    DO $$
+    DECLARE
+        statement text;
+    BEGIN
+        FOR statement IN SELECT definition FROM message_definitions ORDER BY position LOOP
+            EXECUTE statement;
+        END LOOP;
+    END $$
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0025_favorite_message_rows'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='chatmessage',
+            name='unique_message_sequence',
+        ),
+        migrations.AlterField(
+            model_name='chatchange',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='chat.chatmessage'),
+        ),
+        migrations.AlterField(
+            model_name='chatmessage',
+            name='reply_to',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='reply_for', to='chat.chatmessage'),
+        ),
+        migrations.AlterField(
+            model_name='favoritemessage',
+            name='message',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='favorites', to='chat.chatmessage'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['conversation', 'sequence'], name='chat_message_sequence_idx'),
+        ),
+        migrations.RunSQL(PARTITION_MESSAGES),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0026_partition_messages_by_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archived_up_to',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='MessageSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_sequence', models.BigIntegerField()),
+                ('last_sequence', models.BigIntegerField()),
+                ('first_created_on', models.DateTimeField()),
+                ('last_created_on', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('path', models.CharField(max_length=255)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='chat.conversation')),
+            ],
+            options={
+                'db_table': 'w3chat_message_segments',
+                'ordering': ['-last_sequence'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='messagesegment',
+            index=models.Index(fields=['conversation', 'last_sequence'], name='message_segment_idx'),
+        ),
+    ]
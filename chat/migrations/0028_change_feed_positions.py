@@ -0,0 +1,55 @@
+# Generated by Django 3.2.7 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+NUMBER_CHANGES = """
+    UPDATE w3chat_chat_changes AS change SET position = numbered.position
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY participant_id ORDER BY id) AS position
+        FROM w3chat_chat_changes
+    ) AS numbered
+    WHERE change.id = numbered.id;
+    UPDATE w3chat_participants AS participant SET last_change = numbered.last_change
+    FROM (
+        SELECT participant_id, MAX(position) AS last_change FROM w3chat_chat_changes GROUP BY participant_id
+    ) AS numbered
+    WHERE participant.id = numbered.participant_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0027_message_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='last_change',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatchange',
+            name='position',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.RunSQL(NUMBER_CHANGES, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='chatchange',
+            name='position',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterModelOptions(
+            name='chatchange',
+            options={'ordering': ['position']},
+        ),
+        migrations.RemoveIndex(
+            model_name='chatchange',
+            name='chat_change_feed_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='chatchange',
+            constraint=models.UniqueConstraint(fields=('participant', 'position'), name='chat_change_feed_position'),
+        ),
+    ]
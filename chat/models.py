@@ -3,17 +3,38 @@ import uuid
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.postgres.fields import ArrayField, BigIntegerRangeField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import (
+    Case,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
 from django.utils import timezone
+from django.utils.functional import cached_property
+from psycopg2.extras import NumericRange
 
+import bases.lookups  # noqa: F401 registers any_range_contains
 from bases.models import BaseModel
 from chat.choices import RegexChoice
+from mysite.auth_cache import get_client_config, set_client_config
 
 # define local imports
 from users.models import Client
 
 User = get_user_model()  # define user model
 
+MESSAGE_SEARCH_CONFIG = 'simple'  # text search configuration of the message search trigger
+
 
 class Participant(models.Model):
     id = models.UUIDField(
@@ -26,6 +47,7 @@ class Participant(models.Model):
     user_id = models.CharField(max_length=128)  # will provided from client-app
     photo = models.TextField(blank=True, null=True)
     last_seen = models.DateTimeField(auto_now=True)
+    last_change = models.BigIntegerField(default=0)  # last position given to a change of the feed
     # is_online = models.BooleanField(default=False)
     # count_connection = models.PositiveIntegerField(default=0)
 
@@ -35,16 +57,40 @@ class Participant(models.Model):
 
     @property
     def unread_count(self):
-        return len(ChatMessage.objects.filter(
-            read_on__isnull=True, conversation__participants=self, is_deleted=False
-        ).exclude(sender=self))
+        return self.conversation_states.aggregate(total=Sum('unread_count'))['total'] or 0
 
     def __str__(self):
         return f"{self.name} : {self.is_online}"
 
+    @classmethod
+    def upsert(cls, client, user_id, name):
+        """
+            Return the participant of a client user, creating it when missing.
+            Insert and lookup run as one statement and an existing row is not written.
+        """
+        table = cls._meta.db_table
+        query = (
+            f"WITH inserted AS ("
+            f"INSERT INTO {table} (id, client_id, name, user_id, last_seen, last_change) "
+            f"VALUES (%s, %s, %s, %s, %s, 0) "
+            f"ON CONFLICT (client_id, user_id) DO NOTHING RETURNING *) "
+            f"SELECT * FROM inserted UNION ALL SELECT * FROM {table} WHERE client_id = %s AND user_id = %s"
+        )
+        for _ in range(2):  # retry once if a concurrent insert was committed after the snapshot
+            participants = list(cls.objects.raw(
+                query, [uuid.uuid4(), client.id, name, str(user_id), timezone.now(), client.id, str(user_id)]
+            ))
+            if participants:
+                participants[0].client = client
+                return participants[0]
+        raise cls.DoesNotExist
+
     class Meta:
         db_table = f"{settings.DB_PREFIX}_participants"  # define table name for database
         unique_together = (('client', 'user_id'),)  # unique user of client
+        indexes = [
+            GinIndex(fields=['name'], name='participant_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]  # substring and similarity search of participant names
 
 
 class ConnectedParticipantConversation(models.Model):
@@ -55,6 +101,194 @@ class ConnectedParticipantConversation(models.Model):
     connection_token = models.UUIDField()
 
 
+class ParticipantConversationState(models.Model):
+    """
+        Store per participant state of a conversation.
+        Unread counter is maintained by the write path, so counts are read instead of recomputed.
+        Delivered and read watermarks are the sequence of the last message of the other participants
+        that reached and was seen by the participant, every message up to it has that status.
+        Messages the participant deleted for himself are hidden up to a cleared sequence
+        and in sparse ranges of sequences after it.
+    """
+    participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='conversation_states')
+    conversation = models.ForeignKey('chat.Conversation', on_delete=models.CASCADE,
+                                     related_name='participant_states')
+    unread_count = models.PositiveIntegerField(default=0)  # unread messages sent by other participants
+    last_delivered_sequence = models.BigIntegerField(default=0)
+    last_delivered_on = models.DateTimeField(blank=True, null=True)  # time the delivered watermark moved
+    last_read_sequence = models.BigIntegerField(default=0)
+    last_read_on = models.DateTimeField(blank=True, null=True)  # time the read watermark moved
+    cleared_up_to = models.BigIntegerField(default=0)  # messages up to this sequence are hidden
+    hidden_ranges = ArrayField(BigIntegerRangeField(), default=list, blank=True)  # hidden sequences after it
+
+    class Meta:
+        db_table = f"{settings.DB_PREFIX}_participant_conversation_states"  # define table name for database
+        unique_together = (('participant', 'conversation'),)  # one state per participant of a conversation
+
+    @classmethod
+    def increment_unread(cls, participant, conversation, count=1):
+        updated = cls.objects.filter(participant=participant, conversation=conversation).update(
+            unread_count=F('unread_count') + count
+        )
+        if not updated:
+            cls.objects.get_or_create(participant=participant, conversation=conversation,
+                                      defaults={'unread_count': count})
+
+    @classmethod
+    def decrement_unread(cls, participant, conversation, count=1):
+        cls.objects.filter(participant=participant, conversation=conversation).update(
+            unread_count=Greatest(F('unread_count') - count, 0)
+        )
+
+    @classmethod
+    def reset_unread(cls, participant, conversation):
+        cls.objects.filter(participant=participant, conversation=conversation).update(unread_count=0)
+
+    def visible(self):
+        """
+            Condition on the sequence of the messages that are not hidden from the participant.
+        """
+        condition = Q(sequence__gt=self.cleared_up_to)
+        for hidden in self.hidden_ranges:
+            condition &= ~Q(sequence__gte=hidden.lower, sequence__lt=hidden.upper)
+        return condition
+
+    def hides(self, sequence):
+        return sequence <= self.cleared_up_to or any(sequence in hidden for hidden in self.hidden_ranges)
+
+    @classmethod
+    def receipt_states(cls, conversation_id):
+        """
+            (participant id, delivered sequence and time, read sequence and time) of the participants of a conversation.
+        """
+        return list(cls.objects.filter(conversation_id=conversation_id).values_list(
+            'participant_id', 'last_delivered_sequence', 'last_delivered_on', 'last_read_sequence', 'last_read_on'
+        ))
+
+    @classmethod
+    def hide(cls, participant, conversation, sequences):
+        """
+            Hide messages of a conversation from a participant.
+            Hidden messages are stored as ranges of consecutive messages,
+            a range starting at the first visible message moves the cleared sequence instead.
+            Archived messages are not in the table, their ranges are kept as given and only joined when they touch.
+        """
+        with transaction.atomic():
+            state, created = cls.objects.select_for_update().get_or_create(participant=participant,
+                                                                           conversation=conversation)
+            ranges = [(hidden.lower, hidden.upper) for hidden in state.hidden_ranges]
+            ranges += [(sequence, sequence + 1) for sequence in sequences if sequence > state.cleared_up_to]
+            if not ranges:
+                return state
+            archived = []
+            for lower, upper in sorted((lower, min(upper, conversation.archived_up_to + 1)) for lower, upper in ranges
+                                       if lower <= conversation.archived_up_to):
+                if archived and lower <= archived[-1][1]:
+                    archived[-1] = (archived[-1][0], max(archived[-1][1], upper))
+                else:
+                    archived.append((lower, upper))
+            query = f"""
+                WITH messages AS (
+                    SELECT m.sequence, ROW_NUMBER() OVER (ORDER BY m.sequence) AS position,
+                        EXISTS (SELECT 1 FROM unnest(%(lowers)s::bigint[], %(uppers)s::bigint[]) AS r(lower, upper)
+                                WHERE m.sequence >= r.lower AND m.sequence < r.upper) AS hidden
+                    FROM {ChatMessage._meta.db_table} m
+                    WHERE m.conversation_id = %(conversation)s AND m.created_on >= %(since)s
+                        AND m.sequence > %(cleared)s AND m.sequence < %(end)s
+                )
+                SELECT MIN(sequence), MAX(sequence), MIN(position) FROM (
+                    SELECT sequence, position, position - ROW_NUMBER() OVER (ORDER BY sequence) AS island
+                    FROM messages WHERE hidden
+                ) hidden_messages GROUP BY island ORDER BY 1
+            """
+            params = {
+                'lowers': [lower for lower, upper in ranges], 'uppers': [upper for lower, upper in ranges],
+                'conversation': conversation.id, 'since': conversation.created_on,
+                'cleared': max(state.cleared_up_to, conversation.archived_up_to),
+                'end': max(upper for lower, upper in ranges),
+            }
+            with connection.cursor() as cursor:
+                cursor.execute(query, params)
+                islands = cursor.fetchall()
+            if islands and islands[0][2] == 1 and state.cleared_up_to >= conversation.archived_up_to:
+                state.cleared_up_to = islands.pop(0)[1]
+            state.hidden_ranges = [NumericRange(lower, upper) for lower, upper in archived]
+            state.hidden_ranges += [NumericRange(lower, upper + 1) for lower, upper, position in islands]
+            state.save(update_fields=['cleared_up_to', 'hidden_ranges'])
+        return state
+
+    @classmethod
+    def clear(cls, participant, conversation, up_to_sequence):
+        """
+            Hide every message of a conversation up to a sequence from a participant,
+            hidden messages are not counted as unread.
+        """
+        updated = cls.objects.filter(participant=participant, conversation=conversation).update(
+            cleared_up_to=Greatest(F('cleared_up_to'), up_to_sequence), hidden_ranges=[], unread_count=0
+        )
+        if not updated:
+            cls.objects.get_or_create(participant=participant, conversation=conversation,
+                                      defaults={'cleared_up_to': up_to_sequence})
+
+    @classmethod
+    def advance(cls, participant_id, read=False, conversation_id=None, up_to_sequence=None):
+        """
+            Move the delivered watermark of a participant, and the read watermark when read,
+            to the last message the other participants sent (up to a sequence),
+            in one conversation or in all conversations of the participant, with one statement.
+            Moving the read watermark also recounts the unread messages after it.
+            Return (conversation_id, previous sequence, sequence) of the moved watermarks.
+        """
+        column = 'last_read_sequence' if read else 'last_delivered_sequence'
+        messages = ChatMessage._meta.db_table
+        received = (
+            f"FROM {messages} m WHERE m.conversation_id = c.conversation_id AND m.created_on >= conversation.created_on "
+            f"AND m.sender_id <> %(participant)s AND m.message_type = 'message' AND NOT m.is_deleted"
+        )
+        target = f"SELECT MAX(m.sequence) {received}"
+        if up_to_sequence is not None:
+            target += " AND m.sequence <= %(up_to)s"
+        unread = f"SELECT COUNT(*) {received} AND m.sequence > ({target})" if read else "0"
+        conversations = "WHERE c.participant_id = %(participant)s"
+        if conversation_id is not None:
+            conversations += " AND c.conversation_id = %(conversation)s"
+        read_columns = (
+            "last_read_sequence = EXCLUDED.last_read_sequence, last_read_on = EXCLUDED.last_read_on, "
+            "unread_count = EXCLUDED.unread_count, "
+        ) if read else ""
+        query = f"""
+            WITH target AS (
+                SELECT c.conversation_id, ({target}) AS sequence, ({unread}) AS unread
+                FROM {Conversation.participants.through._meta.db_table} c
+                JOIN {Conversation._meta.db_table} conversation ON conversation.id = c.conversation_id {conversations}
+            ), previous AS (
+                SELECT conversation_id, {column} AS sequence FROM {cls._meta.db_table}
+                WHERE participant_id = %(participant)s
+            )
+            INSERT INTO {cls._meta.db_table} AS state (participant_id, conversation_id, unread_count,
+                last_read_sequence, last_read_on, last_delivered_sequence, last_delivered_on,
+                cleared_up_to, hidden_ranges)
+            SELECT %(participant)s, target.conversation_id, target.unread,
+                {'target.sequence, %(now)s' if read else '0, NULL'}, target.sequence, %(now)s, 0, '{{}}'
+            FROM target WHERE target.sequence IS NOT NULL
+            ON CONFLICT (participant_id, conversation_id) DO UPDATE SET {read_columns}
+                last_delivered_on = CASE WHEN state.last_delivered_sequence < EXCLUDED.last_delivered_sequence
+                    THEN EXCLUDED.last_delivered_on ELSE state.last_delivered_on END,
+                last_delivered_sequence = GREATEST(state.last_delivered_sequence, EXCLUDED.last_delivered_sequence)
+            WHERE state.{column} < EXCLUDED.{column}
+            RETURNING state.conversation_id,
+                COALESCE((SELECT sequence FROM previous WHERE previous.conversation_id = state.conversation_id), 0),
+                state.{column}
+        """
+        params = {
+            'participant': participant_id, 'conversation': conversation_id, 'up_to': up_to_sequence,
+            'now': timezone.now(),
+        }
+        with connection.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+
 class Conversation(BaseModel):
     client = models.ForeignKey(Client, on_delete=models.DO_NOTHING)  # client-info
     friendly_name = models.CharField(max_length=128, blank=True, null=True)
@@ -63,28 +297,174 @@ class Conversation(BaseModel):
     connected = models.ManyToManyField(Participant, related_name="connected_users",
                                        through=ConnectedParticipantConversation)
     is_blocked = models.BooleanField(default=False)
+    last_sequence = models.BigIntegerField(default=0)  # last sequence given to a message or change
+    archived_up_to = models.BigIntegerField(default=0)  # messages up to this sequence are read from segments
 
     def __str__(self):
         return str(self.id)
 
+    def next_sequences(self, count=1):
+        """
+            Reserve the next gap-free sequence numbers of the conversation.
+            The row stays locked until the surrounding transaction commits.
+            The partitioned message table can not have a unique (conversation, sequence) key,
+            so the reservation fails when a message already uses one of the reserved sequences.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Conversation._meta.db_table} conversation SET last_sequence = last_sequence + %s "
+                f"WHERE id = %s RETURNING last_sequence, EXISTS (SELECT 1 FROM {ChatMessage._meta.db_table} message "
+                f"WHERE message.conversation_id = conversation.id AND message.sequence > last_sequence - %s)",
+                [count, self.id, count]
+            )
+            self.last_sequence, used = cursor.fetchone()
+        if used:
+            raise IntegrityError(f"sequences after {self.last_sequence - count} of conversation {self.id} are used")
+        return list(range(self.last_sequence - count + 1, self.last_sequence + 1))
+
+    def add_message(self, **kwargs):
+        """
+            Create a message with the next sequence of the conversation
+            and add it to the change feed of the participants.
+        """
+        with transaction.atomic():
+            sequence, = self.next_sequences()
+            message = ChatMessage.objects.create(conversation=self, sequence=sequence, **kwargs)
+            ChatChange.record(self, ChatChange.ChangeType.MESSAGE, [message])
+        return message
+
+    def mark_read(self, participant, up_to_sequence=None):
+        """
+            Move the read watermark of a participant to the last message of the others (up to a sequence)
+            and add the last read message to the change feed, every message up to it is read.
+            Return the previous and the new watermark, None when there was nothing to read.
+        """
+        with transaction.atomic():
+            moved = ParticipantConversationState.advance(participant.id, read=True, conversation_id=self.id,
+                                                         up_to_sequence=up_to_sequence)
+            if not moved:
+                return None
+            conversation_id, previous, read_up_to = moved[0]
+            self.record_receipt(ChatChange.ChangeType.READ, read_up_to)
+        return previous, read_up_to
+
+    def record_receipt(self, change_type, sequence):
+        """
+            Add the message at a watermark to the change feed, the change covers every message up to it.
+        """
+        message_id = self.history().filter(sequence=sequence).values_list('id', flat=True).first()
+        if message_id:
+            ChatChange.record(self, change_type, [ChatMessage(id=message_id)])
+
+    def received_messages(self, participant, after, up_to):
+        """
+            Messages of the other participants between two watermarks.
+        """
+        return self.history().filter(
+            sequence__gt=after, sequence__lte=up_to, message_type=ChatMessage.MessageType.MESSAGE, is_deleted=False
+        ).exclude(sender=participant)
+
+    def history(self):
+        """
+            Messages of the conversation, bounded by its creation time
+            so the monthly partitions of older messages are skipped.
+        """
+        return ChatMessage.objects.filter(conversation=self, created_on__gte=self.created_on)
+
     @property
     def last_message(self):
-        return self.messages.first()
+        return self.history().with_receipts().first()
 
     def opposite_user(self, participant):
         return self.participants.exclude(id=participant.id).last()
 
     def unread_count(self, participant):
-        return len(self.messages.filter(read_on__isnull=True, is_deleted=False).exclude(sender=participant))
+        return self.participant_states.filter(participant=participant).values_list(
+            'unread_count', flat=True
+        ).first() or 0
 
     class Meta:
         ordering = ['-created_on']  # define default order as created in descending
         db_table = f"{settings.DB_PREFIX}_conversations"  # define table name for database
+        indexes = [
+            models.Index(fields=['created_on', 'id'], name='conversation_created_idx'),  # date ranges and ordering
+        ]
+
+
+class ChatMessageQuerySet(models.QuerySet):
+
+    def visible_to(self, participant, conversation=None):
+        """
+            Messages not hidden from a participant.
+            With a conversation the hidden state is read once and applied as sequence ranges.
+        """
+        if conversation is not None:
+            state = ParticipantConversationState.objects.filter(participant=participant,
+                                                                conversation=conversation).first()
+            return self.filter(state.visible()) if state else self
+        hidden = ParticipantConversationState.objects.filter(
+            participant=participant, conversation=OuterRef('conversation')
+        ).filter(Q(cleared_up_to__gte=OuterRef('sequence')) | Q(hidden_ranges__any_range_contains=OuterRef('sequence')))
+        return self.filter(~Exists(hidden))
+
+    def favorites_of(self, participant, before=None):
+        """
+            Favorite messages of a participant newest first, deleted and hidden messages left out.
+            Pass the favorite id of the last message of a page to get the next one.
+        """
+        conditions = {'favorites__participant': participant}
+        if before:
+            conditions['favorites__id__lt'] = before  # same join as the participant condition
+        return self.filter(is_deleted=False, **conditions).visible_to(participant).annotate(
+            favorite_id=F('favorites__id')
+        ).order_by('-favorite_id')
+
+    def with_receipts(self):
+        """
+            Annotate the lowest delivered and read watermarks of the receivers,
+            so status of a page of messages is derived without a query per message.
+        """
+        states = ParticipantConversationState.objects.filter(
+            conversation=OuterRef('conversation')
+        ).exclude(participant=OuterRef('sender'))
+        delivered = states.order_by('last_delivered_sequence')
+        read = states.order_by('last_read_sequence')
+        return self.annotate(
+            receiver_delivered_sequence=Subquery(delivered.values('last_delivered_sequence')[:1]),
+            receiver_delivered_on=Subquery(delivered.values('last_delivered_on')[:1]),
+            receiver_read_sequence=Subquery(read.values('last_read_sequence')[:1]),
+            receiver_read_on=Subquery(read.values('last_read_on')[:1]),
+        )
+
+    def with_receipt_times(self):
+        """
+            Annotate the delivered and read times the status of a message is derived from,
+            the column of older messages or the watermark time of the receivers, so they can be filtered on.
+        """
+        queryset = self if 'receiver_read_sequence' in self.query.annotations else self.with_receipts()
+        covered = Q(message_type=ChatMessage.MessageType.MESSAGE)  # watermarks only cover messages
+        read_on = Coalesce('read_on', Case(
+            When(covered & Q(receiver_read_sequence__gte=F('sequence')), then=F('receiver_read_on'))
+        ))
+        delivered_on = Case(
+            When(covered, then=Coalesce('delivered_on', Case(
+                When(receiver_delivered_sequence__gte=F('sequence'), then=F('receiver_delivered_on'))
+            ), read_on)),
+            default=F('delivered_on'),
+        )
+        return queryset.annotate(receipt_read_on=read_on, receipt_delivered_on=delivered_on)
 
 
 class ChatMessage(models.Model):
     """
         Store message of users for a conversation.
+        Delivery and read times of new messages come from the watermarks of the receivers,
+        read_on and delivered_on are only set on older messages and date separators.
+        The table is range partitioned by month of created_on, primary key of the table is (id, created_on).
+        Unique keys must contain created_on, so sequences are unique by the conversation row lock that gives them,
+        checked by Conversation.next_sequences, and other tables refer to messages without a foreign key constraint.
+        Django only knows id as the primary key, lookups by id alone probe the index of every partition,
+        so updates of saved messages also filter on created_on to reach their partition.
     """
     class MessageType(models.TextChoices):
         MESSAGE = 'message'
@@ -95,11 +475,12 @@ class ChatMessage(models.Model):
     sender = models.ForeignKey(Participant, on_delete=models.DO_NOTHING,
                                related_name='sent_messages')  # define sender of the message
     message = models.TextField()  # define message body
+    sequence = models.BigIntegerField()  # gap-free order of the message in the conversation
     read_on = models.DateTimeField(blank=True, null=True)  # time of message seen
     delivered_on = models.DateTimeField(blank=True, null=True)  # time of message delivery
     is_deleted = models.BooleanField(default=False)  # if sender want to remove the message
-    deleted_from = models.ManyToManyField(Participant)
-    reply_to = models.ForeignKey('self', on_delete=models.DO_NOTHING, related_name="reply_for", null=True)
+    reply_to = models.ForeignKey('self', on_delete=models.DO_NOTHING, related_name="reply_for", null=True,
+                                 db_constraint=False)
     file = models.FileField(
         upload_to="conversation/",
         blank=True,
@@ -110,39 +491,215 @@ class ChatMessage(models.Model):
     created_on = models.DateTimeField(
         auto_now_add=True
     )  # object creation time. will automatic generate
+    search_vector = SearchVectorField(null=True, editable=False)  # set from message by a database trigger
+
+    objects = ChatMessageQuerySet.as_manager()
 
     class Meta:
         db_table = f"{settings.DB_PREFIX}_chat_messages"  # define table name for database
         verbose_name = "Message"
         ordering = ['-created_on']  # define default order as created in descending
         get_latest_by = "created_on"  # define latest queryset by created
+        indexes = [
+            models.Index(fields=['conversation', 'sequence'], name='chat_message_sequence_idx'),
+            GinIndex(fields=['search_vector'], name='chat_message_search_idx'),
+            models.Index(fields=['created_on', 'id'], name='chat_message_created_idx'),  # date ranges and ordering
+        ]
+
+    def save(self, *args, **kwargs):
+        """
+            Messages created without Conversation.add_message (admin, shell) get the next sequence here,
+            they are not added to the change feed.
+        """
+        if self.sequence is not None:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            self.sequence, = self.conversation.next_sequences()
+            return super().save(*args, **kwargs)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if self.created_on is not None:
+            base_qs = base_qs.filter(created_on=self.created_on)  # partition key, the update scans one partition
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
 
     @property
     def receiver(self):
         return self.conversation.participants.exclude(id=self.sender.id).last()
 
     def is_favorite(self, user):
-        user_fav, created = FavoriteMessage.objects.get_or_create(participant=user)
-        if user_fav.messages.filter(id=self.id):
-            return True
-        return False
+        if getattr(self, 'favorite_id', None):
+            return True  # listed from the favorites of the user
+        return FavoriteMessage.objects.filter(participant=user, message=self).exists()
+
+    def set_receivers(self, states):
+        """
+            Set what with_receipts annotates from the receipt states of the conversation:
+            the lowest watermarks of the receivers.
+        """
+        receivers = [state for state in states if state[0] != self.sender_id]
+        delivered = min(receivers, key=lambda state: state[1], default=None)
+        read = min(receivers, key=lambda state: state[3], default=None)
+        self.receiver_delivered_sequence = delivered and delivered[1]
+        self.receiver_delivered_on = delivered and delivered[2]
+        self.receiver_read_sequence = read and read[3]
+        self.receiver_read_on = read and read[4]
+
+    @cached_property
+    def receipt(self):
+        """
+            (delivered time, read time) of the message for the receivers.
+        """
+        if self.message_type != ChatMessage.MessageType.MESSAGE:
+            return self.delivered_on, self.read_on  # watermarks only cover messages
+        if not hasattr(self, 'receiver_read_sequence'):
+            self.set_receivers(ParticipantConversationState.receipt_states(self.conversation_id))  # not annotated
+        delivered = (self.receiver_delivered_sequence, self.receiver_delivered_on)
+        read = (self.receiver_read_sequence, self.receiver_read_on)
+        read_on = self.read_on
+        if read_on is None and read and read[0] is not None and read[0] >= self.sequence:
+            read_on = read[1]
+        delivered_on = self.delivered_on
+        if delivered_on is None and delivered and delivered[0] is not None and delivered[0] >= self.sequence:
+            delivered_on = delivered[1]
+        return delivered_on or read_on, read_on
 
     @property
     def status(self):
-        if self.read_on:
+        delivered_on, read_on = self.receipt
+        if read_on:
             return "seen"
-        elif not self.read_on and self.delivered_on:
+        elif delivered_on:
             return "delivered"
         return "sent"
 
 
+class ChatChange(models.Model):
+    """
+        Change feed of a participant.
+        Every change carries the sequence of its conversation and a position in the feed of its participant,
+        the position is the cursor clients use to fetch changes after a reconnect.
+        Positions are given under a lock of the participant row held until commit, so they commit in order
+        and a change never appears behind a cursor a client already read (row ids are given before commit).
+        Delivered, read and cleared changes point at the last message of a watermark
+        and cover every message before it.
+    """
+    class ChangeType(models.TextChoices):
+        MESSAGE = 'message'
+        DELIVERED = 'delivered'
+        READ = 'read'
+        DELETED = 'deleted'
+        CLEARED = 'cleared'
+    participant = models.ForeignKey(Participant, on_delete=models.CASCADE,
+                                    related_name='changes')  # define owner of the feed
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='changes')
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='changes', db_constraint=False)
+    change_type = models.CharField(max_length=16, choices=ChangeType.choices)
+    sequence = models.BigIntegerField()  # sequence of the change in the conversation
+    position = models.BigIntegerField()  # gap-free order of the change in the feed of the participant
+    created_on = models.DateTimeField(
+        auto_now_add=True
+    )  # object creation time. will automatic generate
+
+    class Meta:
+        db_table = f"{settings.DB_PREFIX}_chat_changes"  # define table name for database
+        ordering = ['position']  # define default order as feed order
+        constraints = [
+            models.UniqueConstraint(fields=['participant', 'position'], name='chat_change_feed_position'),
+        ]
+
+    @staticmethod
+    def next_positions(participants, count):
+        """
+            Reserve the next feed positions of participants, return the first one by participant id.
+            Rows are locked in id order, so concurrent writers to the same feeds do not deadlock.
+        """
+        ids = sorted(participant.id for participant in participants)
+        table = Participant._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {table} WHERE id = ANY(%s) ORDER BY id FOR UPDATE", [ids])
+            cursor.execute(
+                f"UPDATE {table} SET last_change = last_change + %s WHERE id = ANY(%s) RETURNING id, last_change",
+                [count, ids]
+            )
+            return {participant_id: last_change - count + 1 for participant_id, last_change in cursor.fetchall()}
+
+    @classmethod
+    def record(cls, conversation, change_type, messages, participants=None):
+        """
+            Add message changes to the feed of the participants.
+            New messages keep their own sequence, other changes reserve the next ones.
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        if participants is None:
+            participants = list(conversation.participants.all())
+        with transaction.atomic():
+            if change_type == cls.ChangeType.MESSAGE:
+                sequences = [message.sequence for message in messages]
+            else:
+                sequences = conversation.next_sequences(len(messages))
+            positions = cls.next_positions(participants, len(messages))
+            changes = cls.objects.bulk_create([
+                cls(participant=participant, conversation=conversation, message=message,
+                    change_type=change_type, sequence=sequence, position=positions[participant.id] + index)
+                for index, (message, sequence) in enumerate(zip(messages, sequences)) for participant in participants
+            ])
+        return changes
+
+
+class MessageSegment(models.Model):
+    """
+        Index of a compressed file of archived messages of a conversation.
+        A segment holds every message between its first and last sequence, path is relative to MESSAGE_ARCHIVE_ROOT.
+    """
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='segments')
+    first_sequence = models.BigIntegerField()
+    last_sequence = models.BigIntegerField()
+    first_created_on = models.DateTimeField()
+    last_created_on = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    path = models.CharField(max_length=255)
+    created_on = models.DateTimeField(
+        auto_now_add=True
+    )  # object creation time. will automatic generate
+
+    class Meta:
+        db_table = f"{settings.DB_PREFIX}_message_segments"  # define table name for database
+        ordering = ['-last_sequence']  # define default order as history order, newest first
+        indexes = [
+            models.Index(fields=['conversation', 'last_sequence'], name='message_segment_idx'),
+        ]
+
+
 class FavoriteMessage(models.Model):
+    """
+        Store one favorite message of a participant.
+        Row id is the cursor of the favorites list, newest first.
+    """
     participant = models.ForeignKey(Participant, on_delete=models.DO_NOTHING,
                                     related_name='favorite_messages')  # define user who added favorite
-    messages = models.ManyToManyField(ChatMessage)
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='favorites', db_constraint=False)
+    created_on = models.DateTimeField(
+        auto_now_add=True
+    )  # object creation time. will automatic generate
 
     class Meta:
         db_table = f"{settings.DB_PREFIX}_favorite_messages"  # define table name for database
+        constraints = [
+            models.UniqueConstraint(fields=['participant', 'message'], name='favorite_message_unique'),
+        ]  # adding a favorite twice is ignored by the conflict
+        indexes = [
+            models.Index(fields=['participant', 'id'], name='favorite_message_list_idx'),
+        ]
+
+    @classmethod
+    def add(cls, participant, message):
+        cls.objects.bulk_create([cls(participant=participant, message=message)], ignore_conflicts=True)
+
+    @classmethod
+    def remove(cls, participant, message):
+        cls.objects.filter(participant=participant, message=message).delete()
 
 
 class OffensiveWord(models.Model):
@@ -160,6 +717,22 @@ class ClientOffensiveWords(models.Model):
         verbose_name_plural = "ClientOffensiveWords"
 
 
+def staff_client_config(user):
+    """
+        Client a dashboard user administers, or else works for, with the ids of its word and expression lists.
+        Resolved with one joined query and served from the client configuration cache.
+    """
+    config = get_client_config(user.pk)
+    if config is None:
+        config = Client.objects.filter(Q(admin=user) | Q(employee=user)).annotate(
+            is_client_admin=ExpressionWrapper(Q(admin=user), output_field=models.BooleanField())
+        ).order_by('-is_client_admin', 'created_on', 'id').values(
+            client_id=F('id'), offensive_words_id=F('offensive_word'), re_formats_id=F('RE_format')
+        ).first() or {'client_id': None, 'offensive_words_id': None, 're_formats_id': None}
+        set_client_config(user.pk, config)
+    return config
+
+
 class REFormat(models.Model):
     expression = models.CharField(max_length=128, unique=True, choices=RegexChoice.choices)
 
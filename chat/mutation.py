@@ -7,8 +7,9 @@ from graphene_file_upload.scalars import Upload
 from graphql import GraphQLError
 
 # local imports
-from chat.choices import RegexChoice
+from chat.choices import InboxEvent, RegexChoice
 from chat.models import (
+    ChatChange,
     ChatMessage,
     ClientOffensiveWords,
     ClientREFormats,
@@ -16,6 +17,7 @@ from chat.models import (
     FavoriteMessage,
     OffensiveWord,
     Participant,
+    ParticipantConversationState,
     REFormat,
 )
 from chat.query import (
@@ -27,12 +29,13 @@ from chat.query import (
 )
 from chat.subscription import (
     ChatSubscription,
-    MessageCountSubscription,
+    InboxSubscription,
     MessageSubscription,
     TypingSubscription,
     UserSubscription,
 )
-from mysite.permissions import is_authenticated, is_client_request
+from chat.tasks import notify_message_count
+from mysite.permissions import is_authenticated, is_client_request, rate_limited
 from users.choices import IdentifierBaseChoice
 from users.models import Client
 
@@ -61,6 +64,7 @@ class StartConversation(graphene.Mutation):
         opposite_user_photo = graphene.String(required=False)
 
     @is_client_request
+    @rate_limited("start_conversation")
     def mutate(self, info, opposite_user_id, opposite_username, friendly_name=None, identifier_id=None,
                user_photo=None, opposite_user_photo=None):
         participant = info.context.user
@@ -90,10 +94,16 @@ class StartConversation(graphene.Mutation):
                 identifier_id=identifier_id
             )
             chat.participants.add(participant, opposite_user)
+            ParticipantConversationState.objects.bulk_create([
+                ParticipantConversationState(participant=participant, conversation=chat),
+                ParticipantConversationState(participant=opposite_user, conversation=chat),
+            ])
 
             ChatSubscription.broadcast(payload=chat, group=str(participant.id))
+            InboxSubscription.notify(participant.id, InboxEvent.CONVERSATION, conversation=chat)
 
             ChatSubscription.broadcast(payload=chat, group=str(opposite_user.id))
+            InboxSubscription.notify(opposite_user.id, InboxEvent.CONVERSATION, conversation=chat)
         elif Conversation.objects.filter(participants=participant).filter(participants=opposite_user):
             raise GraphQLError(
                 message="Already have conversation.",
@@ -155,6 +165,7 @@ class SendMessage(graphene.Mutation):
         reply_to = graphene.ID(required=False)
 
     @is_client_request
+    @rate_limited("send_message")
     def mutate(self, info, chat_id, message=None, file=None, reply_to=None, **kwargs):
         client = info.context.client
         sender = info.context.user
@@ -193,31 +204,79 @@ class SendMessage(graphene.Mutation):
                             }
                         )
         if reply_to:
-            reply_to = ChatMessage.objects.get(id=reply_to, conversation=chat, is_deleted=False)
-        if not chat.messages.all() or chat.last_message.created_on.date() != today:
-            ChatMessage.objects.create(
-                conversation=chat, sender=sender, message=str(today), message_type=ChatMessage.MessageType.DATE,
-                read_on=timezone.now()
+            reply_to = chat.history().filter(id=reply_to, is_deleted=False).first()
+            if not reply_to:
+                raise GraphQLError(
+                    message="Message not found.",
+                    extensions={
+                        "errors": {"message": "Message not found, archived messages can not be answered."},
+                        "code": "invalid_message"
+                    }
+                )
+        last_message = chat.last_message
+        if not last_message or last_message.created_on.date() != today:
+            chat.add_message(
+                sender=sender, message=str(today), message_type=ChatMessage.MessageType.DATE, read_on=timezone.now()
             )
-        chat_message = ChatMessage.objects.create(
-            conversation=chat, sender=sender, message=message, file=file, reply_to=reply_to
-        )
-        if chat_message.receiver.is_online:
-            chat_message.delivered_on = timezone.now()
-            if chat_message.receiver in chat.connected.all():
-                chat_message.read_on = timezone.now()
-            else:
-                MessageCountSubscription.broadcast(payload=chat_message.receiver.unread_count,
-                                                   group=str(chat_message.receiver.id))
-            chat_message.save()
-            ChatSubscription.broadcast(payload=chat, group=str(chat_message.receiver.id))
+        receiver = chat.opposite_user(sender)
+        chat_message = chat.add_message(sender=sender, message=message, file=file, reply_to=reply_to)
+        is_read = receiver.is_online and receiver in chat.connected.all()
+        if not is_read:
+            ParticipantConversationState.increment_unread(receiver, chat)
+        if receiver.is_online:
+            ParticipantConversationState.advance(receiver.id, read=is_read, conversation_id=chat.id,
+                                                 up_to_sequence=chat_message.sequence)
+            ChatSubscription.broadcast(payload=chat, group=str(receiver.id))
+            InboxSubscription.notify(receiver.id, InboxEvent.CONVERSATION, conversation=chat)
+            if not is_read:
+                notify_message_count(receiver.id)
 
         MessageSubscription.broadcast(payload=chat_message, group=str(chat.id))
         ChatSubscription.broadcast(payload=chat, group=str(sender.id))
+        InboxSubscription.notify(receiver.id, InboxEvent.MESSAGE, message=chat_message)
+        InboxSubscription.notify(sender.id, InboxEvent.MESSAGE, message=chat_message)
+        InboxSubscription.notify(sender.id, InboxEvent.CONVERSATION, conversation=chat)
 
         return SendMessage(success=True, message=chat_message)
 
 
+class MarkConversationRead(graphene.Mutation):
+    """
+        Mark the received messages of a conversation as read, up to a sequence or all of them.
+        The other participants get one read event with the last read sequence.
+        Will return success(true), the number of messages read and the last read sequence.
+    """
+    success = graphene.Boolean()
+    read_count = graphene.Int()
+    read_up_to = graphene.Int()
+
+    class Arguments:
+        chat_id = graphene.ID(required=True)
+        up_to_sequence = graphene.Int(required=False)
+
+    @is_client_request
+    @rate_limited("mark_read")
+    def mutate(self, info, chat_id, up_to_sequence=None, **kwargs):
+        participant = info.context.user
+        chat = Conversation.objects.get(id=chat_id, participants=participant)
+        result = chat.mark_read(participant, up_to_sequence)
+        if not result:
+            return MarkConversationRead(success=True, read_count=0)
+        previous, read_up_to = result
+        read = chat.received_messages(participant, previous, read_up_to)
+        read_count = read.count()
+
+        last_read = read.order_by('-sequence').first()
+        if last_read:  # None when the read messages were deleted in the meantime
+            MessageSubscription.broadcast(payload=last_read, group=str(chat.id))
+        for other in chat.participants.exclude(id=participant.id):
+            InboxSubscription.notify(other.id, InboxEvent.READ, chat_id=str(chat.id), read_up_to=read_up_to)
+        ChatSubscription.broadcast(payload=chat, group=str(participant.id))
+        InboxSubscription.notify(participant.id, InboxEvent.CONVERSATION, conversation=chat)
+        notify_message_count(participant.id)
+        return MarkConversationRead(success=True, read_count=read_count, read_up_to=read_up_to)
+
+
 class TypingMutation(graphene.Mutation):
     """
         Send typing response to other user.
@@ -232,12 +291,14 @@ class TypingMutation(graphene.Mutation):
         recipient_id = graphene.ID()
 
     @is_client_request
+    @rate_limited("typing")
     def mutate(self, info, chat_id, recipient_id, **kwargs):
         # user = info.context.user
         # chat = Conversation.objects.get(participants=user, id=chat_id, is_blocked=False)
         TypingSubscription.broadcast(
             payload=str(chat_id), group=str(recipient_id)
         )
+        InboxSubscription.notify(recipient_id, InboxEvent.TYPING, chat_id=str(chat_id))
         return TypingMutation(success=True)
 
 
@@ -255,21 +316,25 @@ class UnsubscribeMutation(graphene.Mutation):
 
 def deliver_message(user_id):
     """
-        Will deliver the message to user.
+        Will deliver the message to user by moving the delivered watermarks of his conversations.
         And sender will also get response by broadcasting.
     """
-    user = Participant.objects.get(id=user_id)
-    messages = ChatMessage.objects.filter(
-        conversation__participants=user, delivered_on__isnull=True, read_on__isnull=True, is_deleted=False
-    ).exclude(sender=user)
-    for msg in messages:
-        msg.delivered_on = timezone.now()
-        # msg.save()
-        if msg == msg.conversation.last_message and msg.sender.is_online:
-            ChatSubscription.broadcast(payload=msg.conversation, group=str(msg.sender.id))
-        if msg.sender in msg.conversation.connected.all():
-            MessageSubscription.broadcast(payload=msg, group=str(msg.conversation.id))
-    ChatMessage.objects.bulk_update(messages, ['delivered_on'])
+    moved = ParticipantConversationState.advance(user_id)
+    conversations = Conversation.objects.in_bulk([conversation_id for conversation_id, previous, sequence in moved])
+    for conversation_id, previous, delivered_up_to in moved:
+        conversation = conversations[conversation_id]
+        conversation.record_receipt(ChatChange.ChangeType.DELIVERED, delivered_up_to)
+        msg = conversation.history().filter(sequence=delivered_up_to).select_related('sender').first()
+        if msg is None:
+            continue
+        if msg.sender.is_online:
+            ChatSubscription.broadcast(payload=conversation, group=str(msg.sender.id))
+            InboxSubscription.notify(msg.sender.id, InboxEvent.CONVERSATION, conversation=conversation)
+        if msg.sender in conversation.connected.all():
+            MessageSubscription.broadcast(payload=msg, group=str(conversation.id))
+        InboxSubscription.notify(msg.sender.id, InboxEvent.MESSAGE, message=msg)
+        InboxSubscription.notify(msg.sender.id, InboxEvent.DELIVERED, chat_id=str(conversation.id),
+                                 delivered_up_to=delivered_up_to)
 
 
 class UserOnlineMutation(graphene.Mutation):
@@ -282,14 +347,15 @@ class UserOnlineMutation(graphene.Mutation):
     success = graphene.Boolean()
 
     @is_client_request
+    @rate_limited("user_online")
     def mutate(self, info, **kwargs):
         user = info.context.user
         if not user.is_online:
-            user.save()
+            user.save(update_fields=['last_seen'])
             UserSubscription.broadcast(payload=user, group="users-channel")
             deliver_message(user.id)
         else:
-            user.save()
+            user.save(update_fields=['last_seen'])
         return UserOnlineMutation(success=True)
 
 
@@ -317,11 +383,11 @@ class DeleteMessages(graphene.Mutation):
         participant = info.context.user
         message_ids = [id.id for id in message_ids]
         if message_ids and ChatMessage.objects.filter(id__in=message_ids, conversation__participants=participant,
-                                                      is_deleted=False).exclude(deleted_from=participant):
+                                                      is_deleted=False).visible_to(participant):
             messages = ChatMessage.objects.filter(id__in=message_ids, conversation__participants=participant,
-                                                  is_deleted=False).exclude(deleted_from=participant)
+                                                  is_deleted=False).visible_to(participant)
             if for_all:
-                all_messages = messages.filter(read_on__isnull=True)
+                all_messages = [msg for msg in messages.with_receipts() if not msg.receipt[1]]
                 conversation = messages.last().conversation
                 if len(messages) != len(all_messages):
                     raise GraphQLError(
@@ -331,7 +397,7 @@ class DeleteMessages(graphene.Mutation):
                             "code": "invalid_request"
                         }
                     )
-                all_messages = all_messages.filter(sender=participant)
+                all_messages = [msg for msg in all_messages if msg.sender_id == participant.id]
                 if len(messages) != len(all_messages):
                     raise GraphQLError(
                         message="Invalid request.",
@@ -344,22 +410,40 @@ class DeleteMessages(graphene.Mutation):
                 for msg in all_messages:
                     msg.is_deleted = True
                     msg.save()
+                    ChatChange.record(msg.conversation, ChatChange.ChangeType.DELETED, [msg])
+                    receiver = msg.receiver
+                    ParticipantConversationState.decrement_unread(receiver, msg.conversation)
+                    notify_message_count(receiver.id)
                     MessageSubscription.broadcast(payload=msg, group=str(msg.conversation.id))
+                    InboxSubscription.notify(receiver.id, InboxEvent.MESSAGE, message=msg)
+                    InboxSubscription.notify(msg.sender.id, InboxEvent.MESSAGE, message=msg)
                     if msg == conversation.last_message:
                         ChatSubscription.broadcast(
-                            payload=conversation, group=str(msg.receiver.id)
+                            payload=conversation, group=str(receiver.id)
                         )
                         ChatSubscription.broadcast(
                             payload=conversation, group=str(msg.sender.id)
                         )
+                        InboxSubscription.notify(receiver.id, InboxEvent.CONVERSATION, conversation=conversation)
+                        InboxSubscription.notify(msg.sender.id, InboxEvent.CONVERSATION, conversation=conversation)
             else:
+                messages = list(messages.select_related('conversation'))
+                hidden = {}
                 for msg in messages:
-                    msg.deleted_from.add(participant)
+                    hidden.setdefault(msg.conversation, []).append(msg.sequence)
+                for conversation, sequences in hidden.items():
+                    ParticipantConversationState.hide(participant, conversation, sequences)
+                for msg in messages:
+                    ChatChange.record(msg.conversation, ChatChange.ChangeType.DELETED, [msg],
+                                      participants=[participant])
                     MessageSubscription.broadcast(payload=msg, group=str(msg.conversation.id))
+                    InboxSubscription.notify(participant.id, InboxEvent.MESSAGE, message=msg)
                     if msg == msg.conversation.last_message:
                         ChatSubscription.broadcast(
                             payload=msg.conversation, group=str(participant.id)
                         )
+                        InboxSubscription.notify(participant.id, InboxEvent.CONVERSATION,
+                                                 conversation=msg.conversation)
         else:
             raise GraphQLError(
                 message="Invalid input request.",
@@ -371,6 +455,32 @@ class DeleteMessages(graphene.Mutation):
         return DeleteMessages(success=True)
 
 
+class ClearConversation(graphene.Mutation):
+    """
+        Delete every message of a conversation for the user.
+        This will take conversation-id as parameter.
+        And will return success(true) if cleared.
+    """
+    success = graphene.Boolean()
+
+    class Arguments:
+        chat_id = graphene.ID(required=True)
+
+    @is_client_request
+    @rate_limited("clear_conversation")
+    def mutate(self, info, chat_id, **kwargs):
+        participant = info.context.user
+        chat = Conversation.objects.get(id=chat_id, participants=participant)
+        last_message = chat.last_message
+        if last_message:
+            ParticipantConversationState.clear(participant, chat, last_message.sequence)
+            notify_message_count(participant.id)
+            ChatChange.record(chat, ChatChange.ChangeType.CLEARED, [last_message], participants=[participant])
+            ChatSubscription.broadcast(payload=chat, group=str(participant.id))
+            InboxSubscription.notify(participant.id, InboxEvent.CONVERSATION, conversation=chat)
+        return ClearConversation(success=True)
+
+
 class BlockUserConversation(graphene.Mutation):
     """
         Block and unblock a user chat.
@@ -414,6 +524,7 @@ class FavoriteMessageMutation(graphene.Mutation):
         Add or remove message from favorite.
         This will take message-id and add fields as parameter.
         If add field is false then the message will be removed from favorite.
+        Adding a favorite message or removing a message that is not favorite does nothing.
         And will return success(true), a feedback and message object.
     """
     success = graphene.Boolean()
@@ -427,20 +538,19 @@ class FavoriteMessageMutation(graphene.Mutation):
     @is_client_request
     def mutate(self, info, message_id, add=True, **kwargs):
         user = info.context.user
-        message_obj = ChatMessage.objects.get(id=message_id, conversation__participants=user)
-        user_favorite, created = FavoriteMessage.objects.get_or_create(participant=user)
-        if add:
-            user_favorite.messages.add(message_obj)
-        elif not add and user_favorite.messages.filter(id=message_id):
-            user_favorite.messages.remove(message_obj)
-        else:
+        message_obj = ChatMessage.objects.filter(id=message_id, conversation__participants=user).first()
+        if not message_obj:
             raise GraphQLError(
-                message="Message not added yet to favorite.",
+                message="Message not found.",
                 extensions={
-                    "errors": {"message": "Message not added yet to favorites."},
-                    "code": "invalid_action"
+                    "errors": {"message": "Message not found, archived messages can not be favorites."},
+                    "code": "invalid_message"
                 }
             )
+        if add:
+            FavoriteMessage.add(user, message_obj)
+        else:
+            FavoriteMessage.remove(user, message_obj)
         return FavoriteMessageMutation(
             success=True, fav_message=message_obj, message="Successfully added" if add else "Successfully removed"
         )
@@ -557,10 +667,12 @@ class Mutation(graphene.ObjectType):
     start_conversation = StartConversation.Field()
     update_photo = UpdatePhoto.Field()
     send_message = SendMessage.Field()
+    mark_conversation_read = MarkConversationRead.Field()
     block_user_conversation = BlockUserConversation.Field()
     add_or_remove_offensive_word = OffensiveWordMutation.Field()
     add_or_remove_expression = REFormatMutation.Field()
     delete_messages = DeleteMessages.Field()
+    clear_conversation = ClearConversation.Field()
     typing_mutation = TypingMutation.Field()
     favorite_message_mutation = FavoriteMessageMutation.Field()
     unsubscribe_chatting = UnsubscribeMutation.Field()
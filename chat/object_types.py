@@ -5,6 +5,7 @@ from graphene_django.types import DjangoObjectType
 
 # local imports
 from chat.filters import (
+    ChatChangeFilters,
     ClientOffensiveWordFilters,
     ClientREFormatFilters,
     ConversationFilters,
@@ -15,6 +16,7 @@ from chat.filters import (
     REFormatFilters,
 )
 from chat.models import (
+    ChatChange,
     ChatMessage,
     ClientOffensiveWords,
     ClientREFormats,
@@ -36,6 +38,7 @@ class ParticipantType(DjangoObjectType):
     object_id = graphene.ID()
     unread_count = graphene.Int()
     is_online = graphene.Boolean()
+    field_costs = {"unread_count": 1}  # query cost hints of resolvers running queries
 
     class Meta:
         model = Participant
@@ -65,12 +68,15 @@ class MessageType(DjangoObjectType):
     status = graphene.String()
     receiver = graphene.Field(ParticipantType)
     is_favorite = graphene.Boolean()
+    favorite_id = graphene.ID()  # cursor of the favorites list, pass it as favorited_before for the next page
+    field_costs = {"receiver": 3, "is_favorite": 2}  # query cost hints of resolvers running queries
 
     class Meta:
         model = ChatMessage
         filterset_class = MessageFilters
         interfaces = (graphene.relay.Node,)
         convert_choices_to_enum = False
+        exclude = ('search_vector',)
         connection_class = CountConnection
 
     @staticmethod
@@ -81,6 +87,22 @@ class MessageType(DjangoObjectType):
     def resolve_status(self, info, **kwargs):
         return self.status
 
+    @staticmethod
+    def resolve_delivered_on(self, info, **kwargs):
+        return self.receipt[0]
+
+    @staticmethod
+    def resolve_read_on(self, info, **kwargs):
+        return self.receipt[1]
+
+    @staticmethod
+    def resolve_reply_to(self, info, **kwargs):
+        if self.reply_to_id is None:
+            return None
+        if ChatMessage.reply_to.is_cached(self):
+            return self.reply_to  # joined or set with the archived messages
+        return ChatMessage.objects.with_receipts().filter(id=self.reply_to_id).first()
+
     @staticmethod
     def resolve_receiver(self, info, **kwargs):
         return self.receiver
@@ -89,6 +111,10 @@ class MessageType(DjangoObjectType):
     def resolve_is_favorite(self, info, **kwargs):
         return self.is_favorite(user=info.context.user)
 
+    @staticmethod
+    def resolve_favorite_id(self, info, **kwargs):
+        return getattr(self, 'favorite_id', None)
+
 
 class ConversationType(DjangoObjectType):
     """
@@ -98,6 +124,7 @@ class ConversationType(DjangoObjectType):
     last_message = graphene.Field(MessageType)
     opposite_user = graphene.Field(ParticipantType)
     unread_count = graphene.Int()
+    field_costs = {"last_message": 2, "opposite_user": 2, "unread_count": 1}  # query cost hints of resolvers
 
     class Meta:
         model = Conversation
@@ -125,6 +152,25 @@ class ConversationType(DjangoObjectType):
         return self.unread_count(participant)
 
 
+class ChatChangeType(DjangoObjectType):
+    """
+        define django object type for change feed model
+    """
+    object_id = graphene.ID()
+
+    class Meta:
+        model = ChatChange
+        filterset_class = ChatChangeFilters
+        interfaces = (graphene.relay.Node,)
+        convert_choices_to_enum = False
+        connection_class = CountConnection
+        exclude = ('participant',)
+
+    @staticmethod
+    def resolve_object_id(self, info, **kwargs):
+        return self.pk
+
+
 class FavoriteMessageType(DjangoObjectType):
     """
         define django object type for message model
@@ -0,0 +1,129 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from chat.models import ChatChange, ChatMessage, Conversation, FavoriteMessage
+
+MESSAGE_TABLE = ChatMessage._meta.db_table
+DEFAULT_PARTITION = f"{MESSAGE_TABLE}_default"
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(month):
+    return f"{MESSAGE_TABLE}_p{month:%Y%m}"
+
+
+def message_partitions():
+    """
+        Monthly partitions of the message table as (name, first day of the month), oldest first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = %s::regclass",
+            [MESSAGE_TABLE]
+        )
+        names = [name for name, in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        if name == DEFAULT_PARTITION:
+            continue
+        month = datetime.datetime.strptime(name[-6:], "%Y%m").replace(tzinfo=datetime.timezone.utc)
+        partitions.append((name, month))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partition(month):
+    """
+        Create the partition of a month.
+        Rows of the month that went to the default partition are moved to it before it is attached.
+    """
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {name} (LIKE {MESSAGE_TABLE} INCLUDING DEFAULTS INCLUDING STORAGE)")
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_on >= %s AND created_on < %s "
+                f"RETURNING *) INSERT INTO {name} SELECT * FROM moved",
+                [start, end]
+            )
+            cursor.execute(f"ALTER TABLE {MESSAGE_TABLE} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)",
+                           [start, end])
+    return name
+
+
+def ensure_partitions(ahead=None):
+    """
+        Create the missing partitions from this month to some months ahead, return the created names.
+    """
+    ahead = settings.MESSAGE_PARTITION_MONTHS_AHEAD if ahead is None else ahead
+    existing = {month for name, month in message_partitions()}
+    current = month_start(timezone.now())
+    return [
+        create_partition(month) for month in (add_months(current, count) for count in range(ahead + 1))
+        if month not in existing
+    ]
+
+
+def detach_partitions(before):
+    """
+        Detach the partitions of the months before a month, the tables are kept for archiving or dropping.
+        Foreign keys of a detached table are dropped, so its rows do not block deleting conversations.
+        Rows referring to the detached messages have no constraint to follow them: changes and favorites
+        of the messages are deleted and replies to them from other partitions no longer point at them.
+    """
+    detached = []
+    for name, month in message_partitions():
+        if month < month_start(before):
+            with transaction.atomic(), connection.cursor() as cursor:
+                for model in (ChatChange, FavoriteMessage):
+                    cursor.execute(f"DELETE FROM {model._meta.db_table} WHERE message_id IN (SELECT id FROM {name})")
+                cursor.execute(
+                    f"UPDATE {MESSAGE_TABLE} SET reply_to_id = NULL WHERE tableoid <> %s::regclass "
+                    f"AND reply_to_id IN (SELECT id FROM {name})",
+                    [name]
+                )
+                cursor.execute(f"ALTER TABLE {MESSAGE_TABLE} DETACH PARTITION {name}")
+                cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'",
+                               [name])
+                for constraint, in cursor.fetchall():
+                    cursor.execute(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"')
+            detached.append(name)
+    return detached
+
+
+def drop_empty_partitions(before):
+    """
+        Drop the partitions of the months before a month whose messages are all archived.
+        Archived messages kept in the table, favorites and messages answered later, are moved to the default
+        partition first. A dropped month is covered by no partition, so they stay there.
+    """
+    conversations = Conversation._meta.db_table
+    dropped = []
+    for name, month in message_partitions():
+        if month >= month_start(before):
+            break
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute(
+                f"SELECT EXISTS (SELECT 1 FROM {name} message JOIN {conversations} conversation "
+                f"ON conversation.id = message.conversation_id WHERE message.sequence > conversation.archived_up_to)"
+            )
+            if cursor.fetchone()[0]:
+                continue
+            cursor.execute(f"ALTER TABLE {MESSAGE_TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"INSERT INTO {MESSAGE_TABLE} SELECT * FROM {name}")
+            cursor.execute(f"DROP TABLE {name}")
+        dropped.append(name)
+    return dropped
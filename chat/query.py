@@ -1,39 +1,54 @@
 
 import django.contrib.auth
 import graphene
-from django.db.models import Q
-from django.utils import timezone
+from django.db.models import Prefetch, Q
 from graphene_django.filter.fields import DjangoFilterConnectionField
+from graphql import GraphQLError
 
 # local imports
+from bases.lookups import autocomplete
+from chat.archive import ConversationHistory
 from chat.models import (
+    ChatChange,
     ChatMessage,
-    ClientOffensiveWords,
-    ClientREFormats,
     Conversation,
-    FavoriteMessage,
     OffensiveWord,
     Participant,
     REFormat,
+    staff_client_config,
 )
 from chat.object_types import (
+    ChatChangeType,
     ConversationType,
     MessageType,
     OffensiveWordType,
     ParticipantType,
     REFormatType,
 )
-from chat.subscription import (
-    ChatSubscription,
-    MessageCountSubscription,
-    MessageSubscription,
-)
 from mysite.permissions import is_admin_user, is_authenticated, is_client_request
 from users.models import Client
 
 User = django.contrib.auth.get_user_model()
 
 
+class HistoryConnectionField(DjangoFilterConnectionField):
+    """
+        Connection of a conversation history, archived messages follow the messages of the table
+        when the history is only ordered. Filters and search cover the messages of the table.
+    """
+
+    @classmethod
+    def resolve_queryset(cls, connection, iterable, info, args, filtering_args, filterset_class):
+        history = iterable
+        messages = super().resolve_queryset(connection, history.messages, info, args, filtering_args,
+                                            filterset_class)
+        filtered = {name for name, value in args.items() if name in filtering_args and value not in (None, '')}
+        if filtered - {'order_by'}:
+            return messages
+        descending = (args.get('order_by') or '-').startswith('-')
+        return ConversationHistory(history.conversation, history.participant, messages, descending)
+
+
 class ConversationQuery(graphene.ObjectType):
     """
         query all chat information
@@ -79,51 +94,65 @@ class MessageQuery(graphene.ObjectType):
         query all messages information for admin panel
     """
     all_messages = DjangoFilterConnectionField(MessageType)
-    user_conversation_messages = DjangoFilterConnectionField(MessageType, chat_id=graphene.ID())
-    user_favorite_messages = DjangoFilterConnectionField(MessageType)
+    user_conversation_messages = HistoryConnectionField(MessageType, chat_id=graphene.ID())
+    user_favorite_messages = DjangoFilterConnectionField(MessageType, favorited_before=graphene.ID())
     message_info = graphene.Field(MessageType, id=graphene.ID())
     message_count = graphene.Int()
 
     @is_admin_user
     def resolve_all_messages(self, info, **kwargs):
-        return ChatMessage.objects.all().select_related("sender", 'conversation')
+        return ChatMessage.objects.with_receipts().select_related("sender", 'conversation')
 
     @is_client_request
     def resolve_message_info(self, info, id, **kwargs):
-        return ChatMessage.objects.get(id=id, conversation__participants=info.context.user)
+        message = ChatMessage.objects.with_receipts().filter(id=id, conversation__participants=info.context.user).first()
+        if not message:
+            raise GraphQLError(
+                message="Message not found.",
+                extensions={
+                    "message": "Message not found, archived messages are only listed in the conversation history.",
+                    "code": "invalid_message"
+                }
+            )
+        return message
 
     @is_client_request
     def resolve_user_conversation_messages(self, info, chat_id, **kwargs):
         participant = info.context.user
         conversation = Conversation.objects.get(id=chat_id, participants=participant)
-        unread_messages = conversation.messages.filter(read_on__isnull=True,
-                                                       is_deleted=False).exclude(sender=participant)
-        message_data = [obj.id for obj in unread_messages]
-        if unread_messages:
-            unread_messages.update(read_on=timezone.now())
-            for msg in ChatMessage.objects.filter(id__in=message_data):
-                MessageSubscription.broadcast(payload=msg, group=str(conversation.id))
-            ChatSubscription.broadcast(payload=conversation, group=str(participant.id))
-            MessageCountSubscription.broadcast(payload=participant.unread_count, group=str(participant.id))
-        return ChatMessage.objects.filter(conversation=conversation).exclude(
-            deleted_from=participant).select_related("sender", 'conversation')
+        return ConversationHistory(conversation, participant, conversation.history().visible_to(
+            participant, conversation).with_receipts().select_related("sender", 'conversation'))
 
     @is_client_request
-    def resolve_user_favorite_messages(self, info, **kwargs):
-        user = info.context.user
-        user_fav, created = FavoriteMessage.objects.get_or_create(participant=user)
-        return user_fav.messages.exclude(deleted_from=user).select_related("sender", 'conversation')
+    def resolve_user_favorite_messages(self, info, favorited_before=None, **kwargs):
+        return ChatMessage.objects.favorites_of(info.context.user, favorited_before).with_receipts().select_related(
+            "sender", 'conversation')
 
     @is_client_request
     def resolve_message_count(self, info, **kwargs):
         return info.context.user.unread_count
 
 
-class Query(ConversationQuery, MessageQuery, graphene.ObjectType):
+class ChangeQuery(graphene.ObjectType):
+    """
+        query changes of user conversations for delta sync
+    """
+    user_changes = DjangoFilterConnectionField(ChatChangeType)
+
+    @is_client_request
+    def resolve_user_changes(self, info, **kwargs):
+        return ChatChange.objects.filter(participant=info.context.user).select_related('conversation').prefetch_related(
+            Prefetch('message', queryset=ChatMessage.objects.with_receipts())
+        )
+
+
+class Query(ConversationQuery, MessageQuery, ChangeQuery, graphene.ObjectType):
     """
         define all the queries together
     """
     participant_user = graphene.Field(ParticipantType)
+    participant_autocomplete = graphene.List(ParticipantType, search=graphene.String(required=True),
+                                             first=graphene.Int())
     is_user_online = graphene.Boolean(id=graphene.ID())
     offensive_words = DjangoFilterConnectionField(OffensiveWordType)
     re_formats = DjangoFilterConnectionField(REFormatType)
@@ -132,6 +161,17 @@ class Query(ConversationQuery, MessageQuery, graphene.ObjectType):
     def resolve_participant_user(self, info, **kwargs):
         return info.context.user
 
+    @is_authenticated
+    def resolve_participant_autocomplete(self, info, search, first=None, **kwargs):
+        user = info.context.user
+        if getattr(info.context, 'client', None):
+            objects = Participant.objects.filter(client=info.context.client)
+        elif user.is_admin:
+            objects = Participant.objects.all()
+        else:
+            objects = Participant.objects.filter(client__in=Client.objects.filter(Q(admin=user) | Q(employee=user)))
+        return autocomplete(objects, 'name', search, first)
+
     @is_client_request
     def resolve_is_user_online(self, info, id, **kwargs):
         query_user = Participant.objects.get(id=id)
@@ -142,32 +182,19 @@ class Query(ConversationQuery, MessageQuery, graphene.ObjectType):
     @is_authenticated
     def resolve_offensive_words(self, info, **kwargs):
         user = info.context.user
-        words = OffensiveWord.objects.filter(id=0)
         if user.is_admin:
-            words = OffensiveWord.objects.all()
-        elif Client.objects.filter(admin=user):
-            client = Client.objects.filter(admin=user).last()
-            if ClientOffensiveWords.objects.filter(client=client):
-                words = ClientOffensiveWords.objects.filter(client=client).last().words.all()
-        elif Client.objects.filter(employee=user):
-            client = Client.objects.filter(employee=user).last()
-            if ClientOffensiveWords.objects.filter(client=client):
-                words = ClientOffensiveWords.objects.filter(client=client).last().words.all()
-
-        return words
+            return OffensiveWord.objects.all()
+        offensive_words_id = staff_client_config(user)['offensive_words_id']
+        if not offensive_words_id:
+            return OffensiveWord.objects.none()
+        return OffensiveWord.objects.filter(clientoffensivewords=offensive_words_id)  # read from the join table
 
     @is_authenticated
     def resolve_re_formats(self, info, **kwargs):
         user = info.context.user
-        expressions = REFormat.objects.filter(id=0)
         if user.is_admin:
-            expressions = REFormat.objects.all()
-        elif Client.objects.filter(admin=user):
-            client = Client.objects.filter(admin=user).last()
-            if ClientREFormats.objects.filter(client=client):
-                expressions = ClientREFormats.objects.filter(client=client).last().expressions.all()
-        elif Client.objects.filter(employee=user):
-            client = Client.objects.filter(employee=user).last()
-            if ClientREFormats.objects.filter(client=client):
-                expressions = ClientREFormats.objects.filter(client=client).last().expressions.all()
-        return expressions
+            return REFormat.objects.all()
+        re_formats_id = staff_client_config(user)['re_formats_id']
+        if not re_formats_id:
+            return REFormat.objects.none()
+        return REFormat.objects.filter(clientreformats=re_formats_id)  # read from the join table
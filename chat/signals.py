@@ -0,0 +1,51 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from chat.archive import remove_segment
+from chat.models import (
+    ClientOffensiveWords,
+    ClientREFormats,
+    MessageSegment,
+    Participant,
+)
+from mysite.auth_cache import forget_client_config, invalidate
+from users.models import Client
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def invalidate_participant(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_seen'}:
+        return  # online status update only
+    invalidate('participant', instance.pk)
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_client(sender, instance, **kwargs):
+    invalidate('client', instance.pk)
+    forget_client_config([instance.admin_id])  # the admin may have no cached client yet
+
+
+@receiver(post_save, sender=ClientOffensiveWords)
+@receiver(post_delete, sender=ClientOffensiveWords)
+@receiver(post_save, sender=ClientREFormats)
+@receiver(post_delete, sender=ClientREFormats)
+def invalidate_client_config(sender, instance, **kwargs):
+    invalidate('client', instance.client_id)
+
+
+@receiver(m2m_changed, sender=Client.employee.through)
+def invalidate_client_employees(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        forget_client_config([instance.pk])
+    else:
+        invalidate('client', instance.pk)
+        forget_client_config(pk_set or [])
+
+
+@receiver(post_delete, sender=MessageSegment)
+def remove_segment_file(sender, instance, **kwargs):
+    remove_segment(instance.path)
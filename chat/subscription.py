@@ -1,6 +1,9 @@
+import logging
+
 import channels_graphql_ws
 import django.contrib.auth
 import graphene
+from django.conf import settings
 from graphql import GraphQLError
 
 # local imports
@@ -8,6 +11,27 @@ from chat.models import Conversation
 from chat.object_types import ConversationType, MessageType, ParticipantType
 
 User = django.contrib.auth.get_user_model()
+logger = logging.getLogger(__name__)
+
+
+class LegacySubscription(channels_graphql_ws.Subscription):
+    """
+        Subscription of one kind of event that the inbox subscription also carries.
+        Broadcasts are skipped when LEGACY_SUBSCRIPTIONS is off, so every event is sent to the channel layer once.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def broadcast_sync(cls, *, group=None, payload=None):
+        if settings.LEGACY_SUBSCRIPTIONS:
+            super().broadcast_sync(group=group, payload=payload)
+
+    @classmethod
+    async def broadcast_async(cls, *, group=None, payload=None):
+        if settings.LEGACY_SUBSCRIPTIONS:
+            await super().broadcast_async(group=group, payload=payload)
 
 
 class UserSubscription(channels_graphql_ws.Subscription):
@@ -42,7 +66,7 @@ class UserSubscription(channels_graphql_ws.Subscription):
         return UserSubscription(user=payload)
 
 
-class ChatSubscription(channels_graphql_ws.Subscription):
+class ChatSubscription(LegacySubscription):
     """
         Pass conversation info to users.
         This will take no parameter for subscribing.
@@ -75,7 +99,7 @@ class ChatSubscription(channels_graphql_ws.Subscription):
         return ChatSubscription(conversation=payload)
 
 
-class MessageSubscription(channels_graphql_ws.Subscription):
+class MessageSubscription(LegacySubscription):
     """
         Pass message info to the users of a conversation.
         This will take the conversation id as parameter for subscribing.
@@ -130,7 +154,7 @@ class MessageSubscription(channels_graphql_ws.Subscription):
         print(f"[unsubscribed from messaging]... <{user}> | {chat_id}")
 
 
-class MessageCountSubscription(channels_graphql_ws.Subscription):
+class MessageCountSubscription(LegacySubscription):
     """
         Pass unread message count to user.
         This will take no parameter for subscribing.
@@ -162,7 +186,7 @@ class MessageCountSubscription(channels_graphql_ws.Subscription):
         return MessageCountSubscription(count=payload)
 
 
-class TypingSubscription(channels_graphql_ws.Subscription):
+class TypingSubscription(LegacySubscription):
     """
         Pass typing response whenever any user types for messaging.
         This will take no parameter for subscribing.
@@ -195,6 +219,50 @@ class TypingSubscription(channels_graphql_ws.Subscription):
         return TypingSubscription(chat_id=payload)
 
 
+class InboxSubscription(channels_graphql_ws.Subscription):
+    """
+        Pass every event of the user conversations over a single subscription.
+        This will take no parameter for subscribing.
+        And will return the event name with message, conversation, count, typing chat-id
+        or chat-id with the last read or delivered sequence.
+    """
+
+    # Subscription payload.
+    event = graphene.String()
+    message = graphene.Field(MessageType)
+    conversation = graphene.Field(ConversationType)
+    count = graphene.Int()
+    chat_id = graphene.String()
+    read_up_to = graphene.Int()  # messages of the chat up to this sequence are read
+    delivered_up_to = graphene.Int()  # messages of the chat up to this sequence are delivered
+
+    @staticmethod
+    def subscribe(root, info):
+        """Called when user subscribes."""
+        user = info.context.user
+        if not user:
+            raise GraphQLError(
+                message="Invalid user!",
+                extensions={
+                    "message": "Invalid user!",
+                    "code": "invalid_user"
+                }
+            )
+        logger.debug("subscribed to inbox <%s>", user)
+        return [f"inbox-{user.id}"]
+
+    @staticmethod
+    def publish(payload, info):
+        """Called to notify the client."""
+        logger.debug("inbox payload <%s> %s", info.context.user, payload['event'])
+        return InboxSubscription(**payload)
+
+    @classmethod
+    def notify(cls, participant_id, event, **payload):
+        """Send an event to the inbox of a participant."""
+        cls.broadcast(payload={"event": event, **payload}, group=f"inbox-{participant_id}")
+
+
 class Subscription(graphene.ObjectType):
     """Root GraphQL subscription."""
     user_subscription = UserSubscription.Field()
@@ -202,3 +270,4 @@ class Subscription(graphene.ObjectType):
     message_subscription = MessageSubscription.Field()
     message_count_subscription = MessageCountSubscription.Field()
     typing_subscription = TypingSubscription.Field()
+    inbox_subscription = InboxSubscription.Field()
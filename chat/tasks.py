@@ -1 +1,46 @@
 #  at w3chat/chat/tasks.py
+import logging
+
+import redis
+from django.conf import settings
+
+from chat.choices import InboxEvent
+from chat.models import Participant
+from chat.subscription import InboxSubscription, MessageCountSubscription
+from mysite import auth_cache
+from mysite.celery import app
+
+logger = logging.getLogger(__name__)
+
+
+def message_count_key(participant_id):
+    return f"message-count-broadcast:{participant_id}"
+
+
+def notify_message_count(participant_id):
+    """
+        Buffer unread count updates of a participant.
+        Only the first update of an interval schedules a push,
+        the push reads the latest count when it runs.
+        Intervals are kept in the shared store, so updates made by different processes share a push.
+    """
+    interval = settings.MESSAGE_COUNT_BROADCAST_SECONDS
+    try:
+        first = auth_cache.shared.add(message_count_key(participant_id), '1', interval)
+    except redis.RedisError as e:
+        logger.warning("unread count push not buffered: %s", e)
+        first = True
+    if first:
+        broadcast_message_count.apply_async(args=[str(participant_id)], countdown=interval)
+
+
+@app.task
+def broadcast_message_count(participant_id):
+    """
+        push the latest unread count to the participant
+    """
+    participant = Participant.objects.filter(id=participant_id).first()
+    if participant:
+        count = participant.unread_count
+        MessageCountSubscription.broadcast(payload=count, group=str(participant.id))
+        InboxSubscription.notify(participant.id, InboxEvent.COUNT, count=count)
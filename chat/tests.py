@@ -1,3 +1,548 @@
-# from django.test import TestCase
+import datetime
+import io
+import re
+import shutil
+import tempfile
+import threading
+import types
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import channels_graphql_ws
+import redis
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from bases.filters import BaseFilters
+from chat.archive import ConversationHistory, archive_conversation, read_segment
+from chat.choices import InboxEvent
+from chat.filters import ConversationFilters, MessageFilters, ParticipantFilters
+from chat.models import (
+    ChatChange,
+    ChatMessage,
+    Conversation,
+    FavoriteMessage,
+    Participant,
+    ParticipantConversationState,
+)
+from chat.partitions import (
+    DEFAULT_PARTITION,
+    create_partition,
+    detach_partitions,
+    drop_empty_partitions,
+    message_partitions,
+)
+from chat.subscription import ChatSubscription, InboxSubscription, TypingSubscription
+from chat.tasks import notify_message_count
+from mysite import auth_cache
+from mysite.schema import schema
+from users.filters import ClientFilters, LogsFilters
+from users.models import Client, UnitOfHistory, User
+
+
+class IndexFriendlyFilterTests(SimpleTestCase):
+    """
+        Date and id filters must compare the bare column with constants,
+        a cast or function around the column keeps postgres from using its btree index.
+    """
+
+    def filter_sql(self, filterset_class, model, data):
+        filterset = filterset_class(data, queryset=model.objects.all())
+        self.assertTrue(filterset.is_valid(), filterset.errors)
+        return str(filterset.qs.query).split(" FROM ", 1)[1]
+
+    def assert_day_range(self, sql, column, lower=True, upper=True):
+        self.assertNotIn("::date", sql)
+        self.assertNotIn("AT TIME ZONE", sql)
+        self.assertEqual(bool(re.search(rf'"{column}" >= \S+', sql)), lower, sql)
+        self.assertEqual(bool(re.search(rf'"{column}" < \S+', sql)), upper, sql)
+
+    def test_message_day_filters(self):
+        self.assert_day_range(self.filter_sql(MessageFilters, ChatMessage, {"created_on": "2021-10-01"}), "created_on")
+        self.assert_day_range(self.filter_sql(MessageFilters, ChatMessage, {"start": "2021-10-01"}), "created_on",
+                              upper=False)
+        self.assert_day_range(self.filter_sql(MessageFilters, ChatMessage, {"end": "2021-10-01"}), "created_on",
+                              lower=False)
+
+    def test_receipt_day_filters_use_watermarks(self):
+        for name, column, watermark in (("delivered_on", "delivered_on", "last_delivered_sequence"),
+                                        ("read_on", "read_on", "last_read_sequence")):
+            with self.subTest(name):
+                sql = self.filter_sql(MessageFilters, ChatMessage, {name: "2021-10-01"}).split(" WHERE ", 1)[1]
+                self.assertIn(f'COALESCE("w3chat_chat_messages"."{column}"', sql)
+                self.assertIn(watermark, sql)
+                self.assertIn(">= 2021-10-01 00:00:00+00:00", sql)
+                self.assertIn("< 2021-10-02 00:00:00+00:00", sql)
+                self.assertNotIn("::date", sql)
+
+    def test_day_range_is_half_open(self):
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"created_on": "2021-10-01"})
+        self.assertIn('"created_on" >= 2021-10-01 00:00:00+00:00', sql)
+        self.assertIn('"created_on" < 2021-10-02 00:00:00+00:00', sql)
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"end": "2021-12-31"})
+        self.assertIn('"created_on" < 2022-01-01 00:00:00+00:00', sql)
+
+    def test_message_id_filters(self):
+        conversation_id = uuid.uuid4()
+        sender_id = uuid.uuid4()
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"conversation": str(conversation_id)})
+        self.assertIn(f'"conversation_id" = {conversation_id}', sql)
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"sender": str(sender_id)})
+        self.assertIn(f'"sender_id" = {sender_id}', sql)
+        self.assertNotIn("LIKE", sql)
+
+    def test_invalid_ids_are_rejected(self):
+        filterset = MessageFilters({"conversation": "not-a-uuid"}, queryset=ChatMessage.objects.all())
+        self.assertFalse(filterset.is_valid())
+
+    def test_conversation_day_filters(self):
+        for name, column, lower, upper in (("created_on", "created_on", True, True),
+                                           ("updated_on", "updated_on", True, True),
+                                           ("start", "created_on", True, False),
+                                           ("end", "created_on", False, True)):
+            with self.subTest(name):
+                sql = self.filter_sql(ConversationFilters, Conversation, {name: "2021-10-01"})
+                self.assert_day_range(sql, column, lower, upper)
+
+    def test_participant_day_filter(self):
+        self.assert_day_range(self.filter_sql(ParticipantFilters, Participant, {"last_seen": "2021-10-01"}),
+                              "last_seen")
+
+    def test_client_day_filters(self):
+        for name in ("created_on", "updated_on"):
+            with self.subTest(name):
+                self.assert_day_range(self.filter_sql(ClientFilters, Client, {name: "2021-10-01"}), name)
+
+    def test_order_by_uses_declared_keys_with_tiebreaker(self):
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"order_by": "-created_on"})
+        self.assertIn('ORDER BY "w3chat_chat_messages"."created_on" DESC, "w3chat_chat_messages"."id" DESC', sql)
+        sql = self.filter_sql(MessageFilters, ChatMessage, {"order_by": "sequence"})
+        self.assertIn('ORDER BY "w3chat_chat_messages"."conversation_id" ASC, "w3chat_chat_messages"."sequence" ASC',
+                      sql)
+
+    def test_order_by_rejects_undeclared_keys(self):
+        for value in ("message", "-read_on", "sender__name", "?"):
+            with self.subTest(value):
+                filterset = MessageFilters({"order_by": value}, queryset=ChatMessage.objects.all())
+                with self.assertRaises(ValidationError):
+                    filterset.qs
+
+    def test_every_filterset_declares_order_by_keys(self):
+        for filterset_class in BaseFilters.__subclasses__():
+            with self.subTest(filterset_class.__name__):
+                self.assertTrue(filterset_class.order_by_fields)
+        sql = self.filter_sql(LogsFilters, UnitOfHistory, {"order_by": "-created_on"})
+        self.assertIn('ORDER BY "w3chat_unit_of_histories"."id" DESC', sql)
+
+
+class LegacySubscriptionTests(SimpleTestCase):
+    """
+        Per-kind subscriptions are only fed while LEGACY_SUBSCRIPTIONS is on, the inbox always is.
+    """
+
+    def broadcast_groups(self):
+        with mock.patch.object(channels_graphql_ws.Subscription, "broadcast_sync") as broadcast:
+            ChatSubscription.broadcast(payload=None, group="participant")
+            TypingSubscription.broadcast(payload="chat", group="participant")
+            InboxSubscription.notify("participant", InboxEvent.TYPING, chat_id="chat")
+        return [call.kwargs["group"] for call in broadcast.call_args_list]
+
+    def test_legacy_broadcasts_can_be_turned_off(self):
+        with self.settings(LEGACY_SUBSCRIPTIONS=True):
+            self.assertEqual(self.broadcast_groups(), ["participant", "participant", "inbox-participant"])
+        with self.settings(LEGACY_SUBSCRIPTIONS=False):
+            self.assertEqual(self.broadcast_groups(), ["inbox-participant"])
+
+
+class MessageCountBufferTests(SimpleTestCase):
+    """
+        Unread count updates of an interval share one push through the shared store,
+        every update is pushed when the store does not answer.
+    """
+
+    def notify(self, times):
+        participant_id = uuid.uuid4()
+        with mock.patch("chat.tasks.broadcast_message_count.apply_async") as push:
+            for _ in range(times):
+                notify_message_count(participant_id)
+        return push.call_count
+
+    def test_updates_of_an_interval_share_a_push(self):
+        cache.clear()
+        with mock.patch.object(auth_cache.shared, "add", wraps=auth_cache.shared.add) as add:
+            self.assertEqual(self.notify(3), 1)
+        self.assertEqual(add.call_count, 3)
+
+    def test_unavailable_store_pushes_every_update(self):
+        with mock.patch.object(auth_cache.shared, "add", side_effect=redis.ConnectionError):
+            self.assertEqual(self.notify(2), 2)
+
+
+class ChatTestCase(TestCase):
+    """
+        A client with two participants, alice and bob, in one conversation.
+    """
+
+    def setUp(self):
+        admin = User.objects.create_user('admin', 'admin@example.com', 'password')
+        self.client_obj = Client.objects.create(auth_key='key', admin=admin, client_name='client',
+                                                url='http://example.com')
+        self.alice = Participant.objects.create(client=self.client_obj, user_id='1', name='alice')
+        self.bob = Participant.objects.create(client=self.client_obj, user_id='2', name='bob')
+        Conversation.objects.create(client=self.client_obj)
+        self.conversation = Conversation.objects.get()
+        self.conversation.participants.add(self.alice, self.bob)
+
+    def execute(self, participant, query, **variables):
+        context = types.SimpleNamespace(client=self.client_obj, user=participant, headers={}, META={}, GET={})
+        return schema.execute(query, context_value=context, variables=variables)
+
+
+class MessageSequenceTests(ChatTestCase):
+    """
+        Sequences are unique without a unique key, a reservation fails when a message already uses the sequence.
+    """
+
+    def test_used_sequence_is_not_reserved(self):
+        self.assertEqual(self.conversation.add_message(sender=self.alice, message='one').sequence, 1)
+        ChatMessage.objects.create(conversation=self.conversation, sender=self.alice, message='two', sequence=2)
+        with self.assertRaises(IntegrityError):
+            self.conversation.add_message(sender=self.alice, message='three')
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_sequence, 1)
+
+
+class PartitionTests(ChatTestCase):
+    """
+        Monthly partitions are created from the rows of the default partition, detached with the rows
+        referring to them, and dropped once their messages are archived.
+    """
+    month = datetime.datetime(2001, 1, 1, tzinfo=datetime.timezone.utc)
+    before = datetime.datetime(2001, 2, 1, tzinfo=datetime.timezone.utc)
+
+    def setUp(self):
+        super().setUp()
+        Conversation.objects.filter(id=self.conversation.id).update(created_on=self.month)
+        self.conversation.refresh_from_db()
+        self.old = [self.conversation.add_message(sender=self.alice, message=str(index)) for index in range(2)]
+        ChatMessage.objects.filter(id__in=[message.id for message in self.old]).update(
+            created_on=self.month + datetime.timedelta(days=1)
+        )
+
+    def partition_rows(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT id FROM {name} WHERE conversation_id = %s ORDER BY sequence",
+                           [self.conversation.id])
+            return [message_id for message_id, in cursor.fetchall()]
+
+    def test_create_partition_moves_the_default_rows(self):
+        ids = [message.id for message in self.old]
+        self.assertEqual(self.partition_rows(DEFAULT_PARTITION), ids)
+        name = create_partition(self.month)
+        self.assertIn((name, self.month), message_partitions())
+        self.assertEqual(self.partition_rows(name), ids)
+        self.assertEqual(self.partition_rows(DEFAULT_PARTITION), [])
+
+    def test_detach_partitions_forgets_the_rows_referring_to_them(self):
+        name = create_partition(self.month)
+        FavoriteMessage.objects.create(participant=self.bob, message=self.old[0])
+        reply = self.conversation.add_message(sender=self.bob, message='reply', reply_to=self.old[0])
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")  # the test transaction holds deferred checks
+        self.assertEqual(detach_partitions(self.before), [name])
+        self.assertNotIn(name, [partition for partition, month in message_partitions()])
+        self.assertFalse(ChatMessage.objects.filter(id=self.old[0].id).exists())
+        self.assertFalse(FavoriteMessage.objects.filter(message_id=self.old[0].id).exists())
+        self.assertFalse(ChatChange.objects.filter(message_id=self.old[0].id).exists())
+        self.assertIsNone(ChatMessage.objects.get(id=reply.id).reply_to_id)
+        self.assertEqual(len(self.partition_rows(name)), 2)  # the detached table keeps its rows
+
+    def test_partition_commands(self):
+        ahead = len([month for name, month in message_partitions() if month > timezone.now()]) + 1
+        output = io.StringIO()
+        call_command("create_message_partitions", ahead=ahead, stdout=output)
+        self.assertEqual(len(re.findall(r"^created ", output.getvalue(), re.MULTILINE)), 1)
+        create_partition(self.month)
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")  # the test transaction holds deferred checks
+        output = io.StringIO()
+        call_command("detach_message_partitions", "2001-02", stdout=output)
+        self.assertEqual(output.getvalue(), "detached  w3chat_chat_messages_p200101\n")
+        for command, arguments in (("create_message_partitions", ["--ahead", "-1"]),
+                                   ("detach_message_partitions", ["2001"])):
+            with self.subTest(command), self.assertRaises(CommandError):
+                call_command(command, *arguments)
+
+    def test_drop_empty_partitions_keeps_the_rows_left_in_the_table(self):
+        name = create_partition(self.month)
+        Conversation.objects.filter(id=self.conversation.id).update(archived_up_to=1)
+        self.assertEqual(drop_empty_partitions(self.before), [])
+        Conversation.objects.filter(id=self.conversation.id).update(archived_up_to=2)
+        self.assertEqual(drop_empty_partitions(self.before), [name])
+        self.assertNotIn(name, [partition for partition, month in message_partitions()])
+        self.assertEqual(self.partition_rows(DEFAULT_PARTITION), [message.id for message in self.old])
+
+
+class ChangeFeedTests(ChatTestCase):
+    """
+        Changes are read after a cursor of positions that is gap-free in the feed of each participant.
+    """
+    query = """
+        query($since: Float) {
+            userChanges(since: $since) { edges { node { position changeType sequence } } }
+        }
+    """
+
+    def changes(self, participant, since=None):
+        result = self.execute(participant, self.query, since=since)
+        self.assertIsNone(result.errors)
+        return [(edge['node']['position'], edge['node']['changeType'], edge['node']['sequence'])
+                for edge in result.data['userChanges']['edges']]
+
+    def test_positions_are_gap_free_per_participant(self):
+        for text in ('one', 'two'):
+            self.conversation.add_message(sender=self.alice, message=text)
+        self.conversation.mark_read(self.bob)
+        ChatChange.record(self.conversation, ChatChange.ChangeType.CLEARED,
+                          [self.conversation.history().first()], participants=[self.alice])
+        self.assertEqual(self.changes(self.bob), [(1, 'message', 1), (2, 'message', 2), (3, 'read', 3)])
+        self.assertEqual(self.changes(self.alice), [(1, 'message', 1), (2, 'message', 2), (3, 'read', 3),
+                                                    (4, 'cleared', 4)])
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.last_change, 4)
+
+    def test_since_returns_later_changes(self):
+        for text in ('one', 'two', 'three'):
+            self.conversation.add_message(sender=self.alice, message=text)
+        self.assertEqual(self.changes(self.bob, since=2), [(3, 'message', 3)])
+        self.assertEqual(self.changes(self.bob, since=3), [])
+
+    def test_positions_of_several_messages(self):
+        messages = [self.conversation.add_message(sender=self.alice, message=str(index)) for index in range(3)]
+        ChatChange.record(self.conversation, ChatChange.ChangeType.DELETED, messages, participants=[self.bob])
+        self.assertEqual([change[0] for change in self.changes(self.bob, since=3)], [4, 5, 6])
+
+
+class ChangePositionLockTests(TransactionTestCase):
+    """
+        A writer holds the feed of a participant until it commits, a later writer waits for it.
+    """
+
+    def test_positions_wait_for_the_open_transaction(self):
+        admin = User.objects.create_user('admin', 'admin@example.com', 'password')
+        client = Client.objects.create(auth_key='key', admin=admin, client_name='client', url='http://example.com')
+        participant = Participant.objects.create(client=client, user_id='1', name='alice')
+        errors = []
+
+        def reserve():
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL lock_timeout = '200ms'")
+                    ChatChange.next_positions([participant], 1)
+            except OperationalError as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            self.assertEqual(ChatChange.next_positions([participant], 2), {participant.id: 1})
+            thread = threading.Thread(target=reserve)
+            thread.start()
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(ChatChange.next_positions([participant], 1), {participant.id: 3})
+
+
+class MarkConversationReadTests(ChatTestCase):
+    """
+        Reading a conversation broadcasts the last read message, nothing when the read messages were deleted meanwhile.
+    """
+    query = """
+        mutation($chatId: ID!) { markConversationRead(chatId: $chatId) { success readCount readUpTo } }
+    """
+
+    def mark_read(self, delete_read=False):
+        mark_read = Conversation.mark_read
+
+        def mark_read_and_delete(conversation, participant, up_to_sequence=None):
+            result = mark_read(conversation, participant, up_to_sequence)
+            conversation.history().update(is_deleted=True)  # deleted by the sender before the broadcast
+            return result
+
+        with mock.patch("chat.mutation.MessageSubscription.broadcast") as broadcast, \
+                mock.patch("chat.mutation.notify_message_count"), \
+                mock.patch.object(Conversation, "mark_read", mark_read_and_delete if delete_read else mark_read):
+            result = self.execute(self.bob, self.query, chatId=str(self.conversation.id))
+        self.assertIsNone(result.errors)
+        return result.data['markConversationRead'], [call.kwargs['payload'] for call in broadcast.call_args_list]
+
+    def test_last_read_message_is_broadcast(self):
+        self.conversation.add_message(sender=self.alice, message='one')
+        last = self.conversation.add_message(sender=self.alice, message='two')
+        result, payloads = self.mark_read()
+        self.assertEqual(result, {'success': True, 'readCount': 2, 'readUpTo': 2})
+        self.assertEqual(payloads, [last])
+
+    def test_only_deleted_messages_broadcast_nothing(self):
+        self.conversation.add_message(sender=self.alice, message='one')
+        result, payloads = self.mark_read(delete_read=True)
+        self.assertEqual(result, {'success': True, 'readCount': 0, 'readUpTo': 1})
+        self.assertEqual(payloads, [])
+
+
+class ReceiptQueryTests(ChatTestCase):
+    """
+        Status of messages comes from annotations of the query that loads them, not a query per message.
+    """
+
+    def count_queries(self, query):
+        with CaptureQueriesContext(connection) as queries:
+            result = self.execute(self.bob, query, chatId=str(self.conversation.id))
+        self.assertIsNone(result.errors)
+        return len(queries)
+
+    def test_changes_do_not_query_per_message(self):
+        query = "query { userChanges { edges { node { message { %s } } } } }"
+        self.conversation.add_message(sender=self.alice, message='one')
+        few = self.count_queries(query % "status readOn deliveredOn")
+        for text in ('two', 'three', 'four'):
+            self.conversation.add_message(sender=self.alice, message=text)
+        self.assertEqual(self.count_queries(query % "status readOn deliveredOn"), few)
+        self.assertEqual(self.count_queries(query % "message"), few)
+
+    def test_replies_and_last_message_do_not_query_per_receipt(self):
+        replied = self.conversation.add_message(sender=self.alice, message='one')
+        for text in ('two', 'three'):
+            self.conversation.add_message(sender=self.bob, message=text, reply_to=replied)
+        replies = "query($chatId: ID) { userConversationMessages(chatId: $chatId) { edges { node { replyTo { %s } } } } }"
+        self.assertEqual(self.count_queries(replies % "status readOn"), self.count_queries(replies % "message"))
+        last = "query { userConversations { edges { node { lastMessage { %s } } } } }"
+        self.assertEqual(self.count_queries(last % "status readOn"), self.count_queries(last % "message"))
+
+
+class ConversationHistoryTests(ChatTestCase):
+    """
+        History pages read the rows of the table and the archived segments as one list,
+        in both orders and with the hidden messages of the participant left out.
+    """
+    query = """
+        query($chatId: ID, $first: Int, $last: Int, $after: String, $before: String, $orderBy: String) {
+            userConversationMessages(chatId: $chatId, first: $first, last: $last, after: $after, before: $before,
+                                     orderBy: $orderBy) {
+                totalCount
+                pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+                edges { node { sequence } }
+            }
+        }
+    """
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        archive_settings = override_settings(MESSAGE_ARCHIVE_ROOT=root, MESSAGE_ARCHIVE_SEGMENT_SIZE=4)
+        archive_settings.enable()
+        self.addCleanup(archive_settings.disable)
+        self.addCleanup(read_segment.cache_clear)
+        super().setUp()
+        now = timezone.now()
+        Conversation.objects.filter(id=self.conversation.id).update(created_on=now - datetime.timedelta(hours=2))
+        self.conversation.refresh_from_db()
+        for sequence in range(1, 11):
+            ChatMessage.objects.create(conversation=self.conversation, sender=self.alice, message=str(sequence),
+                                       sequence=sequence)
+        self.conversation.history().filter(sequence__lte=6).update(created_on=now - datetime.timedelta(hours=1))
+        # segments [1, 4] and [5, 6], messages 7 to 10 stay in the table
+        self.assertEqual(archive_conversation(self.conversation, now - datetime.timedelta(minutes=30)), 6)
+        self.conversation.refresh_from_db()
+        ParticipantConversationState.hide(self.bob, self.conversation, [3, 8])
+
+    def history(self, participant, descending=True):
+        messages = self.conversation.history().visible_to(participant, self.conversation).order_by(
+            '-sequence' if descending else 'sequence')
+        return ConversationHistory(self.conversation, participant, messages, descending)
+
+    def sequences(self, page):
+        return [message.sequence for message in page]
+
+    def fetch(self, participant, **variables):
+        result = self.execute(participant, self.query, chatId=str(self.conversation.id), **variables)
+        self.assertIsNone(result.errors)
+        return result.data['userConversationMessages']
+
+    def test_archive_splits_history(self):
+        self.assertEqual(self.conversation.archived_up_to, 6)
+        self.assertEqual(list(self.conversation.segments.order_by('first_sequence').values_list(
+            'first_sequence', 'last_sequence')), [(1, 4), (5, 6)])
+        self.assertEqual(sorted(self.conversation.history().values_list('sequence', flat=True)), [7, 8, 9, 10])
+
+    def test_replies_across_segments(self):
+        messages = {message.sequence: message for message in self.conversation.history()}
+        for sequence in range(11, 17):
+            messages[sequence] = ChatMessage.objects.create(conversation=self.conversation, sender=self.alice,
+                                                            message=str(sequence), sequence=sequence)
+        ChatMessage.objects.filter(id=messages[13].id).update(reply_to=messages[11])  # in its segment
+        ChatMessage.objects.filter(id=messages[16].id).update(reply_to=messages[12])  # in a later segment
+        now = timezone.now()
+        self.conversation.history().update(created_on=now - datetime.timedelta(hours=1))
+        # segments [7, 10], [11, 14] and [15, 16] in one run
+        self.assertEqual(archive_conversation(self.conversation, now - datetime.timedelta(minutes=30)), 10)
+        self.conversation.refresh_from_db()
+        self.assertEqual(list(self.conversation.history().values_list('sequence', flat=True)), [12])
+        replies = {message.sequence: message.reply_to.sequence
+                   for message in self.history(self.alice)[:] if message.reply_to}
+        self.assertEqual(replies, {13: 11, 16: 12})
+
+    def test_every_window_in_both_orders(self):
+        for participant, visible in ((self.alice, list(range(1, 11))), (self.bob, [1, 2, 4, 5, 6, 7, 9, 10])):
+            for descending in (True, False):
+                expected = visible[::-1] if descending else visible
+                history = self.history(participant, descending)
+                self.assertEqual(len(history), len(expected))
+                for start in range(len(expected) + 1):
+                    for stop in range(start, len(expected) + 1):
+                        with self.subTest(participant=participant.name, descending=descending, start=start,
+                                          stop=stop):
+                            self.assertEqual(self.sequences(history[start:stop]), expected[start:stop])
+
+    def test_page_of_a_page(self):
+        history = self.history(self.bob)
+        self.assertEqual(self.sequences(history[2:7][1:4]), [6, 5, 4])
+        self.assertEqual(self.sequences(history[2:7][3:]), [4, 2])
+        self.assertEqual(self.sequences(history[5:][:2]), [4, 2])
+
+    def test_hidden_range_inside_a_segment(self):
+        ParticipantConversationState.hide(self.alice, self.conversation, [2, 5])
+        self.assertEqual(self.sequences(self.history(self.alice)[:]), [10, 9, 8, 7, 6, 4, 3, 1])
+        ParticipantConversationState.clear(self.alice, self.conversation, 3)
+        ParticipantConversationState.hide(self.alice, self.conversation, [4, 5, 8])
+        self.assertEqual(self.sequences(self.history(self.alice, descending=False)[:]), [6, 7, 9, 10])
+        state = ParticipantConversationState.objects.get(participant=self.alice, conversation=self.conversation)
+        self.assertEqual(state.cleared_up_to, 3)  # archived messages are not read to move it
+        self.assertEqual([(hidden.lower, hidden.upper) for hidden in state.hidden_ranges], [(4, 6), (8, 9)])
+
+    def test_first_and_after_cross_the_archive(self):
+        page = self.fetch(self.bob, first=3)
+        self.assertEqual(page['totalCount'], 8)
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [10, 9, 7])
+        page = self.fetch(self.bob, first=3, after=page['pageInfo']['endCursor'])
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [6, 5, 4])
+        page = self.fetch(self.bob, first=3, after=page['pageInfo']['endCursor'])
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [2, 1])
+        self.assertFalse(page['pageInfo']['hasNextPage'])
+
+    def test_ascending_pages(self):
+        page = self.fetch(self.bob, first=4, orderBy='sequence')
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [1, 2, 4, 5])
+        page = self.fetch(self.bob, first=4, after=page['pageInfo']['endCursor'], orderBy='sequence')
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [6, 7, 9, 10])
+
+    def test_last_and_before_cross_the_archive(self):
+        page = self.fetch(self.bob, last=3)
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [4, 2, 1])
+        page = self.fetch(self.bob, last=3, before=page['pageInfo']['startCursor'])
+        self.assertEqual([edge['node']['sequence'] for edge in page['edges']], [7, 6, 5])
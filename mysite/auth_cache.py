@@ -0,0 +1,266 @@
+import copy
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStore:
+    """
+        Versions, revoked tokens and unread count push intervals kept in redis, so they are seen by every process.
+    """
+
+    def __init__(self, url):
+        self.redis = redis.Redis.from_url(url, socket_timeout=settings.AUTH_CACHE_TIMEOUT_SECONDS,
+                                          decode_responses=True)
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def get_many(self, keys):
+        return {key: value for key, value in zip(keys, self.redis.mget(keys)) if value is not None}
+
+    def set(self, key, value, timeout=None):
+        self.redis.set(key, value, ex=timeout)
+
+    def add(self, key, value, timeout=None):
+        return bool(self.redis.set(key, value, ex=timeout, nx=True))
+
+
+def get_shared_store():
+    if settings.AUTH_CACHE_REDIS_URL:
+        return SharedStore(settings.AUTH_CACHE_REDIS_URL)
+    return cache  # only seen by this process
+
+
+shared = get_shared_store()
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def version_key(model_name, pk):
+    return f"auth-version:{model_name}:{pk}"
+
+
+def invalidate(model_name, pk):
+    """
+        Change the version of a participant or client,
+        cached authentications holding the old version are not served anymore.
+        Versions reach other processes only through the shared store of AUTH_CACHE_REDIS_URL.
+    """
+    try:
+        shared.set(version_key(model_name, pk), uuid.uuid4().hex, None)
+    except redis.RedisError as e:
+        logger.warning("auth cache version of %s %s not changed: %s", model_name, pk, e)
+
+
+def get_versions(participant, create=False):
+    """
+        Versions of a participant and its client, None when the store does not answer.
+        A version is None when its key is missing, never set or culled by the fallback cache. Entries are cached
+        with created versions and a missing one counts as a miss, so a lost version can not match an old entry.
+    """
+    keys = [version_key('participant', participant.pk), version_key('client', participant.client_id)]
+    try:
+        versions = shared.get_many(keys)
+        if create and len(versions) < len(keys):
+            for key in keys:
+                if key not in versions:
+                    shared.add(key, uuid.uuid4().hex, None)
+            versions = shared.get_many(keys)  # the version of a concurrent add wins
+    except redis.RedisError as e:
+        logger.warning("auth cache versions unavailable: %s", e)
+        return None
+    versions = tuple(versions.get(key) for key in keys)
+    return None if None in versions else versions
+
+
+def participant_key(client_id, user_id):
+    return f"participant:{token_digest(f'{client_id}:{user_id}')}"
+
+
+def get_participant(client_id, user_id):
+    """
+        return participant of a client user from cache,
+        None if participant is not cached or participant/client changed meanwhile.
+    """
+    cached = cache.get(participant_key(client_id, user_id))
+    if not cached:
+        return None
+    participant, versions = cached
+    if versions is None or get_versions(participant) != versions:
+        return None
+    return participant
+
+
+def cacheable(participant):
+    """
+        Copy of a participant without last_seen, the field is deferred
+        so online status is read from the database instead of a stale cached value.
+    """
+    participant = copy.copy(participant)
+    participant.__dict__.pop('last_seen', None)
+    return participant
+
+
+def set_participant(participant):
+    cache.set(
+        participant_key(participant.client_id, participant.user_id),
+        (cacheable(participant), get_versions(participant, create=True)),
+        settings.PARTICIPANT_CACHE_SECONDS
+    )
+
+
+def client_config_key(user_id):
+    return f"client-config:{user_id}"
+
+
+def get_client_config(user_id):
+    """
+        return cached client configuration of a dashboard user,
+        None if it is not cached or the client changed meanwhile.
+    """
+    cached = cache.get(client_config_key(user_id))
+    if not cached:
+        return None
+    config, version = cached
+    if config['client_id'] and (version is None or client_version(config['client_id']) != version):
+        return None
+    return config
+
+
+def client_version(client_id, create=False):
+    """
+        Version of a client, None when it is missing or the store does not answer.
+    """
+    key = version_key('client', client_id)
+    try:
+        if create:
+            shared.add(key, uuid.uuid4().hex, None)
+        return shared.get(key)
+    except redis.RedisError as e:
+        logger.warning("auth cache version of client %s unavailable: %s", client_id, e)
+        return None
+
+
+def set_client_config(user_id, config):
+    version = client_version(config['client_id'], create=True) if config['client_id'] else None
+    cache.set(client_config_key(user_id), (config, version), settings.CLIENT_CONFIG_CACHE_SECONDS)
+
+
+def forget_client_config(user_ids):
+    cache.delete_many([client_config_key(user_id) for user_id in user_ids])
+
+
+def get_channel_participant(token):
+    """
+        return participant of a websocket token from cache,
+        None if token is not cached, participant/client changed meanwhile or the token was revoked.
+    """
+    digest = token_digest(token)
+    cached = cache.get(f"channel-auth:{digest}")
+    if not cached:
+        return None
+    participant, versions = cached
+    if versions is None or get_versions(participant) != versions:
+        return None
+    if is_revoked(digest):
+        cache.delete(f"channel-auth:{digest}")
+        return None
+    return participant
+
+
+def set_channel_participant(token, participant):
+    cache.set(
+        f"channel-auth:{token_digest(token)}",
+        (cacheable(participant), get_versions(participant, create=True)),
+        settings.CHANNEL_AUTH_CACHE_SECONDS
+    )
+
+
+def revoked_key(digest):
+    return f"revoked-token:{digest}"
+
+
+def revoke(token, expires=None):
+    """
+        Add a token to the denylist until it expires.
+        With AUTH_CACHE_REDIS_URL the denylist is shared and verified copies of the token are dropped
+        by every process within TOKEN_DENYLIST_CHECK_SECONDS, without it only by this process.
+    """
+    timeout = None if expires is None else max(1, int(expires - time.time()))
+    try:
+        shared.set(revoked_key(token_digest(token)), '1', timeout)
+    except redis.RedisError as e:
+        logger.warning("token not added to the denylist: %s", e)
+
+
+def is_revoked(digest):
+    """
+        When the denylist does not answer tokens are accepted or rejected following TOKEN_DENYLIST_FAIL_OPEN.
+    """
+    try:
+        return bool(shared.get(revoked_key(digest)))
+    except redis.RedisError as e:
+        logger.warning("token denylist unavailable: %s", e)
+        return not settings.TOKEN_DENYLIST_FAIL_OPEN
+
+
+class VerifiedTokens:
+    """
+        Bounded LRU of verified token claims keyed by token digest.
+        Claims are served until the token expires and the denylist is rechecked every few seconds.
+    """
+
+    def __init__(self):
+        self.tokens = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        digest = token_digest(token)
+        now = time.time()
+        with self.lock:
+            entry = self.tokens.get(digest)
+            if entry is None:
+                return None
+            claims, expires, checked_on = entry
+            if now >= expires:
+                del self.tokens[digest]
+                return None
+            self.tokens.move_to_end(digest)
+        if now - checked_on >= settings.TOKEN_DENYLIST_CHECK_SECONDS:
+            if is_revoked(digest):
+                self.discard(token)
+                return None
+            with self.lock:
+                if digest in self.tokens:
+                    self.tokens[digest] = (claims, expires, now)
+        return dict(claims)
+
+    def set(self, token, claims):
+        digest = token_digest(token)
+        now = time.time()
+        if is_revoked(digest):
+            return False
+        expires = min(claims.get('exp', now + settings.VERIFIED_TOKEN_MAX_SECONDS),
+                      now + settings.VERIFIED_TOKEN_MAX_SECONDS)
+        with self.lock:
+            self.tokens[digest] = (dict(claims), expires, now)
+            self.tokens.move_to_end(digest)
+            while len(self.tokens) > settings.VERIFIED_TOKEN_CACHE_SIZE:
+                self.tokens.popitem(last=False)
+        return True
+
+    def discard(self, token):
+        with self.lock:
+            self.tokens.pop(token_digest(token), None)
@@ -9,6 +9,7 @@ from decouple import config
 
 from users.models import Client
 from chat.models import Participant
+from mysite.auth_cache import VerifiedTokens, get_participant, invalidate, revoke, set_participant
 
 User = get_user_model()
 N = config("N", None)
@@ -19,6 +20,8 @@ Q = config("Q", None)
 
 
 class TokenManager:
+    access_tokens = VerifiedTokens()  # verified claims of user tokens
+    client_tokens = VerifiedTokens()  # verified claims of client tokens
 
     @staticmethod
     def get_token(exp, payload, token_type="access"):
@@ -33,6 +36,9 @@ class TokenManager:
 
     @staticmethod
     def decode_token(token):
+        decoded = TokenManager.access_tokens.get(token)
+        if decoded:
+            return decoded
         try:
             decoded = jwt.decode(token, key=settings.SECRET_KEY, algorithms="HS256")
         except jwt.DecodeError:
@@ -40,17 +46,43 @@ class TokenManager:
 
         if timezone.now().timestamp() > decoded['exp']:
             return None
+        if not TokenManager.access_tokens.set(token, decoded):
+            return None  # revoked
         return decoded
 
     @staticmethod
     def decode_client_token(token):
+        decoded = TokenManager.client_tokens.get(token)
+        if decoded:
+            return decoded
         try:
             decoded = jwt.decode(token, key=settings.CLIENT_KEY, algorithms="HS256")
         except jwt.DecodeError:
             return None
 
+        if not TokenManager.client_tokens.set(token, decoded):
+            return None  # revoked
         return decoded
 
+    @staticmethod
+    def revoke_token(token):
+        """
+            Deny a token until it expires, in this and every other process.
+            Only tokens signed by us are denied, others are rejected anyway and would fill the denylist.
+        """
+        for key in (settings.SECRET_KEY, settings.CLIENT_KEY):
+            try:
+                decoded = jwt.decode(token, key=key, algorithms="HS256")
+                break
+            except jwt.InvalidTokenError:
+                continue
+        else:
+            return False
+        revoke(token, decoded.get('exp'))
+        TokenManager.access_tokens.discard(token)
+        TokenManager.client_tokens.discard(token)
+        return True
+
     @staticmethod
     def get_access(payload):
         token_expiration_time = 24 * 60
@@ -182,10 +214,16 @@ class ClientAuthentication:
     @staticmethod
     def get_participant(client, participant_id, username):
         try:
-            participant, created = Participant.objects.get_or_create(client=client, user_id=participant_id)
+            participant = get_participant(client.id, participant_id)
+            if participant is None:
+                participant = Participant.upsert(client, participant_id, username)
+                set_participant(participant)
+            participant.client = client
             if participant.name != username:
+                Participant.objects.filter(pk=participant.pk).update(name=username)
                 participant.name = username
-                participant.save()
+                invalidate('participant', participant.pk)
+                set_participant(participant)
             return participant
         except Exception as e:
             return None
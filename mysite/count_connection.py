@@ -5,6 +5,7 @@ from graphene import Connection
 
 class CountConnection(Connection):
     total_count = graphene.Int()
+    field_costs = {"total_count": 1}  # count query
 
     class Meta:
         abstract = True
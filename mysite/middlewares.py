@@ -1,12 +1,14 @@
 
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 
+from .auth_cache import get_channel_participant, set_channel_participant
 from .authentication import Authentication, ClientAuthentication
 
 
 @database_sync_to_async
-def get_user(token_key):
+def authenticate_channel(token_key):
     try:
         user = ClientAuthentication(token_key).channel_auth()
         return user
@@ -14,22 +16,43 @@ def get_user(token_key):
         return None
 
 
+async def get_user(token_key):
+    # the cache and the shared store block, they are called off the event loop
+    user = await sync_to_async(get_channel_participant, thread_sensitive=False)(token_key)
+    if user is None:
+        user = await authenticate_channel(token_key)
+        if user:
+            await sync_to_async(set_channel_participant, thread_sensitive=False)(token_key, user)
+    if user is not None and 'last_seen' in user.get_deferred_fields():
+        # cached participants leave last_seen out, it is read here so the consumer never queries on the event loop
+        await database_sync_to_async(user.refresh_from_db)(fields=['last_seen'])
+    return user
+
+
 class W3AuthMiddleware(object):
 
     def resolve(self, next, root, info, **kwargs):
-        info.context.user = self.authorize_user(info)
-        if self.authorize_client(info):
-            info.context.client, info.context.user = self.authorize_client(info)
+        # resolve runs for every field, authenticate only once per operation
+        if not getattr(info.context, '_w3_authenticated', False):
+            self.authenticate(info.context)
         return next(root, info, **kwargs)
 
+    @classmethod
+    def authenticate(cls, request):
+        request.user = cls.authorize_user(request)
+        client_auth = cls.authorize_client(request)
+        if client_auth:
+            request.client, request.user = client_auth
+        request._w3_authenticated = True
+
     @staticmethod
-    def authorize_user(info):
-        auth = Authentication(info.context)
+    def authorize_user(request):
+        auth = Authentication(request)
         return auth.authenticate()
 
     @staticmethod
-    def authorize_client(info):
-        auth = ClientAuthentication(info.context)
+    def authorize_client(request):
+        auth = ClientAuthentication(request)
         return auth.authenticate()
 
 
@@ -2,6 +2,8 @@
 
 from graphql import GraphQLError
 
+from mysite.rate_limit import check_rate, retry_after
+
 
 def is_authenticated(func):
     def wrapper(cls, info, **kwargs):
@@ -57,3 +59,27 @@ def is_client_request(func):
         return func(cls, info, **kwargs)
 
     return wrapper
+
+
+def rate_limited(action):
+    """
+        Limit how often a client and each of its participants can call a mutation,
+        the request is rejected before the resolver runs.
+    """
+    def decorator(func):
+        def wrapper(cls, info, **kwargs):
+            wait = check_rate(action, getattr(info.context, "client", None), info.context.user)
+            if wait:
+                raise GraphQLError(
+                    message="Too many requests!",
+                    extensions={
+                        "error": "Rate limit exceeded, try again later.",
+                        "code": "rate_limited",
+                        "retry_after": retry_after(wait)
+                    }
+                )
+            return func(cls, info, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,205 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from graphql import GraphQLError, execute, introspection_query, parse
+from graphql.backend import GraphQLCoreBackend, GraphQLDocument
+from graphql.execution import ExecutionResult
+from graphql.language import ast
+from graphql.validation import validate
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode()).hexdigest()
+
+
+def persisted_query_error(message, code):
+    return GraphQLError(
+        message=message,
+        extensions={
+            "message": message,
+            "code": code
+        }
+    )
+
+
+def is_introspection(document_ast):
+    """
+        True when every operation of the document only selects schema meta fields.
+    """
+    operations = [definition for definition in document_ast.definitions
+                  if isinstance(definition, ast.OperationDefinition)]
+    return bool(operations) and all(
+        operation.operation == "query" and all(
+            isinstance(selection, ast.Field) and selection.name.value.startswith("__")
+            for selection in operation.selection_set.selections
+        )
+        for operation in operations
+    )
+
+
+class ValidatedDocument(GraphQLDocument):
+    """
+        Parsed document with the result of its validation,
+        executing it does not validate again.
+        Results of introspection documents only depend on the schema and are kept.
+    """
+
+    def __init__(self, schema, document_string, document_ast=None, execute_params=None):
+        document_ast = document_ast or parse(document_string)
+        self.validation_errors = validate(schema, document_ast)
+        self.execute_params = execute_params or {}
+        self.introspection_results = {} if is_introspection(document_ast) else None
+        super().__init__(schema, document_string, document_ast, self.execute_validated)
+
+    def execute_validated(self, *args, **kwargs):
+        if self.validation_errors:
+            return ExecutionResult(errors=self.validation_errors, invalid=True)
+        options = {**self.execute_params, **kwargs}
+        if self.introspection_results is None or args:
+            return execute(self.schema, self.document_ast, *args, **options)
+
+        key = json.dumps([options.get("operation_name"), options.get("variable_values")], sort_keys=True, default=str)
+        result = self.introspection_results.get(key)
+        if result is None:
+            result = execute(self.schema, self.document_ast, **options)
+            if isinstance(result, ExecutionResult) and not result.errors and len(self.introspection_results) < 16:
+                self.introspection_results[key] = result
+        return result
+
+
+class PersistedQueries:
+    """
+        Registry of persisted queries by sha256 hash.
+        Queries of the manifest are always kept, registered ones are kept in a bounded LRU
+        and in the persisted queries cache, which other processes only see when it is shared.
+    """
+
+    def __init__(self):
+        self.manifest = None
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load_manifest(self, schema):
+        """
+            manifest is a json object of hash to query, as written by the client code generators.
+        """
+        with self.lock:
+            if self.manifest is not None:
+                return
+            manifest = {}
+            if settings.PERSISTED_QUERIES_MANIFEST:
+                with open(settings.PERSISTED_QUERIES_MANIFEST) as file:
+                    for digest, query in json.load(file).items():
+                        manifest[digest] = ValidatedDocument(schema, query)
+            self.manifest = manifest
+
+    def get(self, schema, digest, shared=True):
+        if self.manifest is None:
+            self.load_manifest(schema)
+        document = self.manifest.get(digest)
+        if document is not None:
+            return document
+        with self.lock:
+            document = self.documents.get(digest)
+            if document is not None:
+                self.documents.move_to_end(digest)
+                return document
+        if not shared:
+            return None
+        query = caches[settings.PERSISTED_QUERIES_CACHE].get(f"persisted-query:{digest}")
+        if query is None:
+            return None
+        return self.add(schema, digest, query)
+
+    def register(self, schema, query):
+        """
+            Register a query sent together with its hash.
+            Invalid queries are not registered and report their errors on execution.
+        """
+        digest = query_hash(query)
+        document = self.get(schema, digest)
+        if document is None:
+            document = ValidatedDocument(schema, query)
+            if not document.validation_errors:
+                caches[settings.PERSISTED_QUERIES_CACHE].set(
+                    f"persisted-query:{digest}", query, settings.PERSISTED_QUERIES_TIMEOUT_SECONDS
+                )
+                self.add(schema, digest, query, document)
+        return document
+
+    def add(self, schema, digest, query, document=None):
+        document = document or ValidatedDocument(schema, query)
+        with self.lock:
+            self.documents[digest] = document
+            self.documents.move_to_end(digest)
+            while len(self.documents) > settings.PERSISTED_QUERIES_MAX_SIZE:
+                self.documents.popitem(last=False)
+        return document
+
+    def resolve(self, schema, query, extensions):
+        """
+            Return the query text of a request following the automatic persisted query protocol:
+            a known hash replaces the query, an unknown hash is answered with PersistedQueryNotFound
+            and the client retries with hash and query to register it.
+        """
+        persisted = (extensions or {}).get("persistedQuery")
+        if not persisted:
+            return query
+        digest = persisted.get("sha256Hash")
+        if persisted.get("version") != 1 or not digest:
+            raise persisted_query_error("Unsupported persisted query.", "PERSISTED_QUERY_INVALID")
+        if query:
+            if query_hash(query) != digest:
+                raise persisted_query_error("Provided sha does not match query.", "PERSISTED_QUERY_HASH_MISMATCH")
+            if not settings.PERSISTED_QUERIES_REGISTER and self.get(schema, digest) is None:
+                raise persisted_query_error("PersistedQueryNotSupported", "PERSISTED_QUERY_NOT_SUPPORTED")
+            self.register(schema, query)
+            return query
+        document = self.get(schema, digest)
+        if document is None:
+            raise persisted_query_error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+        return document.document_string
+
+
+persisted_queries = PersistedQueries()
+
+
+class DocumentCacheBackend(GraphQLCoreBackend):
+    """
+        Keep parsed and validated documents in a bounded LRU by query text,
+        documents of persisted queries are served from the registry.
+    """
+
+    def __init__(self, executor=None):
+        super().__init__(executor)
+        self.documents = OrderedDict()
+        self.lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        if not isinstance(document_string, str):
+            return super().document_from_string(schema, document_string)
+
+        with self.lock:
+            document = self.documents.get(document_string)
+            if document is not None and document.schema is schema:
+                self.documents.move_to_end(document_string)
+                return document
+
+        document = persisted_queries.get(schema, query_hash(document_string), shared=False)
+        if document is None or document.schema is not schema:
+            document = ValidatedDocument(schema, document_string, execute_params=self.execute_params)
+        with self.lock:
+            self.documents[document_string] = document
+            while len(self.documents) > settings.GRAPHQL_DOCUMENT_CACHE_SIZE:
+                self.documents.popitem(last=False)
+        return document
+
+    def prepare_introspection(self, schema):
+        """
+            Build the result of the standard introspection query, so it is never computed on a request.
+        """
+        self.document_from_string(schema, introspection_query).execute()
@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from graphql.language import ast
+
+
+def operation_label(document_ast, operation_name=None):
+    if operation_name:
+        return operation_name
+    for definition in document_ast.definitions:
+        if isinstance(definition, ast.OperationDefinition):
+            return definition.name.value if definition.name else f"anonymous {definition.operation}"
+    return "anonymous"
+
+
+class FieldTiming:
+
+    def __init__(self):
+        self.calls = 0
+        self.duration = 0.0
+        self.queries = 0
+        self.query_duration = 0.0
+
+    def add(self, calls, duration, queries, query_duration):
+        self.calls += calls
+        self.duration += duration
+        self.queries += queries
+        self.query_duration += query_duration
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "durationMs": round(self.duration * 1000, 3),
+            "sqlQueries": self.queries,
+            "sqlDurationMs": round(self.query_duration * 1000, 3),
+        }
+
+
+class OperationProfile:
+    """
+        Wall time and SQL queries of the resolvers of one operation, by parent type and field.
+        Time of a field is the time of its own resolver, nested fields are counted separately.
+    """
+
+    def __init__(self, operation, report=False, sampled=False):
+        self.operation = operation
+        self.report = report  # return the profile in the response extensions
+        self.sampled = sampled  # add the profile to the statistics of the process
+        self.started = time.perf_counter()
+        self.duration = None
+        self.fields = {}
+        self.lock = threading.Lock()
+
+    def measure(self, next, root, info, **args):
+        timing = [0, 0.0]
+
+        def count_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                timing[0] += 1
+                timing[1] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                return next(root, info, **args)
+        finally:
+            duration = time.perf_counter() - started
+            key = f"{info.parent_type.name}.{info.field_name}"
+            with self.lock:
+                self.fields.setdefault(key, FieldTiming()).add(1, duration, timing[0], timing[1])
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.started
+            if self.sampled:
+                resolver_stats.add(self)
+
+    def as_dict(self):
+        fields = sorted(self.fields.items(), key=lambda item: item[1].duration, reverse=True)
+        return {
+            "operation": self.operation,
+            "durationMs": round((self.duration or 0) * 1000, 3),
+            "sqlQueries": sum(timing.queries for key, timing in fields),
+            "fields": {key: timing.as_dict() for key, timing in fields},
+        }
+
+
+def start_profile(request, operation):
+    """
+        Profile an operation when an admin asks for it with the profile header
+        or when it is sampled for the statistics.
+    """
+    report = bool(request.headers.get(settings.GRAPHQL_PROFILE_HEADER)) and getattr(request.user, "is_admin", False)
+    sampled = random.random() < settings.GRAPHQL_PROFILE_SAMPLE_RATE
+    request.profile = OperationProfile(operation, report, sampled) if report or sampled else None
+    return request.profile
+
+
+class ProfilingMiddleware:
+
+    def resolve(self, next, root, info, **args):
+        profile = getattr(info.context, "profile", None)
+        if profile is None:
+            return next(root, info, **args)
+        return profile.measure(next, root, info, **args)
+
+
+class ResolverStats:
+    """
+        Timings of sampled operations aggregated in this process, by operation and field.
+    """
+
+    def __init__(self):
+        self.operations = {}
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            operation = self.operations.get(profile.operation)
+            if operation is None:
+                if len(self.operations) >= settings.GRAPHQL_PROFILE_MAX_OPERATIONS:
+                    return
+                operation = self.operations[profile.operation] = {"calls": 0, "duration": 0.0, "fields": {}}
+            operation["calls"] += 1
+            operation["duration"] += profile.duration
+            for key, timing in profile.fields.items():
+                operation["fields"].setdefault(key, FieldTiming()).add(
+                    timing.calls, timing.duration, timing.queries, timing.query_duration
+                )
+
+    def rows(self, operation_name=None):
+        """
+            One row per operation field, share is the part of the operation time spent in the field.
+        """
+        rows = []
+        with self.lock:
+            for name, operation in self.operations.items():
+                if operation_name and name != operation_name:
+                    continue
+                for key, timing in operation["fields"].items():
+                    rows.append({
+                        "operation_name": name,
+                        "field": key,
+                        "operations": operation["calls"],
+                        "calls": timing.calls,
+                        "duration_ms": timing.duration * 1000,
+                        "sql_queries": timing.queries,
+                        "sql_duration_ms": timing.query_duration * 1000,
+                        "share": timing.duration / operation["duration"] if operation["duration"] else 0,
+                    })
+        return sorted(rows, key=lambda row: row["duration_ms"], reverse=True)
+
+    def clear(self):
+        with self.lock:
+            self.operations = {}
+
+
+resolver_stats = ResolverStats()
@@ -0,0 +1,149 @@
+from django.conf import settings
+from graphene.relay import Connection
+from graphene.utils.str_converters import to_snake_case
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+from graphql.language import ast
+from graphql.type import (
+    GraphQLInterfaceType,
+    GraphQLList,
+    GraphQLNonNull,
+    GraphQLObjectType,
+    GraphQLUnionType,
+)
+from graphql.type.definition import get_named_type
+
+
+def field_hint(parent_type, field_name):
+    """
+        Cost hint of a field from the `field_costs` of its graphene type, by python field name.
+    """
+    field_costs = getattr(getattr(parent_type, "graphene_type", None), "field_costs", {})
+    return field_costs.get(to_snake_case(field_name))
+
+
+def is_list(field_type):
+    while isinstance(field_type, GraphQLNonNull):
+        field_type = field_type.of_type
+    return isinstance(field_type, GraphQLList)
+
+
+def is_connection(named_type):
+    graphene_type = getattr(named_type, "graphene_type", None)
+    return isinstance(graphene_type, type) and issubclass(graphene_type, Connection)
+
+
+def argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        return variables.get(value.name.value)
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+    return None
+
+
+def page_size(field, variables):
+    """
+        Number of nodes a connection can return, the relay limit when first/last are missing.
+        graphene-django also fills in the limit when neither is given.
+    """
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    sizes = [
+        argument_value(argument.value, variables) for argument in field.arguments
+        if argument.name.value in ("first", "last")
+    ]
+    sizes = [max(size, 0) for size in sizes if isinstance(size, int)]
+    if not sizes:
+        return max_limit or settings.QUERY_COST_DEFAULT_PAGE_SIZE
+    return min(max(sizes), max_limit) if max_limit else max(sizes)
+
+
+class QueryCost:
+    """
+        Static cost of an operation, every object field costs one and scalars are free unless hinted.
+        Nested selections are multiplied by the page size of the enclosing connection
+        and by QUERY_COST_LIST_SIZE for plain lists.
+    """
+
+    def __init__(self, schema, document_ast, variables=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.fragments = {
+            definition.name.value: definition for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+        self.operations = [
+            definition for definition in document_ast.definitions
+            if isinstance(definition, ast.OperationDefinition)
+        ]
+
+    def operation_cost(self, operation_name=None):
+        for operation in self.operations:
+            if not operation_name or (operation.name and operation.name.value == operation_name):
+                root_type = {
+                    "query": self.schema.get_query_type(),
+                    "mutation": self.schema.get_mutation_type(),
+                    "subscription": self.schema.get_subscription_type(),
+                }[operation.operation]
+                return self.selection_cost(root_type, operation.selection_set, set())
+        return 0
+
+    def selection_cost(self, parent_type, selection_set, visited, page=None):
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                cost += self.field_cost(parent_type, selection, visited, page)
+            elif isinstance(selection, ast.InlineFragment):
+                fragment_type = self.fragment_type(selection, parent_type)
+                cost += self.selection_cost(fragment_type, selection.selection_set, visited, page)
+            elif isinstance(selection, ast.FragmentSpread):
+                name = selection.name.value
+                if name in visited or name not in self.fragments:
+                    continue
+                fragment = self.fragments[name]
+                cost += self.selection_cost(self.fragment_type(fragment, parent_type), fragment.selection_set,
+                                            visited | {name}, page)
+        return cost
+
+    def fragment_type(self, fragment, parent_type):
+        if fragment.type_condition:
+            return self.schema.get_type(fragment.type_condition.name.value) or parent_type
+        return parent_type
+
+    def field_cost(self, parent_type, field, visited, page):
+        name = field.name.value
+        fields = getattr(parent_type, "fields", {})
+        if name.startswith("__") or name not in fields:
+            return 0
+        field_type = fields[name].type
+        named_type = get_named_type(field_type)
+
+        composite = isinstance(named_type, (GraphQLObjectType, GraphQLInterfaceType, GraphQLUnionType))
+        hint = field_hint(parent_type, name)
+        if hint is None:
+            hint = 1 if composite else 0
+        if not field.selection_set or not composite:
+            return hint
+
+        if is_connection(named_type):
+            return hint + self.selection_cost(named_type, field.selection_set, visited, page_size(field, self.variables))
+        multiplier = (page or settings.QUERY_COST_LIST_SIZE) if is_list(field_type) else 1
+        return hint + multiplier * self.selection_cost(named_type, field.selection_set, visited)
+
+
+def check_query_cost(schema, document_ast, operation_name, variables, client=None):
+    """
+        Reject an operation whose static cost is over the budget of the requesting client.
+    """
+    cost = QueryCost(schema, document_ast, variables).operation_cost(operation_name)
+    budget = getattr(client, "max_query_cost", None) or settings.DEFAULT_MAX_QUERY_COST
+    if cost > budget:
+        raise GraphQLError(
+            message="Query is too expensive.",
+            extensions={
+                "message": f"Query cost {cost} is over the limit of {budget}.",
+                "code": "query_too_expensive",
+                "cost": cost,
+                "limit": budget
+            }
+        )
+    return cost
@@ -0,0 +1,163 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# take one token from every bucket, or none of them and return the seconds to wait
+TAKE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local available = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    available = math.min(burst, available + math.max(0, now - updated) * rate)
+    if available < 1 then
+        wait = math.max(wait, (1 - available) / rate)
+    end
+    tokens[i] = available
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HMSET', key, 'tokens', tostring(tokens[i] - 1), 'updated', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return '0'
+"""
+
+
+class MemoryBuckets:
+    """
+        Token buckets of this process, stand-in when no shared store is configured.
+        Buckets are kept in a bounded LRU, an evicted bucket is full again.
+    """
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, limits):
+        now = time.monotonic()
+        with self.lock:
+            tokens = []
+            for key, rate, burst in limits:
+                available, updated = self.buckets.get(key, (burst, now))
+                tokens.append(min(burst, available + max(0.0, now - updated) * rate))
+            wait = max([(1 - available) / rate for available, (key, rate, burst) in zip(tokens, limits)
+                        if available < 1], default=0)
+            if wait:
+                return wait
+            for available, (key, rate, burst) in zip(tokens, limits):
+                self.buckets[key] = (available - 1, now)
+                self.buckets.move_to_end(key)
+            while len(self.buckets) > settings.RATE_LIMIT_MEMORY_SIZE:
+                self.buckets.popitem(last=False)
+        return 0
+
+
+class RedisBuckets:
+    """
+        Token buckets shared by every process, all buckets of a call are checked in one round trip.
+    """
+
+    def __init__(self, url):
+        self.redis = redis.Redis.from_url(url, socket_timeout=settings.RATE_LIMIT_TIMEOUT_SECONDS)
+        self.script = self.redis.register_script(TAKE_SCRIPT)
+
+    def take(self, limits):
+        args = [time.time()]
+        for key, rate, burst in limits:
+            args += [rate, burst]
+        return float(self.script(keys=[key for key, rate, burst in limits], args=args))
+
+
+def get_buckets():
+    if settings.RATE_LIMIT_REDIS_URL:
+        return RedisBuckets(settings.RATE_LIMIT_REDIS_URL)
+    return MemoryBuckets()
+
+
+buckets = get_buckets()
+
+
+def parse_limit(limit):
+    """
+        (requests, seconds) of a limit, None when it is not two positive numbers.
+    """
+    try:
+        count, seconds = limit
+        count, seconds = float(count), float(seconds)
+    except (TypeError, ValueError):
+        return None
+    if not count > 0 or not seconds > 0:
+        return None
+    return count, seconds
+
+
+def client_limits(client, action):
+    """
+        Overrides of an action from Client.rate_limits, malformed entries are left out.
+    """
+    rate_limits = getattr(client, "rate_limits", None) or {}
+    action_limits = rate_limits.get(action) if isinstance(rate_limits, dict) else None
+    if not isinstance(action_limits, dict):
+        if action_limits:
+            logger.warning("rate limits of %s for %s are not an object, defaults are used", client, action)
+        return {}
+    return action_limits
+
+
+def get_limits(action, client, participant):
+    """
+        Buckets of an action as (key, tokens per second, burst),
+        limits of the client override the defaults of RATE_LIMITS.
+        An empty limit turns a scope off, an invalid one falls back to the default.
+    """
+    overrides = client_limits(client, action)
+    owners = {"client": client, "participant": participant}
+    limits = []
+    for scope, owner in owners.items():
+        limit = overrides.get(scope, settings.RATE_LIMITS.get(action, {}).get(scope))
+        if owner is None or not limit:
+            continue
+        parsed = parse_limit(limit)
+        if parsed is None:
+            logger.warning("invalid rate limit %r of %s for %s %s, default is used", limit, client, action, scope)
+            parsed = parse_limit(settings.RATE_LIMITS.get(action, {}).get(scope))
+            if parsed is None:
+                continue
+        count, seconds = parsed
+        limits.append((f"rate-limit:{action}:{scope}:{owner.pk}", count / seconds, count))
+    return limits
+
+
+def check_rate(action, client, participant):
+    """
+        Take a token of the client and of the participant for an action,
+        return the seconds to wait when one of the buckets is empty.
+    """
+    limits = get_limits(action, client, participant)
+    if not limits:
+        return 0
+    try:
+        return buckets.take(limits)
+    except Exception as e:
+        logger.warning("rate limit unavailable: %s", e)  # requests are not blocked by the counter store
+        return 0
+
+
+def retry_after(wait):
+    return max(1, math.ceil(wait))
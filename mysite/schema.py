@@ -1,7 +1,9 @@
 import graphene
+from graphql.backend import set_default_backend
 
 import users.schema as user_schema
 import chat.schema as chat_schema
+from mysite.persisted_queries import DocumentCacheBackend
 
 
 class Query(
@@ -28,3 +30,7 @@ class Subscription(
 
 
 schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
+
+backend = DocumentCacheBackend()
+backend.prepare_introspection(schema)
+set_default_backend(backend)
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'corsheaders',
     'graphene_django',
 
@@ -177,19 +178,116 @@ DB_PREFIX = 'w3chat'
 
 OFFLINE_TIME_DELTA_MINUTES = 2
 
+# unread count pushes of a participant are buffered and sent at most once per interval
+MESSAGE_COUNT_BROADCAST_SECONDS = 1
+
+# websocket handshakes of a token are served from cache for this long
+CHANNEL_AUTH_CACHE_SECONDS = 60
+
+# participants of client requests are served from cache for this long
+PARTICIPANT_CACHE_SECONDS = 300
+
+# client configuration of dashboard users is served from cache for this long
+CLIENT_CONFIG_CACHE_SECONDS = 300
+
+# versions invalidating cached participants and clients, the token denylist and unread count push intervals are
+# shared by the processes through redis, without it a change or a logout is only seen by the process that made it
+AUTH_CACHE_REDIS_URL = config('AUTH_CACHE_REDIS_URL', None)
+AUTH_CACHE_TIMEOUT_SECONDS = 0.5  # cached entries are not served when the store does not answer in time
+
+# per-kind subscriptions (chat, message, count, typing) are fed next to the inbox subscription that carries
+# all of them, turn them off once every client subscribes to the inbox so each event is sent once
+LEGACY_SUBSCRIPTIONS = config('LEGACY_SUBSCRIPTIONS', True, cast=bool)
+
+# monthly partitions of the message table are created this many months ahead
+MESSAGE_PARTITION_MONTHS_AHEAD = 3
+
+# messages older than this many days are moved to archive segments, clients can override it, 0 keeps every message
+MESSAGE_ARCHIVE_AFTER_DAYS = 365
+
+# archive segments are gzipped json lines files of at most this many messages under the archive root
+MESSAGE_ARCHIVE_ROOT = os.path.join(BASE_DIR, 'archive')
+MESSAGE_ARCHIVE_SEGMENT_SIZE = 1000
+
+# decoded segments kept in process, archived history pages are read from them
+MESSAGE_ARCHIVE_CACHE_SIZE = 64
+
+# verified tokens are kept in process, revocations in the shared denylist are picked up within the check interval
+VERIFIED_TOKEN_CACHE_SIZE = 10000
+VERIFIED_TOKEN_MAX_SECONDS = 3600
+TOKEN_DENYLIST_CHECK_SECONDS = 5
+
+# tokens are accepted when the denylist does not answer, turn it off to reject them until it is back
+TOKEN_DENYLIST_FAIL_OPEN = config('TOKEN_DENYLIST_FAIL_OPEN', True, cast=bool)
+
 # Cores origin
 CORS_ORIGIN_WHITELIST = [
     "http://localhost:3000",
 ]
 CORS_ORIGIN_ALLOW_ALL = True
 
-DJANGO_ALLOW_ASYNC_UNSAFE = True
+# graphql resolvers run their database calls on a pool of this many threads
+GRAPHQL_DATABASE_THREADS = 8
+GRAPHQL_DATABASE_CONN_MAX_AGE = 600  # seconds a thread of the pool keeps its database connection
+
+# persisted queries, the manifest is a json object of sha256 hash to query
+PERSISTED_QUERIES_MANIFEST = config('PERSISTED_QUERIES_MANIFEST', None)
+PERSISTED_QUERIES_REGISTER = config('PERSISTED_QUERIES_REGISTER', False, cast=bool)  # accept hash and query sent together
+PERSISTED_QUERIES_MAX_SIZE = 1000
+PERSISTED_QUERIES_TIMEOUT_SECONDS = 86400  # registered queries are forgotten a day after registration
+
+# registered queries are kept in their own cache, they are only seen by other processes
+# when it is pointed at a shared backend, the default one is per process
+PERSISTED_QUERIES_CACHE = 'persisted_queries'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    PERSISTED_QUERIES_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'persisted-queries',
+        'OPTIONS': {'MAX_ENTRIES': PERSISTED_QUERIES_MAX_SIZE},
+    },
+}
+
+# parsed and validated documents kept by query text
+GRAPHQL_DOCUMENT_CACHE_SIZE = 500
+
+# static query cost, operations over the budget of the client are rejected before execution
+DEFAULT_MAX_QUERY_COST = 5000
+QUERY_COST_LIST_SIZE = 10  # assumed length of lists that are not paginated
+QUERY_COST_DEFAULT_PAGE_SIZE = 100  # page size of connections when relay has no limit
+
+# token bucket limits of chat mutations as (requests, seconds) per client and per participant,
+# clients can override them with Client.rate_limits
+RATE_LIMITS = {
+    'send_message': {'client': (1200, 60), 'participant': (30, 10)},
+    'typing': {'client': (3000, 60), 'participant': (20, 10)},
+    'user_online': {'client': (3000, 60), 'participant': (10, 10)},
+    'start_conversation': {'client': (300, 60), 'participant': (10, 60)},
+    'mark_read': {'client': (3000, 60), 'participant': (30, 10)},
+    'clear_conversation': {'client': (300, 60), 'participant': (10, 60)},
+}
+RATE_LIMIT_REDIS_URL = config('RATE_LIMIT_REDIS_URL', None)  # buckets are kept in process when empty
+RATE_LIMIT_TIMEOUT_SECONDS = 0.1  # requests are not limited when the store does not answer in time
+RATE_LIMIT_MEMORY_SIZE = 100000
+
+# resolver timings, admins get the profile of an operation in the response extensions by sending the header,
+# a sample of all operations is aggregated for the resolverStats query
+GRAPHQL_PROFILE_HEADER = 'X-GraphQL-Profile'
+GRAPHQL_PROFILE_SAMPLE_RATE = config('GRAPHQL_PROFILE_SAMPLE_RATE', 0.01, cast=float)
+GRAPHQL_PROFILE_MAX_OPERATIONS = 500
+
+# similarity ranked autocomplete of participant and client names
+AUTOCOMPLETE_SIZE = 10
+AUTOCOMPLETE_MAX_SIZE = 50
 
 # graphene config
 GRAPHENE = {
     'SCHEMA': 'mysite.schema.schema',
     'MIDDLEWARE': [
-        'mysite.middlewares.W3AuthMiddleware'
+        'mysite.middlewares.W3AuthMiddleware',
+        'mysite.profiling.ProfilingMiddleware',
     ]
 }
 
@@ -0,0 +1,307 @@
+import json
+import threading
+import types
+import uuid
+from unittest import mock
+
+import jwt
+import redis
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.db import connections
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from graphql import GraphQLError
+from graphql.execution import ExecutionResult
+
+from chat.models import Participant
+from mysite import auth_cache, middlewares, rate_limit
+from mysite.authentication import TokenManager
+from mysite.middlewares import W3AuthMiddleware
+from mysite.permissions import rate_limited
+from mysite.persisted_queries import PersistedQueries, query_hash
+from mysite.rate_limit import get_limits
+from mysite.schema import schema
+from mysite.views import AsyncGraphQLView, database_pool, merge_results
+from users.models import Client, User
+
+
+class MergeResultsTests(SimpleTestCase):
+    """
+        Results of the fields of a split query are merged into one response.
+    """
+
+    def test_data_and_errors_are_merged(self):
+        result = merge_results([ExecutionResult(data={"a": 1}), ExecutionResult(data={"b": 2}, errors=["e"])])
+        self.assertEqual(result.data, {"a": 1, "b": 2})
+        self.assertEqual(result.errors, ["e"])
+        self.assertFalse(result.invalid)
+
+    def test_invalid_field_invalidates_the_result(self):
+        result = merge_results([ExecutionResult(data={"a": 1}), ExecutionResult(errors=["e"], invalid=True)])
+        self.assertTrue(result.invalid)
+        self.assertIsNone(result.data)
+        self.assertEqual(result.errors, ["e"])
+
+
+class SplitQueryCostTests(SimpleTestCase):
+    """
+        The cost budget applies to the operation that runs, not to the first one of the document.
+    """
+    query = """
+        query Cheap { messageCount }
+        query Heavy { messageCount allMessages(first: 100) { edges { node { receiver { name } isFavorite } } } }
+    """
+
+    def post(self, operation_name):
+        def authenticate(request):
+            request.user = AnonymousUser()
+            request.client = types.SimpleNamespace(max_query_cost=50)
+            request._w3_authenticated = True
+
+        request = RequestFactory().post("/graphql/", json.dumps({"query": self.query, "operationName": operation_name}),
+                                        content_type="application/json")
+        with mock.patch.object(W3AuthMiddleware, "authenticate", side_effect=authenticate):
+            return async_to_sync(AsyncGraphQLView.as_view())(request)
+
+    def test_named_operation_is_priced(self):
+        response = self.post("Heavy")
+        self.assertEqual(response.status_code, 400)
+        error = json.loads(response.content)["errors"][0]
+        self.assertEqual(error["extensions"]["code"], "query_too_expensive")
+        self.assertGreater(error["extensions"]["cost"], 50)
+
+
+class DatabasePoolTests(SimpleTestCase):
+    """
+        Root fields of a split query reuse the connections of the pool threads and get their own context.
+    """
+
+    def test_pool_threads_keep_their_connections(self):
+        max_age = database_pool.submit(lambda: connections["default"].settings_dict["CONN_MAX_AGE"]).result()
+        self.assertEqual(max_age, settings.GRAPHQL_DATABASE_CONN_MAX_AGE)
+        self.assertEqual(connections["default"].settings_dict["CONN_MAX_AGE"],
+                         settings.DATABASES["default"].get("CONN_MAX_AGE", 0))
+
+    def test_each_field_gets_its_own_context(self):
+        request = RequestFactory().post("/graphql/")
+        request.user = types.SimpleNamespace(id="participant")
+        view = AsyncGraphQLView()
+        with mock.patch("mysite.views.execute") as execute:
+            view.execute_document(request, None, {})
+            view.execute_document(request, None, {})
+        first, second = [call.kwargs["context_value"] for call in execute.call_args_list]
+        self.assertIsNot(first, request)
+        self.assertIsNot(first, second)
+        self.assertIs(first.user, request.user)
+        first.cached = True
+        self.assertFalse(hasattr(request, "cached"))
+
+
+class RateLimitTests(SimpleTestCase):
+    """
+        Malformed Client.rate_limits entries fall back to the defaults instead of failing the mutation.
+    """
+
+    def limits(self, rate_limits):
+        client = types.SimpleNamespace(pk="client", rate_limits=rate_limits)
+        participant = types.SimpleNamespace(pk="participant")
+        with self.settings(RATE_LIMITS={"send_message": {"client": (100, 10), "participant": (10, 10)}}):
+            return get_limits("send_message", client, participant)
+
+    def test_override_and_turning_off(self):
+        self.assertEqual(self.limits({"send_message": {"participant": [5, 1], "client": None}}),
+                         [("rate-limit:send_message:participant:participant", 5.0, 5.0)])
+
+    def test_invalid_entries_use_the_defaults(self):
+        defaults = self.limits(None)
+        for rate_limits in ({"send_message": {"client": [10, 0]}}, {"send_message": {"client": "x"}},
+                            {"send_message": [1, 2]}, ["send_message"], {"send_message": {"participant": [1, 2, 3]}}):
+            with self.subTest(rate_limits):
+                self.assertEqual(self.limits(rate_limits), defaults)
+
+
+class RateLimitedTests(SimpleTestCase):
+    """
+        Decorated mutations are rejected with the seconds to wait once a bucket is empty,
+        and run when the counter store does not answer.
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.mutate = rate_limited("test")(lambda cls, info, **kwargs: self.calls.append(kwargs))
+        self.info = types.SimpleNamespace(context=types.SimpleNamespace(
+            client=types.SimpleNamespace(pk="client", rate_limits=None), user=types.SimpleNamespace(pk="participant")
+        ))
+        limits = self.settings(RATE_LIMITS={"test": {"participant": (2, 60)}})
+        limits.enable()
+        self.addCleanup(limits.disable)
+
+    def test_empty_bucket_rejects_the_call(self):
+        with mock.patch.object(rate_limit, "buckets", rate_limit.MemoryBuckets()):
+            self.mutate(None, self.info, message="one")
+            self.mutate(None, self.info, message="two")
+            with self.assertRaises(GraphQLError) as raised:
+                self.mutate(None, self.info, message="three")
+        self.assertEqual(raised.exception.extensions["code"], "rate_limited")
+        self.assertEqual(raised.exception.extensions["retry_after"], 30)
+        self.assertEqual(self.calls, [{"message": "one"}, {"message": "two"}])
+
+    def test_unavailable_store_lets_the_call_run(self):
+        with mock.patch.object(rate_limit.buckets, "take", side_effect=redis.ConnectionError):
+            self.mutate(None, self.info, message="one")
+        self.assertEqual(self.calls, [{"message": "one"}])
+
+
+class W3AuthMiddlewareTests(SimpleTestCase):
+    """
+        Authentication runs on the first resolved field of an operation, the other fields reuse it.
+    """
+
+    def test_authenticates_once_per_operation(self):
+        context = types.SimpleNamespace()
+        info = types.SimpleNamespace(context=context)
+        middleware = W3AuthMiddleware()
+        with mock.patch.object(W3AuthMiddleware, "authorize_user", return_value=None) as authorize_user, \
+                mock.patch.object(W3AuthMiddleware, "authorize_client", return_value=("client", "participant")):
+            for field in range(3):
+                self.assertEqual(middleware.resolve(lambda root, info: field, None, info), field)
+        authorize_user.assert_called_once_with(context)
+        self.assertEqual((context.client, context.user), ("client", "participant"))
+
+
+class AuthCacheTests(SimpleTestCase):
+    """
+        Cached participants are dropped when their version changes or is lost,
+        and websocket authentication does not call the cache on the event loop.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.participant = Participant(id=uuid.uuid4(), client_id=uuid.uuid4(), user_id="1", name="alice")
+
+    def test_invalidate_drops_the_entry(self):
+        auth_cache.set_participant(self.participant)
+        self.assertEqual(auth_cache.get_participant(self.participant.client_id, "1").pk, self.participant.pk)
+        auth_cache.invalidate("participant", self.participant.pk)
+        self.assertIsNone(auth_cache.get_participant(self.participant.client_id, "1"))
+
+    def test_lost_version_is_a_miss(self):
+        auth_cache.set_participant(self.participant)
+        cache.delete(auth_cache.version_key("client", self.participant.client_id))  # culled
+        self.assertIsNone(auth_cache.get_participant(self.participant.client_id, "1"))
+
+    def test_channel_cache_runs_off_the_event_loop(self):
+        threads = []
+
+        def lookup(token):
+            threads.append(threading.get_ident())
+            return self.participant
+
+        async def get_user():
+            threads.append(threading.get_ident())
+            return await middlewares.get_user("token")
+
+        with mock.patch("mysite.middlewares.get_channel_participant", side_effect=lookup):
+            self.assertIs(async_to_sync(get_user)(), self.participant)
+        self.assertNotEqual(threads[0], threads[1])
+
+
+class ChannelAuthTests(TransactionTestCase):
+    """
+        Participants served from the channel auth or participant cache come with a fresh last_seen,
+        the consumer reads online status on the event loop.
+    """
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_user("admin", "admin@example.com", "password")
+        client = Client.objects.create(auth_key="key", admin=admin, client_name="client", url="http://example.com")
+        self.participant = Participant.objects.create(client=client, user_id="1", name="alice")
+        self.token = jwt.encode({"client_id": str(client.id), "user_id": "1", "username": "alice"},
+                                settings.CLIENT_KEY, algorithm="HS256")
+
+    def connect(self):
+        async def connect():
+            user = await middlewares.get_user(self.token)
+            return str(user)  # what the consumer prints on connect
+
+        return async_to_sync(connect)()
+
+    def test_channel_cache_hit(self):
+        auth_cache.set_channel_participant(self.token, self.participant)
+        self.assertEqual(self.connect(), "alice : True")
+
+    def test_participant_cache_hit(self):
+        auth_cache.set_participant(self.participant)
+        self.assertEqual(self.connect(), "alice : True")
+
+
+class PersistedQueryTests(SimpleTestCase):
+    """
+        Automatic registration is off unless turned on, registered queries expire from their own cache.
+    """
+
+    query = "{ __typename }"
+
+    def setUp(self):
+        caches[settings.PERSISTED_QUERIES_CACHE].clear()
+        self.persisted_queries = PersistedQueries()
+        self.extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(self.query)}}
+
+    def test_registration_is_off_by_default(self):
+        with self.assertRaises(GraphQLError) as raised:
+            self.persisted_queries.resolve(schema, self.query, self.extensions)
+        self.assertEqual(raised.exception.extensions["code"], "PERSISTED_QUERY_NOT_SUPPORTED")
+
+    @override_settings(PERSISTED_QUERIES_REGISTER=True)
+    def test_registered_queries_expire_from_their_cache(self):
+        registry = caches[settings.PERSISTED_QUERIES_CACHE]
+        with mock.patch.object(registry, "set", wraps=registry.set) as set_query:
+            self.assertEqual(self.persisted_queries.resolve(schema, self.query, self.extensions), self.query)
+        set_query.assert_called_once_with(
+            f"persisted-query:{query_hash(self.query)}", self.query, settings.PERSISTED_QUERIES_TIMEOUT_SECONDS
+        )
+        self.assertIsNone(cache.get(f"persisted-query:{query_hash(self.query)}"))
+        self.assertEqual(PersistedQueries().resolve(schema, None, self.extensions), self.query)
+
+
+class DenylistTests(SimpleTestCase):
+    """
+        Only verified tokens are revoked, revoked tokens are not served from the verified or channel caches,
+        and an unavailable denylist accepts or rejects tokens following TOKEN_DENYLIST_FAIL_OPEN.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.token = TokenManager.get_access({"user_id": 1})
+
+    def test_forged_tokens_are_not_revoked(self):
+        forged = jwt.encode({"user_id": 1}, "not the key", algorithm="HS256")
+        self.assertFalse(TokenManager.revoke_token(forged))
+        self.assertFalse(auth_cache.is_revoked(auth_cache.token_digest(forged)))
+
+    def test_revoked_token_is_rejected(self):
+        self.assertEqual(TokenManager.decode_token(self.token)["user_id"], 1)
+        self.assertTrue(TokenManager.revoke_token(self.token))
+        self.assertIsNone(TokenManager.decode_token(self.token))
+
+    def test_channel_cache_checks_the_denylist(self):
+        participant = Participant(id=uuid.uuid4(), client_id=uuid.uuid4(), user_id="1", name="alice")
+        auth_cache.set_channel_participant(self.token, participant)
+        self.assertEqual(auth_cache.get_channel_participant(self.token).pk, participant.pk)
+        auth_cache.revoke(self.token)
+        self.assertIsNone(auth_cache.get_channel_participant(self.token))
+
+    def test_unavailable_denylist(self):
+        digest = auth_cache.token_digest(self.token)
+        with mock.patch.object(auth_cache.shared, "get", side_effect=redis.ConnectionError):
+            self.assertFalse(auth_cache.is_revoked(digest))
+            with self.settings(TOKEN_DENYLIST_FAIL_OPEN=False):
+                self.assertTrue(auth_cache.is_revoked(digest))
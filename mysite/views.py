@@ -0,0 +1,253 @@
+import asyncio
+import copy
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.http import HttpResponse, HttpResponseBadRequest
+from graphene_django.views import HttpError
+from graphene_file_upload.django import FileUploadGraphQLView
+from graphql import GraphQLError, execute
+from graphql.execution import ExecutionResult
+from graphql.language import ast
+from graphql.validation import validate
+
+from mysite.middlewares import W3AuthMiddleware
+from mysite.persisted_queries import persisted_queries
+from mysite.profiling import operation_label, start_profile
+from mysite.query_cost import check_query_cost
+
+
+def keep_connections():
+    """
+        Threads of the pool live as long as the process, their connections are reused across requests
+        for GRAPHQL_DATABASE_CONN_MAX_AGE instead of being opened for every root field.
+    """
+    for alias in connections:
+        connection = connections[alias]  # own wrapper of this thread
+        connection.settings_dict = {**connection.settings_dict,
+                                    'CONN_MAX_AGE': settings.GRAPHQL_DATABASE_CONN_MAX_AGE}
+
+
+# every database call of the GraphQL endpoint runs on one of these threads
+database_pool = ThreadPoolExecutor(max_workers=settings.GRAPHQL_DATABASE_THREADS, thread_name_prefix="graphql",
+                                   initializer=keep_connections)
+
+
+def closing_connections(func, *args, **kwargs):
+    """
+        Run a call on a pool thread and close its connections when they broke or are older than their max age.
+    """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_in_pool(func, *args, **kwargs):
+    return await sync_to_async(closing_connections, thread_sensitive=False, executor=database_pool)(
+        func, *args, **kwargs
+    )
+
+
+def split_root_fields(document_ast, operation_name=None):
+    """
+        Split a query into one document per root field, so the fields can be executed concurrently.
+        Return None for mutations, single field queries and selections that can not be split.
+    """
+    operations = [
+        definition for definition in document_ast.definitions
+        if isinstance(definition, ast.OperationDefinition)
+        and (not operation_name or (definition.name and definition.name.value == operation_name))
+    ]
+    if len(operations) != 1 or operations[0].operation != "query":
+        return None
+    operation = operations[0]
+    selections = operation.selection_set.selections
+    if len(selections) < 2 or not all(isinstance(selection, ast.Field) for selection in selections):
+        return None
+    response_names = [(selection.alias or selection.name).value for selection in selections]
+    if len(set(response_names)) != len(response_names):
+        return None  # repeated fields are merged by the executor
+    fragments = [definition for definition in document_ast.definitions
+                 if isinstance(definition, ast.FragmentDefinition)]
+    return [
+        ast.Document(definitions=[ast.OperationDefinition(
+            operation="query",
+            name=operation.name,
+            variable_definitions=operation.variable_definitions,
+            directives=operation.directives,
+            selection_set=ast.SelectionSet(selections=[selection]),
+        )] + fragments)
+        for selection in selections
+    ]
+
+
+def merge_results(results):
+    """
+        One result of the fields of a split query, invalid when one of the fields could not be executed.
+    """
+    data = {}
+    errors = []
+    for result in results:
+        errors.extend(result.errors or [])
+        if data is not None:
+            data = None if result.data is None else {**data, **result.data}
+    if any(result.invalid for result in results):
+        return ExecutionResult(errors=errors, invalid=True)  # answered with 400 like the unsplit view
+    return ExecutionResult(data=data, errors=errors or None)
+
+
+class AsyncGraphQLView(FileUploadGraphQLView):
+    """
+        GraphQL view for ASGI.
+        Root fields of a query are executed concurrently on the database thread pool,
+        mutations, batches and graphiql go through the sync view on the same pool.
+        Operations over the query cost budget of the client are rejected before execution.
+        Profiled operations return their resolver timings in the response extensions.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        super().as_view(**initkwargs)  # validate the arguments
+
+        async def view(request, *args, **kwargs):
+            self = cls(**initkwargs)
+            self.setup(request, *args, **kwargs)
+            return await self.dispatch_async(request, *args, **kwargs)
+
+        view.view_class = cls
+        view.view_initkwargs = initkwargs
+        view.csrf_exempt = True  # csrf_exempt() would hide the coroutine function from django
+        return view
+
+    async def dispatch_async(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post") or self.batch:
+                return await run_in_pool(self.dispatch, request, *args, **kwargs)
+
+            data = self.parse_body(request)
+            try:
+                data = self.resolve_persisted_query(request, data)
+            except GraphQLError as e:
+                status_code = 200 if e.extensions["code"] == "PERSISTED_QUERY_NOT_FOUND" else 400
+                return HttpResponse(status=status_code, content=self.json_encode(
+                    request, {"errors": [self.format_error(e)]}), content_type="application/json")
+            if self.graphiql and self.can_display_graphiql(request, data):
+                return await run_in_pool(self.dispatch, request, *args, **kwargs)
+
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+            try:
+                document = self.get_backend(request).document_from_string(self.schema, query) if query else None
+            except Exception:
+                document = None  # the sync view reports syntax errors
+            documents = document and split_root_fields(document.document_ast, operation_name)
+            if not documents:
+                result, status_code = await run_in_pool(self.get_response, request, data)
+            else:
+                result, status_code = await self.get_split_response(request, document, documents, variables,
+                                                                    operation_name)
+
+            return HttpResponse(status=status_code, content=result, content_type="application/json")
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(request, {"errors": [self.format_error(e)]})
+            return response
+
+    def resolve_persisted_query(self, request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        query = persisted_queries.resolve(self.schema, request.GET.get("query") or data.get("query"), extensions)
+        return {**data, "query": query} if query else data
+
+    async def get_split_response(self, request, document, documents, variables, operation_name=None):
+        validation_errors = getattr(document, "validation_errors", None)
+        if validation_errors is None:
+            validation_errors = validate(self.schema, document.document_ast)
+        if validation_errors:
+            execution_result = ExecutionResult(errors=validation_errors, invalid=True)
+        else:
+            # authenticate once before the fields share the request
+            execution_result = await run_in_pool(self.check_cost, request, document, operation_name, variables)
+        if execution_result is None:
+            profile = start_profile(request, operation_label(document.document_ast, operation_name))
+            execution_result = merge_results(await asyncio.gather(*[
+                run_in_pool(self.execute_document, request, document, variables) for document in documents
+            ]))
+            if profile:
+                profile.finish()
+
+        response = {}
+        status_code = 200
+        if execution_result.errors:
+            response["errors"] = [self.format_error(e) for e in execution_result.errors]
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response["data"] = execution_result.data
+        return self.json_encode(request, response), status_code
+
+    def check_cost(self, request, document, operation_name, variables):
+        """
+            Authenticate the request and return an error result when the operation is over the client budget.
+        """
+        W3AuthMiddleware.authenticate(request)
+        try:
+            check_query_cost(self.schema, document.document_ast, operation_name, variables,
+                             getattr(request, "client", None))
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e], invalid=True)
+        return None
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        if query:
+            try:
+                document = self.get_backend(request).document_from_string(self.schema, query)
+            except Exception:
+                document = None  # reported by the graphql view
+            if document is not None and not getattr(document, "validation_errors", None):
+                result = self.check_cost(request, document, operation_name, variables)
+                if result is not None:
+                    return result
+                profile = start_profile(request, operation_label(document.document_ast, operation_name))
+                try:
+                    return super().execute_graphql_request(
+                        request, data, query, variables, operation_name, show_graphiql
+                    )
+                finally:
+                    if profile:
+                        profile.finish()
+        return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+
+    def json_encode(self, request, d, pretty=False):
+        profile = getattr(request, "profile", None)
+        if profile and profile.report and profile.duration is not None:
+            d = {**d, "extensions": {**d.get("extensions", {}), "profile": profile.as_dict()}}
+        return super().json_encode(request, d, pretty)
+
+    def execute_document(self, request, document, variables):
+        """
+            Execute one root field of a split query.
+            Fields run at the same time on different threads, each gets a shallow copy of the request as context,
+            so attributes set by resolvers stay with their field. User, client and profile are shared and
+            only read, the profile locks its own updates.
+        """
+        try:
+            return execute(
+                self.schema,
+                document,
+                root_value=self.get_root_value(request),
+                context_value=copy.copy(self.get_context(request)),
+                variable_values=variables,
+                middleware=self.get_middleware(request),
+            )
+        except Exception as e:
+            return ExecutionResult(errors=[e], invalid=True)
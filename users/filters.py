@@ -1,15 +1,20 @@
 import django_filters as filters
 from django.contrib.auth import get_user_model
 
-from bases.filters import BaseFilters
+from bases.filters import BaseFilters, DayFilter
 from users.models import Client, UnitOfHistory
 
 User = get_user_model()
 
 
 class UserFilters(BaseFilters):
-    username = filters.CharFilter(field_name="username", lookup_expr="icontains")
-    email = filters.CharFilter(field_name="username", lookup_expr="icontains")
+    username = filters.CharFilter(field_name="username", lookup_expr="trigram_contains")
+    email = filters.CharFilter(field_name="email", lookup_expr="trigram_contains")
+
+    order_by_fields = {
+        'username': ('username',),
+        'email': ('email',),
+    }
 
     class Meta:
         model = User
@@ -33,6 +38,11 @@ class LogsFilters(BaseFilters):
         lookup_expr='icontains'
     )
 
+    order_by_fields = {
+        'id': ('id',),
+        'created_on': ('id',),  # ids follow creation time, the primary key gives the order
+    }
+
     class Meta:
         model = UnitOfHistory
         fields = [
@@ -45,21 +55,25 @@ class LogsFilters(BaseFilters):
 class ClientFilters(BaseFilters):
     client_name = filters.CharFilter(
         field_name='client_name',
-        lookup_expr='icontains'
+        lookup_expr='trigram_contains'
     )
     admin = filters.CharFilter(
         field_name='admin__username',
-        lookup_expr='icontains'
+        lookup_expr='trigram_contains'
     )
-    created_on = filters.CharFilter(
-        field_name='created_on__date',
+    created_on = DayFilter(
+        field_name='created_on',
         lookup_expr='exact'
     )
-    updated_on = filters.CharFilter(
-        field_name='updated_on__date',
+    updated_on = DayFilter(
+        field_name='updated_on',
         lookup_expr='exact'
     )
 
+    order_by_fields = {
+        'client_name': ('client_name',),
+    }
+
     class Meta:
         model = Client
         fields = [
@@ -24,7 +24,8 @@ class ClientForm(forms.ModelForm):
 
     class Meta:
         model = Client
-        exclude = ('auth_key', 'admin', 'employee', 'block_offensive_word', 'restrict_re_format')
+        exclude = ('auth_key', 'admin', 'employee', 'block_offensive_word', 'restrict_re_format',
+                   'max_query_cost', 'rate_limits', 'archive_after_days')
 
 
 class ClientEmployeeForm(forms.ModelForm):
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_auto_20210929_1008'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='max_query_cost',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
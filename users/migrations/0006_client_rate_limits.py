@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_client_max_query_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='rate_limits',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractUser, PermissionsMixin
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 from bases.models import BaseModel
@@ -50,6 +51,10 @@ class User(AbstractUser, PermissionsMixin):
 
     class Meta:
         db_table = f"{settings.DB_PREFIX}_users"
+        indexes = [
+            GinIndex(fields=['username'], name='user_username_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['email'], name='user_email_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]  # substring and similarity search of admin lookups
         # unique = ['email',]
         # ordering = ['-id']  # define default order as id in descending
 
@@ -87,10 +92,16 @@ class Client(BaseModel):
     url = models.URLField(max_length=64)  # client website url
     block_offensive_word = models.BooleanField(default=False)
     restrict_re_format = models.BooleanField(default=False)
+    max_query_cost = models.PositiveIntegerField(blank=True, null=True)  # query cost budget, default if empty
+    rate_limits = models.JSONField(blank=True, null=True)  # overrides of RATE_LIMITS by action and scope
+    archive_after_days = models.PositiveIntegerField(blank=True, null=True)  # message archive age, default if empty, 0 keeps all
 
     class Meta:
         db_table = f"{settings.DB_PREFIX}_clients"
         ordering = ['-created_on']  # define default order as creation time in descending
+        indexes = [
+            GinIndex(fields=['client_name'], name='client_name_trgm_idx', opclasses=['gin_trgm_ops']),
+        ]  # substring and similarity search of admin lookups
 
     def __str__(self):
         return self.client_name
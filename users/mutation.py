@@ -6,6 +6,7 @@ from graphene_django.forms.mutation import DjangoFormMutation
 from graphql import GraphQLError
 
 from bases.utils import create_token, generate_auth_key
+from mysite.auth_cache import invalidate
 from mysite.authentication import TokenManager
 from mysite.permissions import is_authenticated
 from users.choices import IdentifierBaseChoice, RoleChoice
@@ -46,6 +47,23 @@ class LoginUser(graphene.Mutation):
         )
 
 
+class LogoutUser(graphene.Mutation):
+    """
+        Revoke the access token of the request and the given refresh token.
+    """
+    success = graphene.Boolean()
+
+    class Arguments:
+        refresh = graphene.String()
+
+    @is_authenticated
+    def mutate(self, info, refresh=None):
+        TokenManager.revoke_token(info.context.headers["AUTHORIZATION"][4:])
+        if refresh:
+            TokenManager.revoke_token(refresh)
+        return LogoutUser(success=True)
+
+
 class RegisterUser(DjangoFormMutation):
     success = graphene.Boolean()
     message = graphene.String()
@@ -331,6 +349,7 @@ class ClientMutation(DjangoFormMutation):
             if client_exist:
                 client = client_exist.last()
                 client_exist.update(**form.cleaned_data)
+                invalidate('client', client.pk)
             else:
                 form.cleaned_data = form.cleaned_data.copy()
                 form.cleaned_data['admin'] = user
@@ -461,6 +480,7 @@ class DeleteClientEmployee(graphene.Mutation):
 
 class Mutation(graphene.ObjectType):
     login_user = LoginUser.Field()
+    logout_user = LogoutUser.Field()
     register_user = RegisterUser.Field()
     verify_email = VerifyEmail.Field()
     resend_activation_mail = ResendActivationMail.Field()
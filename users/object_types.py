@@ -51,3 +51,17 @@ class ClientType(DjangoObjectType):
     @staticmethod
     def resolve_object_id(self, info, **kwargs):
         return self.pk
+
+
+class ResolverStatType(graphene.ObjectType):
+    """
+        Aggregated timing of a field in the sampled operations of this process.
+    """
+    operation_name = graphene.String()
+    field = graphene.String()
+    operations = graphene.Int()  # sampled operations
+    calls = graphene.Int()
+    duration_ms = graphene.Float()
+    sql_queries = graphene.Int()
+    sql_duration_ms = graphene.Float()
+    share = graphene.Float()  # part of the operation time spent in the field
@@ -4,9 +4,11 @@ from django.contrib.auth import get_user_model
 from graphene_django.filter import DjangoFilterConnectionField
 from graphql import GraphQLError
 
+from bases.lookups import autocomplete
 from mysite.permissions import is_admin_user, is_authenticated
+from mysite.profiling import resolver_stats
 from users.models import Client, UnitOfHistory
-from users.object_types import ClientType, LogType, UserType
+from users.object_types import ClientType, LogType, ResolverStatType, UserType
 
 User = get_user_model()
 
@@ -18,7 +20,9 @@ class Query(graphene.ObjectType):
     log = graphene.relay.Node.Field(LogType)
     clients = DjangoFilterConnectionField(ClientType)
     client = graphene.relay.Node.Field(ClientType)
+    client_autocomplete = graphene.List(ClientType, search=graphene.String(required=True), first=graphene.Int())
     me = graphene.Field(UserType)
+    resolver_stats = graphene.List(ResolverStatType, operation_name=graphene.String())
 
     @is_authenticated
     def resolve_me(self, info, **kwargs):
@@ -40,6 +44,14 @@ class Query(graphene.ObjectType):
     def resolve_clients(self, info, **kwargs):
         return Client.objects.all()
 
+    @is_admin_user
+    def resolve_client_autocomplete(self, info, search, first=None, **kwargs):
+        return autocomplete(Client.objects.all(), 'client_name', search, first)
+
     @is_admin_user
     def resolve_logs(self, info, **kwargs):
         return UnitOfHistory.objects.all()
+
+    @is_admin_user
+    def resolve_resolver_stats(self, info, operation_name=None, **kwargs):
+        return [ResolverStatType(**row) for row in resolver_stats.rows(operation_name)]